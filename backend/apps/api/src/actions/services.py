@@ -1,19 +1,22 @@
 import os
-import smtplib
+import asyncio
 import requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.utils import make_msgid
 from typing import Dict, Any, List
 from datetime import datetime
 from fastapi import HTTPException
+from ..shared_smtp import get_smtp_pool, SMTPPoolExhausted
+
+# One pooled session for all integration calls made by the API process
+http_session = requests.Session()
 
 class ActionService:
     def __init__(self):
         # Initialize clients with environment variables
         self.slack_token = os.getenv("SLACK_BOT_TOKEN")
         self.google_credentials = os.getenv("GOOGLE_CREDENTIALS")
-        self.smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-        self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
         self.smtp_username = os.getenv("SMTP_USERNAME")
         self.smtp_password = os.getenv("SMTP_PASSWORD")
         self.notion_token = os.getenv("NOTION_TOKEN")
@@ -39,10 +42,12 @@ class ActionService:
                 "Content-Type": "application/json"
             }
             
-            response = requests.post(
+            response = await asyncio.to_thread(
+                http_session.post,
                 "https://slack.com/api/chat.postMessage",
                 headers=headers,
-                json=payload
+                json=payload,
+                timeout=10
             )
             
             response.raise_for_status()
@@ -78,12 +83,16 @@ class ActionService:
                 "values": values
             }
             
-            response = requests.post(
+            response = await asyncio.to_thread(
+                http_session.post,
                 f"https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values/{range}:append",
                 headers=headers,
                 json=payload,
-                params={"valueInputOption": "RAW"}
+                params={"valueInputOption": "RAW"},
+                timeout=30
             )
+            if response.status_code == 429:
+                raise HTTPException(status_code=429, detail="Google Sheets quota exceeded, retry later")
             
             response.raise_for_status()
             result = response.json()
@@ -120,22 +129,20 @@ class ActionService:
                 html_part = MIMEText(html_body, 'html')
                 msg.attach(html_part)
             
-            # Send email
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.smtp_username, self.smtp_password)
+            msg['Message-ID'] = make_msgid()
             
-            text = msg.as_string()
-            server.sendmail(self.smtp_username, to, text)
-            server.quit()
+            # Send over a pooled session off the event loop; recipients go out in batches
+            await asyncio.to_thread(get_smtp_pool().send_message, msg, self.smtp_username, to)
             
             return {
-                "message_id": f"msg_{datetime.utcnow().timestamp()}",
+                "message_id": msg['Message-ID'],
                 "to": to,
                 "subject": subject,
                 "sent_at": datetime.utcnow()
             }
             
+        except SMTPPoolExhausted as e:
+            raise HTTPException(status_code=503, detail=f"Email sending is busy: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error sending email: {str(e)}")
     
@@ -1,18 +1,16 @@
 import os
 import random
 import string
-import smtplib
 from datetime import datetime, timedelta
 from typing import Dict, Optional
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from ..shared_smtp import get_smtp_pool
 
 # In-memory storage for magic codes (in production, use Redis or database)
 magic_codes: Dict[str, Dict] = {}
 
-# Email configuration
-SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+# Email configuration (host/port are read by the shared SMTP pool)
 SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 FROM_EMAIL = os.getenv("FROM_EMAIL", "noreply@aiwf.local")
@@ -23,7 +21,7 @@ def generate_magic_code() -> str:
     return ''.join(random.choices(string.digits, k=6))
 
 def send_email(to_email: str, subject: str, body: str) -> bool:
-    """Send email using SMTP"""
+    """Send email over a pooled SMTP session"""
     try:
         if not SMTP_USERNAME or not SMTP_PASSWORD:
             print(f"[EMAIL] No SMTP credentials configured, skipping email to {to_email}")
@@ -36,12 +34,7 @@ def send_email(to_email: str, subject: str, body: str) -> bool:
         
         msg.attach(MIMEText(body, 'plain'))
         
-        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(FROM_EMAIL, to_email, text)
-        server.quit()
+        get_smtp_pool().send_message(msg, FROM_EMAIL, [to_email])
         
         print(f"[EMAIL] Magic code sent to {to_email}")
         return True
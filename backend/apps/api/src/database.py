@@ -1,7 +1,9 @@
 import os
+import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
 from typing import Optional
+from .shared_indexes import apply_indexes
 
 class Database:
     client: Optional[AsyncIOMotorClient] = None
@@ -17,6 +19,9 @@ class Database:
         # Test connection
         await cls.client.admin.command('ping')
         print("✅ Connected to MongoDB")
+        
+        # Every index in the registry (shared_indexes.py); changed definitions are only reported
+        await asyncio.to_thread(apply_indexes, cls.sync_client.aiwf)
 
     @classmethod
     async def close_db(cls):
@@ -45,10 +50,30 @@ def get_workflows_collection():
     """Get workflows collection"""
     return Database.get_db().workflows
 
+def get_workflow_versions_collection():
+    """Get workflow versions collection"""
+    return Database.get_db().workflow_versions
+
 def get_runs_collection():
     """Get runs collection"""
     return Database.get_db().runs
 
+def get_schedules_collection():
+    """Get schedules collection"""
+    return Database.get_db().schedules
+
+def get_run_batches_collection():
+    """Get run batches collection"""
+    return Database.get_db().run_batches
+
 def get_users_collection():
     """Get users collection"""
-    return Database.get_db().users 
\ No newline at end of file
+    return Database.get_db().users
+
+def get_uploaded_files_collection():
+    """Get uploaded files collection"""
+    return Database.get_db().uploaded_files
+
+def get_upload_sessions_collection():
+    """Get upload sessions collection"""
+    return Database.get_db().upload_sessions
@@ -0,0 +1,31 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Request
+from .services import webhook_registry, buffer_event, WEBHOOK_MAX_BYTES
+
+router = APIRouter()
+
+@router.post("/{workflow_id}/{token}", status_code=202)
+async def trigger_webhook(workflow_id: str, token: str, request: Request):
+    """Accept an event for a workflow's webhook trigger.
+
+    The token is checked against cached settings and the raw body is buffered in Redis; the
+    worker creates the run(s), so the caller never waits on MongoDB or the workflow itself.
+    """
+    hook = await webhook_registry.authenticate(workflow_id, token)
+    if not hook:
+        raise HTTPException(status_code=404, detail="Webhook not found")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > WEBHOOK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    body = await request.body()
+    if len(body) > WEBHOOK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Payload too large")
+
+    try:
+        await asyncio.to_thread(buffer_event, workflow_id, hook, body, request.headers.get("content-type"))
+    except Exception as e:
+        print(f"Failed to buffer webhook event for workflow {workflow_id}: {e}")
+        raise HTTPException(status_code=503, detail="Webhook buffer unavailable")
+
+    return {"accepted": True}
@@ -0,0 +1,109 @@
+import os
+import hmac
+import json
+import time
+import hashlib
+from typing import Optional, Dict, Any, Tuple
+import dramatiq
+from bson import ObjectId
+from ..database import get_workflows_collection
+from ..shared_broker import (
+    redis_broker, lane_queue, WEBHOOK_EVENTS_KEY, WEBHOOK_DRAIN_KEY, WEBHOOK_DUE_KEY, WEBHOOK_BUFFER_MAX
+)
+
+# Seconds a workflow's webhook settings are served from memory; a rotated or disabled
+# token keeps working on other API replicas for at most this long
+WEBHOOK_CACHE_TTL = float(os.getenv("WEBHOOK_CACHE_TTL", "30"))
+WEBHOOK_CACHE_MAX = int(os.getenv("WEBHOOK_CACHE_MAX", "10000"))
+WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", str(256 * 1024)))
+# A pending drain whose message was lost stops blocking new drains after this long
+WEBHOOK_DRAIN_GRACE_MS = 60_000
+
+# Append an event to the capped buffer, record the debounce deadline and claim the drain.
+# Returns 1 when the caller must enqueue drain_webhook_events.
+# KEYS: events, drain flag, due   ARGV: event, max length, flag ttl ms, now ms, due ms or ""
+_BUFFER_EVENT = """
+redis.call('rpush', KEYS[1], ARGV[1])
+redis.call('ltrim', KEYS[1], -tonumber(ARGV[2]), -1)
+if ARGV[5] ~= '' then
+    redis.call('set', KEYS[3], ARGV[5], 'PX', ARGV[3])
+end
+if redis.call('set', KEYS[2], ARGV[4], 'NX', 'PX', ARGV[3]) then
+    return 1
+end
+return 0
+"""
+_buffer_event = redis_broker.client.register_script(_BUFFER_EVENT)
+
+
+def hash_webhook_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class WebhookRegistry:
+    """In-process TTL cache of webhook settings, so triggers are authenticated without a DB read"""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+
+    async def get(self, workflow_id: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        entry = self._entries.get(workflow_id)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        hook = None
+        if ObjectId.is_valid(workflow_id):
+            workflow = await get_workflows_collection().find_one(
+                {"_id": ObjectId(workflow_id)}, {"webhook": 1, "is_active": 1}
+            )
+            if workflow and workflow.get("is_active", True):
+                hook = workflow.get("webhook")
+        # Unknown workflows are cached too, so guessing ids cannot hammer the database
+        if len(self._entries) >= WEBHOOK_CACHE_MAX:
+            self._entries.clear()
+        self._entries[workflow_id] = (now + WEBHOOK_CACHE_TTL, hook)
+        return hook
+
+    def invalidate(self, workflow_id: str):
+        self._entries.pop(workflow_id, None)
+
+    async def authenticate(self, workflow_id: str, token: str) -> Optional[Dict[str, Any]]:
+        hook = await self.get(workflow_id)
+        if not hook or not hmac.compare_digest(hook["token_hash"], hash_webhook_token(token)):
+            return None
+        return hook
+
+
+webhook_registry = WebhookRegistry()
+
+
+def buffer_event(workflow_id: str, hook: Dict[str, Any], body: bytes, content_type: Optional[str]):
+    """Buffer one webhook event; the first event of a window schedules the drain that starts runs"""
+    now_ms = int(time.time() * 1000)
+    window_ms = hook.get("window_ms", 0)
+    debounce = hook.get("mode") == "debounce"
+    event = json.dumps({
+        "received_at": now_ms / 1000,
+        "content_type": content_type,
+        "body": body.decode("utf-8", errors="replace")
+    })
+    claimed = _buffer_event(
+        keys=[WEBHOOK_EVENTS_KEY.format(workflow_id), WEBHOOK_DRAIN_KEY.format(workflow_id),
+              WEBHOOK_DUE_KEY.format(workflow_id)],
+        args=[event, WEBHOOK_BUFFER_MAX, window_ms + WEBHOOK_DRAIN_GRACE_MS, now_ms,
+              now_ms + window_ms if debounce else ""]
+    )
+    if not claimed:
+        # A drain is already scheduled and will pick this event up
+        return
+
+    lane = hook.get("lane", "manual")
+    message = dramatiq.Message(
+        queue_name=lane_queue("default", lane),
+        actor_name="drain_webhook_events",
+        args=[workflow_id],
+        kwargs={},
+        options={"lane": lane}
+    )
+    redis_broker.enqueue(message, delay=window_ms or None)
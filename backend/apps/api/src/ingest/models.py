@@ -1,5 +1,5 @@
-from pydantic import BaseModel, HttpUrl
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, HttpUrl, Field
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 class UploadResponse(BaseModel):
@@ -33,4 +33,26 @@ class WebhookResponse(BaseModel):
     document_id: str
     source: str
     processed: bool
-    created_at: datetime 
\ No newline at end of file
+    created_at: datetime 
+class UploadInit(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    size: Optional[int] = Field(default=None, ge=0, description="Total size in bytes, checked on completion")
+    sha256: Optional[str] = Field(default=None, description="Whole-file SHA-256; a match with an earlier upload of yours skips the transfer")
+
+class UploadPart(BaseModel):
+    part_number: int
+    size: int
+    sha256: str
+
+class UploadSession(BaseModel):
+    upload_id: str
+    filename: str
+    status: str
+    part_size_max: int
+    parts: List[UploadPart] = Field(default_factory=list, description="Parts received so far; resume from the first gap")
+    file_id: Optional[str] = None
+    sha256: Optional[str] = None
+    deduplicated: bool = False
+    created_at: datetime
+    expires_at: datetime
@@ -1,73 +1,255 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, Header
+from typing import Optional
 from ..auth.router import get_current_user
 from ..auth.models import User
+from ..database import get_uploaded_files_collection, get_upload_sessions_collection
+from .models import UploadInit, UploadSession, UploadPart
+from . import uploads
+from ..shared_storage import get_storage
+from ..shared_broker import (
+    redis_broker, lane_queue, ingest_throughput, LANES, DEFAULT_LANE, INGEST_PROGRESS_CHANNEL
+)
+from fastapi.responses import StreamingResponse
+import dramatiq
 import os
-import shutil
+import json
+import asyncio
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 router = APIRouter()
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = "/tmp/aiwf_uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+def uploaded_file_doc(file_id: str, filename: str, content_type: str, sha256: str, size: int, storage_key: str,
+                      current_user: User):
+    return {
+        "file_id": file_id,
+        "original_filename": filename,
+        "stored_filename": sha256,
+        "storage_key": storage_key,
+        # Only set for local storage; readers should go through storage_key
+        "file_path": get_storage().local_path(storage_key),
+        "file_size": size,
+        "sha256": sha256,
+        "content_type": content_type,
+        "uploaded_by": current_user.id,
+        "uploaded_at": datetime.utcnow(),
+        "status": "uploaded"
+    }
 
 @router.post("/upload")
 async def upload(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
 ):
-    """Upload and store file for processing"""
+    """Upload and store file for processing (single request; use /uploads for large files)"""
     try:
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else ""
-        stored_filename = f"{file_id}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, stored_filename)
-        
-        # Save file to disk
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Store file metadata in database
-        from ..database import Database
-        db = Database.get_sync_db()
+        # Copied and hashed in a thread, block by block, so the event loop keeps serving
+        sha256, size, storage_key = await asyncio.to_thread(uploads.store_file, file.file)
         
-        file_doc = {
-            "file_id": file_id,
-            "original_filename": file.filename,
-            "stored_filename": stored_filename,
-            "file_path": file_path,
-            "file_size": os.path.getsize(file_path),
-            "content_type": file.content_type,
-            "uploaded_by": current_user.id,
-            "uploaded_at": datetime.utcnow(),
-            "status": "uploaded"
-        }
-        
-        result = db.uploaded_files.insert_one(file_doc)
+        file_id = str(uuid.uuid4())
+        file_doc = uploaded_file_doc(file_id, file.filename, file.content_type, sha256, size, storage_key,
+                                     current_user)
+        await get_uploaded_files_collection().insert_one(file_doc)
         
         return {
             "document_id": file_id,
             "filename": file.filename,
-            "file_path": file_path,
-            "file_size": os.path.getsize(file_path),
+            "file_path": file_doc["file_path"],
+            "storage_key": storage_key,
+            "file_size": size,
+            "sha256": sha256,
             "status": "uploaded"
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
 
+def upload_session_from_doc(doc) -> UploadSession:
+    return UploadSession(
+        upload_id=doc["upload_id"],
+        filename=doc["filename"],
+        status=doc["status"],
+        part_size_max=uploads.UPLOAD_PART_MAX,
+        parts=sorted(
+            (UploadPart(part_number=int(n), size=p["size"], sha256=p["sha256"]) for n, p in doc.get("parts", {}).items()),
+            key=lambda part: part.part_number
+        ),
+        file_id=doc.get("file_id"),
+        sha256=doc.get("sha256"),
+        deduplicated=doc.get("deduplicated", False),
+        created_at=doc["created_at"],
+        expires_at=doc["expires_at"]
+    )
+
+async def get_owned_upload(upload_id: str, current_user: User):
+    doc = await get_upload_sessions_collection().find_one({"upload_id": upload_id})
+    if not doc or doc["uploaded_by"] != current_user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return doc
+
+@router.post("/uploads", response_model=UploadSession)
+async def init_upload(
+    upload_init: UploadInit,
+    current_user: User = Depends(get_current_user)
+):
+    """Start a resumable upload; send parts with PUT /uploads/{upload_id}/parts/{n}, then complete it"""
+    now = datetime.utcnow()
+    session = {
+        "upload_id": str(uuid.uuid4()),
+        "uploaded_by": current_user.id,
+        "filename": upload_init.filename,
+        "content_type": upload_init.content_type,
+        "size": upload_init.size,
+        "parts": {},
+        "status": "uploading",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=uploads.UPLOAD_SESSION_TTL)
+    }
+    
+    if upload_init.sha256:
+        # Only your own files count, so a hash alone never grants access to someone else's content
+        existing = await get_uploaded_files_collection().find_one(
+            {"uploaded_by": current_user.id, "sha256": upload_init.sha256.lower()}
+        )
+        if existing:
+            session.update({"status": "completed", "file_id": existing["file_id"],
+                            "sha256": existing["sha256"], "deduplicated": True})
+            await get_upload_sessions_collection().insert_one(session)
+            return upload_session_from_doc(session)
+    
+    await asyncio.to_thread(uploads.sweep_stale_parts)
+    uploads.start_upload(session["upload_id"])
+    await get_upload_sessions_collection().insert_one(session)
+    return upload_session_from_doc(session)
+
+@router.get("/uploads/{upload_id}", response_model=UploadSession)
+async def get_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Upload progress; a client resuming after a failure re-sends the missing parts"""
+    return upload_session_from_doc(await get_owned_upload(upload_id, current_user))
+
+@router.put("/uploads/{upload_id}/parts/{part_number}", response_model=UploadPart)
+async def upload_part(
+    upload_id: str,
+    part_number: int,
+    request: Request,
+    content_sha256: Optional[str] = Header(None, alias="x-content-sha256"),
+    current_user: User = Depends(get_current_user)
+):
+    """Receive one part as the raw request body, streamed to disk; re-sending a part replaces it"""
+    session = await get_owned_upload(upload_id, current_user)
+    if session["status"] != "uploading":
+        raise HTTPException(status_code=409, detail=f"Upload is {session['status']}")
+    if not 1 <= part_number <= uploads.UPLOAD_MAX_PARTS:
+        raise HTTPException(status_code=400, detail=f"Part number must be between 1 and {uploads.UPLOAD_MAX_PARTS}")
+    
+    try:
+        size, sha256 = await uploads.receive_part(upload_id, part_number, request.stream(), content_sha256)
+    except uploads.PartTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except uploads.PartChecksumMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    await get_upload_sessions_collection().update_one(
+        {"upload_id": upload_id},
+        {"$set": {f"parts.{part_number}": {"size": size, "sha256": sha256}}}
+    )
+    return UploadPart(part_number=part_number, size=size, sha256=sha256)
+
+@router.post("/uploads/{upload_id}/complete", response_model=UploadSession)
+async def complete_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Assemble the parts (1..n, no gaps) into the stored file, deduplicating identical content"""
+    collection = get_upload_sessions_collection()
+    session = await get_owned_upload(upload_id, current_user)
+    if session["status"] == "completed":
+        return upload_session_from_doc(session)
+    
+    if session["status"] == "assembled":
+        # An earlier attempt stored the file but failed to register it; the parts are gone
+        claimed = await collection.update_one(
+            {"upload_id": upload_id, "status": "assembled"}, {"$set": {"status": "assembling"}}
+        )
+        if not claimed.modified_count:
+            raise HTTPException(status_code=409, detail="Upload is already being completed")
+        assembled = session["assembled"]
+    else:
+        part_numbers = sorted(int(n) for n in session.get("parts", {}))
+        if not part_numbers or part_numbers != list(range(1, len(part_numbers) + 1)):
+            raise HTTPException(status_code=400, detail="Parts must be numbered 1..n without gaps")
+        total = sum(part["size"] for part in session["parts"].values())
+        if session.get("size") is not None and total != session["size"]:
+            raise HTTPException(status_code=400, detail=f"Received {total} bytes, expected {session['size']}")
+        
+        # Claim completion so a concurrent retry does not assemble twice
+        claimed = await collection.update_one(
+            {"upload_id": upload_id, "status": "uploading"}, {"$set": {"status": "assembling"}}
+        )
+        if not claimed.modified_count:
+            raise HTTPException(status_code=409, detail="Upload is already being completed")
+        
+        try:
+            sha256, size, storage_key = await asyncio.to_thread(
+                uploads.assemble_parts, upload_id, len(part_numbers), uploads.running_digest(upload_id, len(part_numbers))
+            )
+        except Exception as e:
+            await collection.update_one({"upload_id": upload_id}, {"$set": {"status": "uploading"}})
+            raise HTTPException(status_code=500, detail=f"Failed to assemble upload: {e}")
+        assembled = {"sha256": sha256, "size": size, "storage_key": storage_key}
+    
+    try:
+        files = get_uploaded_files_collection()
+        existing = await files.find_one({"uploaded_by": current_user.id, "sha256": assembled["sha256"]})
+        if existing:
+            file_id, deduplicated = existing["file_id"], True
+        else:
+            file_id, deduplicated = str(uuid.uuid4()), False
+            await files.insert_one(uploaded_file_doc(
+                file_id, session["filename"], session.get("content_type"), assembled["sha256"],
+                assembled["size"], assembled["storage_key"], current_user
+            ))
+        
+        update = {"status": "completed", "file_id": file_id, "sha256": assembled["sha256"], "deduplicated": deduplicated}
+        await collection.update_one({"upload_id": upload_id}, {"$set": update})
+    except Exception as e:
+        # Keep the stored file so a retried /complete registers it instead of finding the session stuck
+        await collection.update_one(
+            {"upload_id": upload_id}, {"$set": {"status": "assembled", "assembled": assembled}}
+        )
+        raise HTTPException(status_code=500, detail=f"Failed to register upload: {e}")
+    session.update(update)
+    return upload_session_from_doc(session)
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Abort an unfinished upload and drop its parts"""
+    session = await get_owned_upload(upload_id, current_user)
+    if session["status"] != "uploading":
+        raise HTTPException(status_code=409, detail=f"Upload is {session['status']}")
+    await asyncio.to_thread(uploads.discard_upload, upload_id)
+    await get_upload_sessions_collection().delete_one({"upload_id": upload_id})
+    return {"message": "Upload aborted"}
+
 @router.post("/fetch")
 async def fetch(
     payload: dict,
     current_user: User = Depends(get_current_user)
 ):
-    """Fetch content from URL for processing"""
+    """Queue a URL for background fetching and indexing; follow it via /status/{document_id}"""
     try:
         url = payload.get("url")
         if not url:
             raise HTTPException(status_code=400, detail="URL is required")
+        lane = payload.get("lane", DEFAULT_LANE)
+        if lane not in LANES:
+            raise HTTPException(status_code=400, detail=f"Unknown lane: {lane}")
         
         # Generate unique document ID
         doc_id = str(uuid.uuid4())
@@ -81,20 +263,50 @@ async def fetch(
             "url": url,
             "requested_by": current_user.id,
             "requested_at": datetime.utcnow(),
-            "status": "pending"
+            "status": "queued",
+            "stage": None,
+            "stages": {},
+            "progress": {},
+            "attempts": 0,
+            "error": None
         }
         
-        db.url_fetches.insert_one(fetch_doc)
+        await asyncio.to_thread(db.url_fetches.insert_one, fetch_doc)
+        
+        # Fetch, chunk, embed and store run in the worker's fetch_and_index on the ingest queue
+        message = dramatiq.Message(
+            queue_name=lane_queue("ingest", lane),
+            actor_name="fetch_and_index",
+            args=[doc_id],
+            kwargs={},
+            options={"lane": lane}
+        )
+        try:
+            await asyncio.to_thread(redis_broker.enqueue, message)
+        except Exception as e:
+            await asyncio.to_thread(
+                db.url_fetches.update_one,
+                {"document_id": doc_id},
+                {"$set": {"status": "failed", "error": f"Failed to enqueue: {e}"}}
+            )
+            raise
         
         return {
             "document_id": doc_id,
             "url": url,
-            "status": "pending"
+            "status": "queued"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"URL fetch request failed: {str(e)}")
 
+# Fields of a url_fetches document returned to pollers and subscribers
+URL_FETCH_STATUS_FIELDS = {"_id": 0, "url": 1, "status": 1, "stage": 1, "stages": 1, "progress": 1,
+                           "attempts": 1, "indexed": 1, "error": 1, "requested_at": 1, "completed_at": 1}
+URL_FETCH_TERMINAL = ("completed", "failed")
+
 @router.get("/status/{document_id}")
 async def get_document_status(
     document_id: str,
@@ -115,17 +327,58 @@ async def get_document_status(
         }
     
     # Check URL fetches
-    url_doc = db.url_fetches.find_one({"document_id": document_id})
+    url_doc = db.url_fetches.find_one({"document_id": document_id}, URL_FETCH_STATUS_FIELDS)
     if url_doc:
-        return {
-            "document_id": document_id,
-            "type": "url",
-            "status": url_doc.get("status", "pending"),
-            "url": url_doc.get("url")
-        }
+        return {"document_id": document_id, "type": "url", **url_doc}
     
     raise HTTPException(status_code=404, detail="Document not found")
 
+@router.get("/status/{document_id}/events")
+async def stream_document_status(
+    document_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Server-sent events with each stage change of a URL ingest, ending once it completes or fails"""
+    from ..database import Database
+    db = Database.get_sync_db()
+    
+    # Subscribe before reading the current state so no update falls in between
+    pubsub = redis_broker.client.pubsub(ignore_subscribe_messages=True)
+    await asyncio.to_thread(pubsub.subscribe, INGEST_PROGRESS_CHANNEL.format(document_id))
+    url_doc = await asyncio.to_thread(db.url_fetches.find_one, {"document_id": document_id}, URL_FETCH_STATUS_FIELDS)
+    if not url_doc:
+        await asyncio.to_thread(pubsub.close)
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    async def events():
+        try:
+            yield f"data: {json.dumps({'document_id': document_id, **url_doc}, default=str)}\n\n"
+            if url_doc.get("status") in URL_FETCH_TERMINAL:
+                return
+            while not await request.is_disconnected():
+                event = await asyncio.to_thread(pubsub.get_message, timeout=15.0)
+                if event is None:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                data = event["data"].decode() if isinstance(event["data"], bytes) else event["data"]
+                yield f"data: {data}\n\n"
+                if json.loads(data).get("status") in URL_FETCH_TERMINAL:
+                    return
+        finally:
+            await asyncio.to_thread(pubsub.close)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/throughput")
+async def get_ingest_throughput(
+    window: int = 60,
+    current_user: User = Depends(get_current_user)
+):
+    """URL ingests completed per second over the last `window` seconds"""
+    return await asyncio.to_thread(ingest_throughput, window)
+
 @router.get("/files")
 async def list_uploaded_files(
     current_user: User = Depends(get_current_user)
@@ -161,11 +414,6 @@ async def delete_uploaded_file(
         raise HTTPException(status_code=404, detail="File not found")
     
     try:
-        # Delete the physical file
-        file_path = file_doc.get("file_path")
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-        
         # Delete from database
         result = db.uploaded_files.delete_one({
             "file_id": file_id,
@@ -175,6 +423,15 @@ async def delete_uploaded_file(
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="File not found")
         
+        # Delete the stored file once no other upload shares its content
+        shared = file_doc.get("sha256") and db.uploaded_files.find_one({"sha256": file_doc["sha256"]}, {"_id": 1})
+        if not shared:
+            if file_doc.get("storage_key"):
+                await asyncio.to_thread(get_storage().delete, file_doc["storage_key"])
+            elif file_doc.get("file_path") and os.path.exists(file_doc["file_path"]):
+                # Uploaded before the storage backend existed
+                os.remove(file_doc["file_path"])
+        
         return {"message": "File deleted successfully"}
         
     except Exception as e:
@@ -1,5 +1,6 @@
 import os
 import uuid
+import asyncio
 import requests
 from datetime import datetime
 from typing import Optional, Dict, Any
@@ -8,6 +9,7 @@ from bs4 import BeautifulSoup
 import PyPDF2
 import io
 from ..database import Database
+from ..shared_flatten import flatten_to_text
 
 class IngestService:
     def __init__(self):
@@ -19,14 +21,16 @@ class IngestService:
             # Generate document ID
             doc_id = str(uuid.uuid4())
             
-            # Read file content
-            content = await file.read()
+            # Size without reading the spooled upload into memory
+            file.file.seek(0, os.SEEK_END)
+            size = file.file.tell()
+            file.file.seek(0)
             
-            # Process based on file type
+            # Process based on file type; PDFs are parsed from the spooled file, off the event loop
             if file.content_type == "application/pdf":
-                text_content = self._extract_pdf_text(content)
+                text_content = await asyncio.to_thread(self._extract_pdf_text, file.file)
             elif file.content_type.startswith("text/"):
-                text_content = content.decode('utf-8')
+                text_content = (await file.read()).decode('utf-8')
             else:
                 raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
             
@@ -38,7 +42,7 @@ class IngestService:
                 "id": doc_id,
                 "filename": file.filename,
                 "content_type": file.content_type,
-                "size": len(content),
+                "size": size,
                 "content": text_content,
                 "chunks": chunks,
                 "created_at": datetime.utcnow(),
@@ -50,7 +54,7 @@ class IngestService:
             return {
                 "document_id": doc_id,
                 "filename": file.filename,
-                "size": len(content),
+                "size": size,
                 "content_type": file.content_type,
                 "chunks": len(chunks),
                 "created_at": document["created_at"]
@@ -124,8 +128,8 @@ class IngestService:
             # Generate document ID
             doc_id = str(uuid.uuid4())
             
-            # Convert data to text
-            text_content = self._dict_to_text(data)
+            # JSONPath-keyed lines for chunking; the structure is kept in `data`
+            text_content = flatten_to_text(data)
             
             # Chunk the content
             chunks = self._chunk_text(text_content)
@@ -153,10 +157,11 @@ class IngestService:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing webhook: {str(e)}")
     
-    def _extract_pdf_text(self, pdf_content: bytes) -> str:
-        """Extract text from PDF content"""
+    def _extract_pdf_text(self, pdf_file) -> str:
+        """Extract text from PDF content (bytes or a binary file object)"""
         try:
-            pdf_file = io.BytesIO(pdf_content)
+            if isinstance(pdf_file, bytes):
+                pdf_file = io.BytesIO(pdf_file)
             pdf_reader = PyPDF2.PdfReader(pdf_file)
             text = ""
             for page in pdf_reader.pages:
@@ -198,21 +203,3 @@ class IngestService:
                 break
         
         return chunks
-    
-    def _dict_to_text(self, data: Dict[str, Any]) -> str:
-        """Convert dictionary to text representation"""
-        def format_value(value, indent=0):
-            if isinstance(value, dict):
-                lines = []
-                for k, v in value.items():
-                    lines.append("  " * indent + f"{k}: {format_value(v, indent + 1)}")
-                return "\n".join(lines)
-            elif isinstance(value, list):
-                lines = []
-                for i, item in enumerate(value):
-                    lines.append("  " * indent + f"[{i}]: {format_value(item, indent + 1)}")
-                return "\n".join(lines)
-            else:
-                return str(value)
-        
-        return format_value(data) 
\ No newline at end of file
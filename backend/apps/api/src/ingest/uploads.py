@@ -0,0 +1,233 @@
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+from typing import AsyncIterator, Dict, List, Optional, Tuple, BinaryIO
+from ..shared_storage import get_storage, blob_key
+
+# Staging area for parts and assembly; finished files go to the storage backend. Parts of
+# one upload must reach the same staging area: share UPLOAD_DIR between API replicas or
+# route /ingest/uploads/{upload_id} requests by upload id.
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/tmp/aiwf_uploads")
+PARTS_DIR = os.path.join(UPLOAD_DIR, "parts")
+TMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+for _dir in (UPLOAD_DIR, PARTS_DIR, TMP_DIR):
+    os.makedirs(_dir, exist_ok=True)
+
+UPLOAD_PART_MAX = int(os.getenv("UPLOAD_PART_MAX", str(64 * 1024 * 1024)))
+UPLOAD_MAX_PARTS = int(os.getenv("UPLOAD_MAX_PARTS", "10000"))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+# Request bodies are written in blocks this large, each in a worker thread
+WRITE_BLOCK = 1024 * 1024
+
+# SHA-256 of uploads whose parts have so far arrived in order, fed as each part is written:
+# upload_id -> [next part number, hash]. Lost on restart or when parts arrive out of order,
+# in which case the hash is computed while the parts are assembled.
+_running_hashes: Dict[str, list] = {}
+_last_sweep = 0.0
+
+
+class PartTooLarge(ValueError):
+    pass
+
+
+class PartChecksumMismatch(ValueError):
+    pass
+
+
+def part_path(upload_id: str, part_number: int) -> str:
+    return os.path.join(PARTS_DIR, upload_id, str(part_number))
+
+
+def start_upload(upload_id: str):
+    os.makedirs(os.path.join(PARTS_DIR, upload_id), exist_ok=True)
+    _running_hashes[upload_id] = [1, hashlib.sha256()]
+
+
+def discard_upload(upload_id: str):
+    _running_hashes.pop(upload_id, None)
+    shutil.rmtree(os.path.join(PARTS_DIR, upload_id), ignore_errors=True)
+
+
+def _write_block(fd: int, data: bytes, hashes: List):
+    # hashlib releases the GIL on large buffers, so this runs in parallel with the event loop
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+    for h in hashes:
+        h.update(data)
+
+
+async def receive_part(upload_id: str, part_number: int, chunks: AsyncIterator[bytes],
+                       expected_sha256: Optional[str] = None) -> Tuple[int, str]:
+    """Stream one part's request body to disk; returns its size and SHA-256.
+
+    The body is never held whole: it is buffered up to WRITE_BLOCK and each block is written
+    and hashed in a thread. A retried part simply replaces the earlier attempt.
+    """
+    running = _running_hashes.get(upload_id)
+    if running and running[0] != part_number:
+        # Out of order or a retry of an earlier part: the running hash no longer applies
+        _running_hashes.pop(upload_id, None)
+        running = None
+    # Feed a copy, so a part that fails halfway leaves the running hash untouched
+    upload_hash = running[1].copy() if running else None
+
+    path = part_path(upload_id, part_number)
+    tmp = f"{path}.partial"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part_hash = hashlib.sha256()
+    hashes = [part_hash] + ([upload_hash] if upload_hash else [])
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    size = 0
+    block = bytearray()
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > UPLOAD_PART_MAX:
+                raise PartTooLarge(f"Part exceeds {UPLOAD_PART_MAX} bytes")
+            block += chunk
+            if len(block) >= WRITE_BLOCK:
+                await asyncio.to_thread(_write_block, fd, bytes(block), hashes)
+                block.clear()
+        if block:
+            await asyncio.to_thread(_write_block, fd, bytes(block), hashes)
+    except BaseException:
+        os.close(fd)
+        os.remove(tmp)
+        raise
+    os.close(fd)
+
+    digest = part_hash.hexdigest()
+    if expected_sha256 and expected_sha256.lower() != digest:
+        os.remove(tmp)
+        raise PartChecksumMismatch(f"Part {part_number} SHA-256 mismatch")
+    os.replace(tmp, path)
+    if running and upload_id in _running_hashes:
+        _running_hashes[upload_id] = [part_number + 1, upload_hash]
+    return size, digest
+
+
+def running_digest(upload_id: str, part_count: int) -> Optional[str]:
+    """SHA-256 of the whole upload when every part was hashed as it arrived"""
+    running = _running_hashes.get(upload_id)
+    if running and running[0] == part_count + 1:
+        return running[1].hexdigest()
+    return None
+
+
+def _copy_fd(src: int, dst: int, size: int):
+    """Copy `size` bytes between the fds' current offsets without passing them through Python"""
+    remaining = size
+    if hasattr(os, "copy_file_range"):
+        try:
+            while remaining:
+                copied = os.copy_file_range(src, dst, remaining)
+                if not copied:
+                    break
+                remaining -= copied
+        except OSError:
+            # e.g. EXDEV/ENOSYS; continue from wherever the offsets got to
+            pass
+    if remaining and hasattr(os, "sendfile"):
+        try:
+            offset = os.lseek(src, 0, os.SEEK_CUR)
+            while remaining:
+                sent = os.sendfile(dst, src, offset, remaining)
+                if not sent:
+                    break
+                offset += sent
+                remaining -= sent
+            os.lseek(src, offset, os.SEEK_SET)
+        except OSError:
+            pass
+    while remaining:
+        data = os.read(src, min(remaining, WRITE_BLOCK))
+        if not data:
+            break
+        _write_block(dst, data, [])
+        remaining -= len(data)
+
+
+def _store(tmp: str, sha256: str) -> str:
+    """Move an assembled file into storage, keeping an existing copy of the same content"""
+    key = blob_key(sha256)
+    get_storage().put_file(key, tmp)
+    return key
+
+
+def assemble_parts(upload_id: str, part_count: int, sha256: Optional[str] = None) -> Tuple[str, int, str]:
+    """Concatenate the parts into storage; returns (sha256, size, storage key). Runs in a thread.
+
+    With the digest already known the parts are copied in the kernel (copy_file_range or
+    sendfile); otherwise they are read once, hashing and writing each block.
+    """
+    storage = get_storage()
+    if sha256 and storage.exists(blob_key(sha256)):
+        discard_upload(upload_id)
+        return sha256, storage.size(blob_key(sha256)), blob_key(sha256)
+
+    tmp = os.path.join(TMP_DIR, upload_id)
+    upload_hash = None if sha256 else hashlib.sha256()
+    size = 0
+    dst = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        for part_number in range(1, part_count + 1):
+            src = os.open(part_path(upload_id, part_number), os.O_RDONLY)
+            try:
+                part_size = os.fstat(src).st_size
+                if upload_hash is None:
+                    _copy_fd(src, dst, part_size)
+                else:
+                    while True:
+                        data = os.read(src, WRITE_BLOCK)
+                        if not data:
+                            break
+                        _write_block(dst, data, [upload_hash])
+                size += part_size
+            finally:
+                os.close(src)
+    finally:
+        os.close(dst)
+
+    sha256 = sha256 or upload_hash.hexdigest()
+    key = _store(tmp, sha256)
+    discard_upload(upload_id)
+    return sha256, size, key
+
+
+def store_file(fileobj: BinaryIO) -> Tuple[str, int, str]:
+    """Stream a file object into storage in one pass; returns (sha256, size, storage key). Runs in a thread."""
+    tmp = os.path.join(TMP_DIR, f"single-{os.getpid()}-{time.monotonic_ns()}")
+    upload_hash = hashlib.sha256()
+    size = 0
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        while True:
+            data = fileobj.read(WRITE_BLOCK)
+            if not data:
+                break
+            _write_block(fd, data, [upload_hash])
+            size += len(data)
+    finally:
+        os.close(fd)
+    sha256 = upload_hash.hexdigest()
+    return sha256, size, _store(tmp, sha256)
+
+
+def sweep_stale_parts():
+    """Remove part directories of abandoned uploads; at most once an hour per process"""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < 3600:
+        return
+    _last_sweep = now
+    for name in os.listdir(PARTS_DIR):
+        path = os.path.join(PARTS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > UPLOAD_SESSION_TTL:
+                discard_upload(name)
+        except OSError:
+            continue
@@ -1,11 +1,13 @@
 import os
 from fastapi import FastAPI
+from fastapi.datastructures import Default
 from starlette.middleware.cors import CORSMiddleware
 from prometheus_fastapi_instrumentator import Instrumentator
 from .database import Database
+from .responses import FastJSONResponse
 import dramatiq
 
-app = FastAPI(title="AI Workflow Builder API", version="0.1.0")
+app = FastAPI(title="AI Workflow Builder API", version="0.1.0", default_response_class=Default(FastJSONResponse))
 
 # Configure Dramatiq broker - use the shared broker
 from .shared_broker import redis_broker
@@ -44,6 +46,7 @@ from .ingest.router import router as ingest_router
 from .rag.router import router as rag_router
 from .actions.router import router as actions_router
 from .nodes.router import router as nodes_router
+from .hooks.router import router as hooks_router
 
 app.include_router(auth_router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(wf_router,    prefix="/api/v1/workflows", tags=["workflows"])
@@ -52,3 +55,4 @@ app.include_router(ingest_router,prefix="/api/v1/ingest", tags=["ingest"])
 app.include_router(rag_router,   prefix="/api/v1/rag", tags=["rag"])
 app.include_router(actions_router,prefix="/api/v1/actions", tags=["actions"])
 app.include_router(nodes_router, prefix="/api/v1/nodes", tags=["nodes"])
+app.include_router(hooks_router, prefix="/api/v1/hooks", tags=["hooks"])
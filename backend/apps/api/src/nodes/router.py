@@ -112,8 +112,9 @@ async def execute_ingest_node(run_id: str, node_id: str, node_type: str, config:
         
         print(f"DEBUG: file_path = '{file_path}', uploaded_file_id = '{uploaded_file_id}'")
         
-        # If we have an uploaded_file_id but no file_path or file doesn't exist, try to look it up from database
-        if uploaded_file_id and (not file_path or not os.path.exists(file_path)):
+        # Uploaded files are read through the storage backend, which may not be this host's disk
+        storage_key = config.get("storage_key", "")
+        if uploaded_file_id and not storage_key and (not file_path or not os.path.exists(file_path)):
             try:
                 from ..database import Database
                 db = Database.get_sync_db()
@@ -121,24 +122,21 @@ async def execute_ingest_node(run_id: str, node_id: str, node_type: str, config:
                 # Look up the file in the database
                 file_doc = db.uploaded_files.find_one({"file_id": uploaded_file_id})
                 if file_doc:
-                    stored_file_path = file_doc.get("file_path")
-                    print(f"DEBUG: Found file in database with path: {stored_file_path}")
-                    
-                    if stored_file_path and os.path.exists(stored_file_path):
-                        file_path = stored_file_path
-                        print(f"DEBUG: Using database file path: {file_path}")
-                    else:
-                        print(f"DEBUG: File in database but doesn't exist at path: {stored_file_path}")
+                    storage_key = file_doc.get("storage_key") or ""
+                    file_path = file_doc.get("file_path") or file_path
+                    print(f"DEBUG: Found file in database with key: {storage_key}, path: {file_path}")
                 else:
                     print(f"DEBUG: No file found in database for uploaded_file_id: {uploaded_file_id}")
             except Exception as e:
                 print(f"DEBUG: Error looking up file in database: {str(e)}")
         
-        if file_path and os.path.exists(file_path):
+        if storage_key or (file_path and os.path.exists(file_path)):
             try:
                 # Actually process the PDF file
                 import PyPDF2
-                with open(file_path, 'rb') as file:
+                from ..shared_storage import get_storage
+                file = get_storage().open(storage_key) if storage_key else open(file_path, 'rb')
+                with file:
                     pdf_reader = PyPDF2.PdfReader(file)
                     content = ""
                     for page_num, page in enumerate(pdf_reader.pages):
@@ -153,7 +151,8 @@ async def execute_ingest_node(run_id: str, node_id: str, node_type: str, config:
                     "document_id": uploaded_file_id or f"doc_{uuid.uuid4().hex[:8]}",
                     "type": "text",
                     "pages_processed": len(pdf_reader.pages),
-                    "file_path": file_path
+                    "file_path": file_path,
+                    "storage_key": storage_key or None
                 }
                 
             except ImportError:
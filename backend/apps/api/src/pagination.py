@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import base64
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from fastapi import HTTPException
+
+# Totals of filtered listings are cached this long per filter, so paging through a list
+# costs one count per TTL rather than one per page
+LIST_COUNT_TTL = float(os.getenv("LIST_COUNT_TTL", "30"))
+_LIST_COUNT_MAX = 10_000
+
+_counts: Dict[str, Tuple[float, int]] = {}
+
+
+def encode_cursor(sort_value: datetime, doc_id: ObjectId) -> str:
+    """Opaque cursor for the position just after a document in a (sort_field, _id) descending listing"""
+    raw = json.dumps({"t": sort_value.isoformat(), "id": str(doc_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]), ObjectId(data["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(query: Dict[str, Any], sort_field: str, cursor: Optional[str]) -> Dict[str, Any]:
+    """Restrict a listing query to documents after `cursor`.
+
+    The range on `sort_field` bounds the index scan, so a page costs the same wherever it
+    starts; `_id` only breaks ties between equal sort values.
+    """
+    if not cursor:
+        return query
+    sort_value, doc_id = decode_cursor(cursor)
+    return {
+        **query,
+        sort_field: {"$lte": sort_value},
+        "$or": [{sort_field: {"$lt": sort_value}}, {"_id": {"$lt": doc_id}}],
+    }
+
+
+def keyset_sort(sort_field: str) -> List[Tuple[str, int]]:
+    return [(sort_field, -1), ("_id", -1)]
+
+
+def next_cursor(docs: List[Dict[str, Any]], limit: int, sort_field: str) -> Optional[str]:
+    """Cursor for the next page; `docs` is one page fetched with limit + 1, trimmed in place"""
+    if len(docs) <= limit:
+        return None
+    del docs[limit:]
+    last = docs[-1]
+    return encode_cursor(last[sort_field], last["_id"])
+
+
+async def cached_count(collection, query: Dict[str, Any]) -> int:
+    """count_documents, cached for LIST_COUNT_TTL seconds per collection and filter"""
+    key = f"{collection.name}:{json.dumps(query, sort_keys=True, default=str)}"
+    now = time.monotonic()
+    hit = _counts.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    count = await collection.count_documents(query)
+    if len(_counts) >= _LIST_COUNT_MAX:
+        _counts.clear()
+    _counts[key] = (now + LIST_COUNT_TTL, count)
+    return count
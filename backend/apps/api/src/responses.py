@@ -0,0 +1,16 @@
+from typing import Any
+from starlette.responses import JSONResponse
+from .shared_broker import json_dumps
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (stdlib json without it).
+
+    Installed as the app's default response class wrapped in fastapi's Default(), so routes
+    with a response model keep FastAPI's own pydantic-core serialization and only routes
+    returning plain dicts and lists render here. ObjectIds and datetimes come out the same
+    way they do in broker messages.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
@@ -11,6 +11,12 @@ class RunStatus(str, Enum):
     FAILED = "failed"
     CANCELLED = "cancelled"
 
+class RunLane(str, Enum):
+    """Priority lane a run executes in"""
+    INTERACTIVE = "interactive"
+    MANUAL = "manual"
+    BATCH = "batch"
+
 class RunLog(BaseModel):
     """Individual log entry for a run"""
     timestamp: datetime = Field(description="Log timestamp")
@@ -23,11 +29,16 @@ class Run(BaseModel):
     """Run model"""
     id: str = Field(description="Unique run identifier")
     workflow_id: str = Field(description="Workflow ID this run belongs to")
+    workflow_version: Optional[int] = Field(default=None, description="Workflow version the run executes")
     status: RunStatus = Field(description="Current run status")
+    lane: RunLane = Field(default=RunLane.MANUAL, description="Priority lane")
+    batch_id: Optional[str] = Field(default=None, description="Batch the run was submitted in")
     created_by: str = Field(description="User who created the run")
     created_at: datetime = Field(description="Run creation timestamp")
     started_at: Optional[datetime] = Field(default=None, description="Run start timestamp")
     completed_at: Optional[datetime] = Field(default=None, description="Run completion timestamp")
+    timeout_ms: Optional[int] = Field(default=None, description="Run time budget in milliseconds")
+    deadline: Optional[datetime] = Field(default=None, description="Time by which the run must finish")
     error: Optional[str] = Field(default=None, description="Error message if failed")
     node_status: Dict[str, str] = Field(default_factory=dict, description="Status of individual nodes")
     inputs: Dict[str, Any] = Field(default_factory=dict, description="Run inputs")
@@ -36,7 +47,8 @@ class Run(BaseModel):
 class RunList(BaseModel):
     """Response model for listing runs"""
     runs: List[Run] = Field(description="List of runs")
-    total: int = Field(description="Total number of runs")
+    total: Optional[int] = Field(default=None, description="Number of matching runs, with include_total; may lag by LIST_COUNT_TTL")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor for the next page; absent on the last page")
 
 class RunLogsResponse(BaseModel):
     """Response model for run logs"""
@@ -47,3 +59,35 @@ class RunLogsResponse(BaseModel):
 class RunCreate(BaseModel):
     """Request model for creating a run"""
     inputs: Optional[Dict[str, Any]] = Field(default_factory=dict, description="Run inputs")
+    timeout_ms: Optional[int] = Field(default=None, ge=1000, description="Run time budget; defaults to the worker's RUN_TIMEOUT_MS")
+
+class RunBatchCreate(BaseModel):
+    """Request model for submitting many runs of one workflow"""
+    inputs: List[Dict[str, Any]] = Field(..., min_length=1, max_length=10000, description="One input set per run")
+    timeout_ms: Optional[int] = Field(default=None, ge=1000, description="Time budget applied to every run")
+
+class RunBatch(BaseModel):
+    """Aggregate progress of a batch of runs"""
+    batch_id: str = Field(description="Batch ID")
+    workflow_id: str = Field(description="Workflow ID the runs belong to")
+    total: int = Field(description="Number of runs in the batch")
+    counts: Dict[str, int] = Field(description="Run count per status")
+    completed: int = Field(description="Runs that reached a terminal status")
+    created_at: datetime = Field(description="Submission timestamp")
+
+class DeadLetter(BaseModel):
+    """A node message that failed permanently or exhausted its retries"""
+    message_id: str = Field(description="Dramatiq message ID")
+    actor_name: str = Field(description="Actor that failed")
+    queue_name: str = Field(description="Queue the message was consumed from")
+    node_id: Optional[str] = Field(default=None, description="Node ID if applicable")
+    error: Optional[str] = Field(default=None, description="Last error message")
+    error_type: Optional[str] = Field(default=None, description="Exception class name")
+    classification: Optional[str] = Field(default=None, description="transient or permanent")
+    retries: int = Field(default=0, description="Retries attempted before dead-lettering")
+    failed_at: datetime = Field(description="When the message was dead-lettered")
+
+class DeadLetterList(BaseModel):
+    """Response model for a run's dead-lettered messages"""
+    run_id: str = Field(description="Run ID")
+    dead_letters: List[DeadLetter] = Field(description="Dead-lettered messages, newest first")
@@ -1,44 +1,107 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Optional, List
 from bson import ObjectId
 from datetime import datetime
-from ..database import get_runs_collection
+from ..database import get_runs_collection, get_run_batches_collection
 from ..auth.router import get_current_user
 from ..auth.models import User
-from .models import Run, RunList, RunLogsResponse, RunLog, RunStatus
+from ..pagination import keyset_query, keyset_sort, next_cursor, cached_count
+from ..shared_broker import (
+    list_dead_letters, get_dead_letter, replay_dead_letter, scheduling_latency_percentiles,
+    request_cancellation, broker_metrics
+)
+from .models import Run, RunList, RunLogsResponse, RunLog, RunStatus, RunBatch, DeadLetter, DeadLetterList
 
 router = APIRouter()
 
 @router.get("", response_model=RunList)
 async def list_runs(
     workflow_id: Optional[str] = Query(None, description="Filter by workflow ID"),
+    batch_id: Optional[str] = Query(None, description="Filter by batch ID"),
     status: Optional[RunStatus] = Query(None, description="Filter by status"),
-    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
     limit: int = Query(100, ge=1, le=1000),
+    include_total: bool = Query(False, description="Also return the number of matching runs (cached briefly)"),
     current_user: User = Depends(get_current_user)
 ):
-    """List runs for the current user"""
+    """List runs for the current user, newest first"""
     collection = get_runs_collection()
     
     # Build filter query
     filter_query = {"created_by": current_user.id}
     if workflow_id:
         filter_query["workflow_id"] = workflow_id
+    if batch_id:
+        filter_query["batch_id"] = batch_id
     if status:
         filter_query["status"] = status.value
     
-    # Count total runs
-    total = await collection.count_documents(filter_query)
+    total = await cached_count(collection, filter_query) if include_total else None
     
-    # Get runs with pagination
-    cursor = collection.find(filter_query).skip(skip).limit(limit).sort("created_at", -1)
+    # Keyset pagination on (created_at, _id): every page is one bounded index scan
+    docs = await collection.find(
+        keyset_query(filter_query, "created_at", cursor)
+    ).sort(keyset_sort("created_at")).limit(limit + 1).to_list(length=limit + 1)
+    cursor_out = next_cursor(docs, limit, "created_at")
     
     runs = []
-    async for doc in cursor:
+    for doc in docs:
         doc["id"] = str(doc["_id"])
         runs.append(Run(**doc))
     
-    return RunList(runs=runs, total=total)
+    return RunList(runs=runs, total=total, next_cursor=cursor_out)
+
+@router.get("/metrics/scheduling")
+async def get_scheduling_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """Enqueue-to-start latency percentiles (seconds) per priority lane (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return {"lanes": await asyncio.to_thread(scheduling_latency_percentiles)}
+
+@router.get("/metrics/broker")
+async def get_broker_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """Redis memory and network use, and the backlog and size of every queue (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return await asyncio.to_thread(broker_metrics)
+
+@router.get("/batches/{batch_id}", response_model=RunBatch)
+async def get_run_batch(
+    batch_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Aggregate progress of a batch submitted with POST /workflows/{id}/runs:batch"""
+    if not ObjectId.is_valid(batch_id):
+        raise HTTPException(status_code=400, detail="Invalid batch ID")
+    
+    batch = await get_run_batches_collection().find_one({"_id": ObjectId(batch_id)})
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if batch.get("created_by") != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    counts = {}
+    cursor = get_runs_collection().aggregate([
+        {"$match": {"batch_id": batch_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ])
+    async for row in cursor:
+        counts[row["_id"]] = row["count"]
+    terminal = (RunStatus.SUCCEEDED.value, RunStatus.FAILED.value, RunStatus.CANCELLED.value)
+    
+    return RunBatch(
+        batch_id=batch_id,
+        workflow_id=batch["workflow_id"],
+        total=batch["total"],
+        counts=counts,
+        completed=sum(counts.get(status, 0) for status in terminal),
+        created_at=batch["created_at"]
+    )
 
 @router.get("/{run_id}", response_model=Run)
 async def get_run(
@@ -145,9 +208,92 @@ async def cancel_run(
         if result.modified_count == 0:
             raise HTTPException(status_code=400, detail="No changes made")
         
+        # Stop queued, parked and executing node work, not just the run document
+        request_cancellation(run_id, tenant=run_doc.get("created_by"))
+        
         return {"message": "Run cancelled successfully"}
         
     except Exception as e:
         if "invalid ObjectId" in str(e):
             raise HTTPException(status_code=400, detail="Invalid run ID")
         raise e
+
+def _dead_letter_view(entry: dict) -> DeadLetter:
+    args = entry.get("args") or []
+    return DeadLetter(
+        message_id=entry["message_id"],
+        actor_name=entry["actor_name"],
+        queue_name=entry["queue_name"],
+        node_id=args[1] if len(args) > 1 and isinstance(args[1], str) else None,
+        error=entry.get("error"),
+        error_type=entry.get("error_type"),
+        classification=entry.get("classification"),
+        retries=(entry.get("options") or {}).get("retries", 0),
+        failed_at=datetime.utcfromtimestamp(entry.get("failed_at", 0))
+    )
+
+@router.get("/{run_id}/dead-letters", response_model=DeadLetterList)
+async def list_run_dead_letters(
+    run_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """List node messages of a run that exhausted their retries or failed permanently"""
+    collection = get_runs_collection()
+    
+    try:
+        run_doc = await collection.find_one({"_id": ObjectId(run_id)})
+        if not run_doc:
+            raise HTTPException(status_code=404, detail="Run not found")
+        
+        if run_doc.get("created_by") != current_user.id:
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        entries = list_dead_letters(run_id=run_id)
+        return DeadLetterList(run_id=run_id, dead_letters=[_dead_letter_view(e) for e in entries])
+        
+    except Exception as e:
+        if "invalid ObjectId" in str(e):
+            raise HTTPException(status_code=400, detail="Invalid run ID")
+        raise e
+
+@router.post("/{run_id}/dead-letters/{message_id}/replay")
+async def replay_run_dead_letter(
+    run_id: str,
+    message_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Re-enqueue a dead-lettered node message with a fresh retry budget"""
+    collection = get_runs_collection()
+    
+    try:
+        run_doc = await collection.find_one({"_id": ObjectId(run_id)})
+        if not run_doc:
+            raise HTTPException(status_code=404, detail="Run not found")
+        
+        if run_doc.get("created_by") != current_user.id:
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        entry = get_dead_letter(message_id)
+        if not entry or entry.get("run_id") != run_id:
+            raise HTTPException(status_code=404, detail="Dead letter not found")
+        
+        if run_doc.get("status") == "cancelled":
+            raise HTTPException(status_code=400, detail="Cannot replay messages of a cancelled run")
+        
+        message = replay_dead_letter(message_id)
+        if not message:
+            raise HTTPException(status_code=404, detail="Dead letter not found")
+        
+        # Put the run back in flight so completion is tracked again
+        update = {"status": "running", "error": None}
+        node_id = _dead_letter_view(entry).node_id
+        if node_id:
+            update[f"node_status.{node_id}"] = "queued"
+        await collection.update_one({"_id": ObjectId(run_id)}, {"$set": update})
+        
+        return {"message": "Dead letter replayed", "message_id": message.message_id, "replayed_from": message_id}
+        
+    except Exception as e:
+        if "invalid ObjectId" in str(e):
+            raise HTTPException(status_code=400, detail="Invalid run ID")
+        raise e
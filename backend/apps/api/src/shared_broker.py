@@ -1,17 +1,862 @@
 import os
+import json
+import time
+import threading
+import traceback
+import zlib
+from uuid import uuid4
+from typing import Optional
+from datetime import datetime, date, timezone
+from email.utils import parsedate_to_datetime
 import dramatiq
 from dramatiq.brokers.redis import RedisBroker
-from dramatiq.middleware import Retries, AgeLimit
+from dramatiq.encoder import Encoder
+from dramatiq.errors import DecodeError
+from dramatiq.common import compute_backoff, current_millis
+from dramatiq.middleware import Middleware, Retries, AgeLimit, TimeLimit, Interrupt, SkipMessage, default_middleware
+from dramatiq.middleware.threading import raise_thread_exception
+from redis import asyncio as redis_asyncio
+from bson import ObjectId
+from pymongo import MongoClient
 
-# Create Redis broker
-redis_broker = RedisBroker(url=os.getenv("REDIS_URL", "redis://redis:6379/0"))
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TransientError(Exception):
+    """Failure worth retrying (timeouts, rate limits, upstream 5xx)"""
+
+    def __init__(self, message: str = "", retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Seconds to wait from a Retry-After header: delta-seconds or an HTTP-date; None if unusable"""
+    if value is None or value == "":
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class PermanentError(Exception):
+    """Failure that no retry can fix (bad config, missing input)"""
+
+
+class DeadlineExceeded(PermanentError):
+    """The run's deadline or the node's time budget has passed"""
+
+
+class RunCancelled(Interrupt):
+    """Raised inside an actor whose run was cancelled; never retried or dead-lettered.
+
+    Like dramatiq's TimeLimitExceeded it is a BaseException, so an actor's
+    `except Exception` handlers do not mark the node failed on the way out.
+    """
+
+
+# Per-queue retry budgets and backoff curves (milliseconds)
+RETRY_POLICIES = {
+    "default": {"max_retries": 5, "min_backoff": 500, "max_backoff": 30_000},
+    "ingest": {"max_retries": 3, "min_backoff": 5_000, "max_backoff": 300_000},
+    "ai": {"max_retries": 4, "min_backoff": 2_000, "max_backoff": 120_000},
+    "actions": {"max_retries": 5, "min_backoff": 1_000, "max_backoff": 300_000},
+    "cpu": {"max_retries": 2, "min_backoff": 5_000, "max_backoff": 120_000},
+}
+DEFAULT_RETRY_POLICY = {"max_retries": 3, "min_backoff": 1_000, "max_backoff": 60_000}
+
+# Consecutive failures of one actor after which retries jump straight to max backoff
+FAILURE_STORM_THRESHOLD = int(os.getenv("FAILURE_STORM_THRESHOLD", "20"))
+
+# Node time limits (milliseconds) per queue when a node sets no timeout_ms; enforced by TimeLimit
+NODE_TIME_LIMITS = {
+    "ai": 180_000,
+    "ingest": 120_000,
+    "actions": 120_000,
+    "cpu": 600_000,
+}
+
+DEAD_LETTER_KEY = "aiwf:dead_letters"
+DEAD_LETTER_INDEX = "aiwf:dead_letters:index"
+DEAD_LETTER_MAX = int(os.getenv("DEAD_LETTER_MAX", "10000"))
+
+# Priority lanes: each lane gets its own queue per base queue, so a backlog of
+# scheduled batch runs never sits in front of interactive or manual work
+LANES = ("interactive", "manual", "batch")
+DEFAULT_LANE = "manual"
+BASE_QUEUES = ("default", "ingest", "ai", "actions", "cpu")
+
+# Cancelled run ids (scored by cancel time) and the channel workers listen on to interrupt them
+CANCELLED_RUNS_KEY = "aiwf:cancelled_runs"
+CANCELLATION_CHANNEL = "aiwf:cancellations"
+CANCELLATION_RETENTION = int(os.getenv("CANCELLATION_RETENTION", str(7 * 24 * 3600)))
+# Seconds a negative cancellation check is trusted by CancellationToken
+CANCELLATION_CHECK_INTERVAL = float(os.getenv("CANCELLATION_CHECK_INTERVAL", "1.0"))
+# Queues whose actors may be interrupted mid-call; action actors hold locks and ledger
+# claims, so they only observe cancellation before they start
+INTERRUPTIBLE_QUEUES = ("ai", "ingest", "cpu")
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+# Terminal status of a run is pushed here for callers waiting on it (POST /workflows/:id/run?wait=true)
+RUN_FINISHED_KEY = "aiwf:run_finished:{}"
+RUN_FINISHED_TTL = 300
+
+# Per-tenant in-flight node slots (see the worker's fair_scheduler), members are "run_id:node_id"
+TENANT_INFLIGHT_KEY = "aiwf:tenant:{}:inflight"
+# Tenants with parked node tasks waiting for a free slot
+TENANTS_BACKLOGGED_KEY = "aiwf:tenants:backlogged"
+
+# Published by the API whenever a schedule changes so the scheduler resyncs immediately
+SCHEDULES_CHANGED_CHANNEL = "aiwf:schedules:changed"
+
+# Webhook trigger buffer, per workflow: the API appends raw events to a capped list and the
+# worker's drain_webhook_events turns them into runs. The flag key marks a pending drain (its
+# value is the first buffered event's time, ms); the due key holds the debounce fire time.
+WEBHOOK_EVENTS_KEY = "aiwf:hooks:{}:events"
+WEBHOOK_DRAIN_KEY = "aiwf:hooks:{}:drain"
+WEBHOOK_DUE_KEY = "aiwf:hooks:{}:due"
+# Events a drain took off the buffer and has not turned into runs yet, per drain message,
+# so a retried or redelivered drain starts runs for them instead of losing them
+WEBHOOK_PROCESSING_KEY = "aiwf:hooks:{}:processing:{}"
+WEBHOOK_BUFFER_MAX = int(os.getenv("WEBHOOK_BUFFER_MAX", "10000"))
+
+# Background URL ingests (POST /ingest/fetch): every stage change of a url_fetches document is
+# published on the progress channel for subscribers; finished ingests are recorded in a sorted
+# set scored by completion time, trimmed to the retention, from which throughput is read.
+INGEST_PROGRESS_CHANNEL = "aiwf:ingest:progress:{}"
+INGEST_COMPLETED_KEY = "aiwf:ingest:completed"
+INGEST_THROUGHPUT_RETENTION = int(os.getenv("INGEST_THROUGHPUT_RETENTION", "3600"))
+
+# Encoded messages at least this large are compressed before they reach Redis (zstd, or zlib
+# without zstandard). A leading marker byte names the codec; plain JSON starts with "{".
+BROKER_COMPRESS_MIN_BYTES = int(os.getenv("BROKER_COMPRESS_MIN_BYTES", "4096"))
+BROKER_COMPRESS_LEVEL = int(os.getenv("BROKER_COMPRESS_LEVEL", "3"))
+ZSTD_MARKER = b"\x01"
+ZLIB_MARKER = b"\x02"
+
+SCHEDULING_LATENCY_KEY = "aiwf:sched_latency"
+SCHEDULING_LATENCY_SAMPLES = int(os.getenv("SCHEDULING_LATENCY_SAMPLES", "2000"))
+
+try:
+    from prometheus_client import Counter, Histogram
+    scheduling_latency = Histogram(
+        "aiwf_scheduling_latency_seconds",
+        "Time from enqueue to the first delivery of a message to an actor",
+        ["lane", "queue"],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+    )
+    broker_message_bytes = Counter(
+        "aiwf_broker_message_bytes_total",
+        "Bytes of messages encoded by this process, before (raw) and after (stored) compression",
+        ["kind"],
+    )
+except ImportError:
+    scheduling_latency = None
+    broker_message_bytes = None
+
+PERMANENT_TYPES = (PermanentError, ValueError, KeyError, TypeError, AttributeError, NotImplementedError)
+
+
+def classify_exception(exception: BaseException) -> str:
+    """Return "transient" or "permanent" for an exception raised by an actor"""
+    if isinstance(exception, TransientError):
+        return "transient"
+    if isinstance(exception, PERMANENT_TYPES):
+        return "permanent"
+    # HTTP client errors carry a response; 4xx other than 408/429 will not succeed on retry
+    response = getattr(exception, "response", None)
+    status = getattr(response, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 429):
+        return "permanent"
+    return "transient"
+
+
+def dead_letter_run_id(message_dict: dict):
+    args = message_dict.get("args") or []
+    return args[0] if args and isinstance(args[0], str) else None
+
+
+def message_run_id(message):
+    """Run id of a node/orchestration message (its first positional argument)"""
+    args = message.args or ()
+    return args[0] if args and isinstance(args[0], str) else None
+
+
+def node_message(message):
+    """(run_id, node_id) of a node task message, marked by dispatch with a `node_id` option; else None"""
+    node_id = message.options.get("node_id")
+    run_id = message_run_id(message)
+    return (run_id, node_id) if node_id and run_id else None
+
+
+def lane_queue(queue_name: str, lane: str = None) -> str:
+    return queue_name if lane in (None, DEFAULT_LANE) else f"{queue_name}_{lane}"
+
+
+def base_queue(queue_name: str) -> str:
+    """Strip delay/dead-letter and lane suffixes, e.g. actions_batch.DQ -> actions"""
+    name = queue_name.split(".")[0]
+    for lane in LANES:
+        if name.endswith(f"_{lane}"):
+            return name[:-len(lane) - 1]
+    return name
+
+
+_message_context = threading.local()
+
+
+def current_lane() -> str:
+    """Lane of the message the current worker thread is processing"""
+    return getattr(_message_context, "lane", DEFAULT_LANE)
+
+
+def current_message_id():
+    """Id of the message the current worker thread is processing; stable across its retries"""
+    return getattr(_message_context, "message_id", None)
+
+
+def current_deadline():
+    """Run deadline (epoch seconds) of the message being processed, if any"""
+    return getattr(_message_context, "deadline", None)
+
+
+def remaining_budget(cap: float) -> float:
+    """Seconds an outbound call may take: `cap`, shortened to the current message's time budget"""
+    budget = getattr(_message_context, "budget", None)
+    if budget is None:
+        return cap
+    left = budget - time.time()
+    if left <= 0:
+        raise DeadlineExceeded("Time budget exhausted")
+    return min(cap, left)
+
+
+def send_in_lane(actor, *args, lane: str = None, delay: int = None, deadline: float = None, timeout_ms: int = None,
+                 tenant: str = None, node_id: str = None):
+    """Send to the actor's queue for the given lane.
+
+    Lane and run deadline default to those of the message being processed, so work
+    spawned by a node inherits both. `timeout_ms` is the node's own time budget, and a
+    node task carries its `node_id` and the `tenant` whose concurrency slot it holds.
+    """
+    lane = lane or current_lane()
+    deadline = deadline or current_deadline()
+    message = actor.message(*args).copy(queue_name=lane_queue(actor.queue_name, lane))
+    message.options["lane"] = lane
+    if deadline:
+        message.options["deadline"] = deadline
+    if timeout_ms:
+        message.options["timeout_ms"] = int(timeout_ms)
+    if tenant:
+        message.options["tenant"] = tenant
+    if node_id:
+        message.options["node_id"] = node_id
+    return actor.broker.enqueue(message, delay=delay)
+
+
+def enqueue_many(messages, broker=None) -> list:
+    """Enqueue messages in a single Redis round trip.
+
+    Equivalent to calling broker.enqueue() for each message, but the dispatch script
+    invocations are pipelined; used for bulk producers like the scheduler.
+    """
+    broker = broker or redis_broker
+    dispatch = broker.scripts["dispatch"]
+    pipe = broker.client.pipeline(transaction=False)
+    enqueued = []
+    for message in messages:
+        message = message.copy(options={"redis_message_id": str(uuid4())})
+        broker.emit_before("enqueue", message, None)
+        # Same argument layout RedisBroker._dispatch("enqueue") uses
+        dispatch(keys=[broker.namespace], args=[
+            "enqueue", current_millis(), message.queue_name, broker.broker_id,
+            broker.heartbeat_timeout, broker.dead_message_ttl, 0, broker._max_unpack_size(),
+            message.options["redis_message_id"], message.encode(),
+        ], client=pipe)
+        enqueued.append(message)
+    if enqueued:
+        pipe.execute()
+    for message in enqueued:
+        broker.emit_after("enqueue", message, None)
+    return enqueued
+
+
+class LaneContext(Middleware):
+    """Tracks the lane of in-flight messages and records per-lane scheduling latency"""
+
+    def before_process_message(self, broker, message):
+        lane = message.options.get("lane", DEFAULT_LANE)
+        _message_context.lane = lane
+        _message_context.message_id = message.message_id
+        if message.options.get("retries"):
+            return
+        enqueued_at = message.options.get("eta", message.message_timestamp)
+        latency = max(0.0, time.time() - enqueued_at / 1000)
+        queue = base_queue(message.queue_name)
+        if scheduling_latency is not None:
+            scheduling_latency.labels(lane=lane, queue=queue).observe(latency)
+        try:
+            key = f"{SCHEDULING_LATENCY_KEY}:{lane}"
+            pipe = broker.client.pipeline()
+            pipe.lpush(key, round(latency, 4))
+            pipe.ltrim(key, 0, SCHEDULING_LATENCY_SAMPLES - 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"[broker] Failed to record scheduling latency: {e}")
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        _message_context.lane = DEFAULT_LANE
+        _message_context.message_id = None
+
+    after_skip_message = after_process_message
+
+
+class Deadlines(Middleware):
+    """Applies run deadlines and node timeouts to each delivery of a message.
+
+    Runs ahead of TimeLimit and sets the message's time_limit to whatever is left of
+    min(run deadline, now + node timeout), so a node can neither hang past its own
+    budget nor outlive its run. Messages of overdue runs are skipped.
+    """
+
+    def before_process_message(self, broker, message):
+        now = time.time()
+        deadline = message.options.get("deadline")
+        timeout_ms = message.options.get("timeout_ms") or NODE_TIME_LIMITS.get(base_queue(message.queue_name))
+        _message_context.deadline = deadline
+        _message_context.budget = None
+        if deadline and now >= deadline:
+            print(f"[broker] Skipping {message.actor_name} ({message.message_id}): run deadline passed")
+            raise SkipMessage()
+        budget = now + timeout_ms / 1000 if timeout_ms else None
+        if deadline:
+            budget = min(budget, deadline) if budget else deadline
+        if budget:
+            _message_context.budget = budget
+            message.options["time_limit"] = max(1, int((budget - now) * 1000))
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        _message_context.deadline = None
+        _message_context.budget = None
+
+    after_skip_message = after_process_message
+
+
+def scheduling_latency_percentiles() -> dict:
+    """p50/p95/p99 scheduling latency (seconds) per lane over the recent sample window"""
+    client = redis_broker.client
+    result = {}
+    for lane in LANES:
+        samples = sorted(float(v) for v in client.lrange(f"{SCHEDULING_LATENCY_KEY}:{lane}", 0, -1))
+        if not samples:
+            result[lane] = {"samples": 0, "p50": None, "p95": None, "p99": None}
+            continue
+        pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+        result[lane] = {"samples": len(samples), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+    return result
+
+
+def record_ingest_completed(document_id: str):
+    now = time.time()
+    pipe = redis_broker.client.pipeline()
+    pipe.zadd(INGEST_COMPLETED_KEY, {document_id: now})
+    pipe.zremrangebyscore(INGEST_COMPLETED_KEY, "-inf", now - INGEST_THROUGHPUT_RETENTION)
+    pipe.execute()
+
+
+def ingest_throughput(window: float = 60) -> dict:
+    """Documents ingested over the last `window` seconds (at most the retention) and the rate"""
+    window = min(max(window, 1), INGEST_THROUGHPUT_RETENTION)
+    count = redis_broker.client.zcount(INGEST_COMPLETED_KEY, time.time() - window, "+inf")
+    return {"window_seconds": window, "documents": count, "docs_per_second": count / window}
+
+
+def request_cancellation(run_id: str, tenant: str = None):
+    """Mark a run cancelled and interrupt its in-flight messages on every worker"""
+    client = redis_broker.client
+    now = time.time()
+    pipe = client.pipeline()
+    pipe.zadd(CANCELLED_RUNS_KEY, {run_id: now})
+    pipe.zremrangebyscore(CANCELLED_RUNS_KEY, "-inf", now - CANCELLATION_RETENTION)
+    pipe.publish(CANCELLATION_CHANNEL, run_id)
+    pipe.execute()
+    if tenant:
+        # Interrupted nodes never complete; free their slots now rather than after the slot TTL
+        key = TENANT_INFLIGHT_KEY.format(tenant)
+        slots = [member for member, _ in client.zscan_iter(key, match=f"{run_id}:*")]
+        if slots:
+            client.zrem(key, *slots)
+
+
+def request_pending_dispatch(broker=None):
+    """Ask a worker to hand free tenant slots to parked node tasks (the worker's dispatch_pending actor)"""
+    broker = broker or redis_broker
+    broker.enqueue(dramatiq.Message(
+        queue_name="default", actor_name="dispatch_pending", args=(), kwargs={}, options={}
+    ))
+
+
+def release_tenant_slot(broker, message):
+    """Free the tenant slot held by a node message that will never complete"""
+    node, tenant = node_message(message), message.options.get("tenant")
+    if not node or not tenant:
+        return
+    if broker.client.zrem(TENANT_INFLIGHT_KEY.format(tenant), "{}:{}".format(*node)):
+        # Parked work would otherwise wait for another completion or the scheduler's sweep
+        request_pending_dispatch(broker)
+
+
+def refresh_tenant_slot(broker, message, at):
+    """Keep the tenant slot of a retried node message from expiring before its next attempt starts"""
+    node, tenant = node_message(message), message.options.get("tenant")
+    if node and tenant:
+        # xx: a slot already released or swept stays free
+        broker.client.zadd(TENANT_INFLIGHT_KEY.format(tenant), {"{}:{}".format(*node): at}, xx=True)
+
+
+_runs = None
+
+
+def runs_collection():
+    """The runs collection, for the broker-side bookkeeping of node tasks that are given up on"""
+    global _runs
+    if _runs is None:
+        _runs = MongoClient(os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")).aiwf.runs
+    return _runs
+
+
+def as_object_id(value):
+    """Ids travel through messages as strings; API-created runs are stored under ObjectIds"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
+def is_run_cancelled(run_id: str) -> bool:
+    return redis_broker.client.zscore(CANCELLED_RUNS_KEY, run_id) is not None
+
+
+def notify_run_finished(run_id: str, status: str):
+    """Wake API requests waiting on the run (`?wait=true`); the list outlives a late waiter briefly"""
+    key = RUN_FINISHED_KEY.format(run_id)
+    pipe = redis_broker.client.pipeline()
+    pipe.rpush(key, status)
+    pipe.expire(key, RUN_FINISHED_TTL)
+    pipe.execute()
+
+
+_async_client = None
+
+
+def async_client():
+    """asyncio Redis client for API handlers that wait on Redis without holding a thread"""
+    global _async_client
+    if _async_client is None:
+        _async_client = redis_asyncio.Redis.from_url(REDIS_URL)
+    return _async_client
+
+
+async def wait_for_run(run_id: str, timeout: float):
+    """Wait until the run finishes or `timeout` seconds pass; returns the terminal status or None"""
+    item = await async_client().blpop([RUN_FINISHED_KEY.format(run_id)], timeout=max(timeout, 0.01))
+    if not item:
+        return None
+    status = item[1]
+    return status.decode() if isinstance(status, bytes) else status
+
+
+class CancellationToken:
+    """Cheap cancellation check for long actors, called between chunks of work"""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self._cancelled = False
+        self._checked_at = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._cancelled and time.monotonic() - self._checked_at >= CANCELLATION_CHECK_INTERVAL:
+            self._cancelled = is_run_cancelled(self.run_id)
+            self._checked_at = time.monotonic()
+        return self._cancelled
+
+    def check(self):
+        if self.cancelled:
+            raise RunCancelled(f"Run {self.run_id} was cancelled")
+
+
+class Cancellation(Middleware):
+    """Skips messages of cancelled runs and interrupts the ones already executing"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.listener = None
+
+    def after_worker_boot(self, broker, worker):
+        pubsub = broker.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{CANCELLATION_CHANNEL: self.on_cancel})
+        self.listener = pubsub.run_in_thread(sleep_time=0.5, daemon=True)
+
+    def before_worker_shutdown(self, broker, worker):
+        if self.listener:
+            self.listener.stop()
+
+    def on_cancel(self, event):
+        run_id = event["data"].decode() if isinstance(event["data"], bytes) else event["data"]
+        with self.lock:
+            for thread_id, interruptible in self.inflight.get(run_id, {}).items():
+                if interruptible:
+                    print(f"[broker] Interrupting cancelled run {run_id} on thread {thread_id}")
+                    raise_thread_exception(thread_id, RunCancelled)
+
+    def before_process_message(self, broker, message):
+        run_id = message_run_id(message)
+        if not run_id:
+            return
+        if is_run_cancelled(run_id):
+            print(f"[broker] Skipping {message.actor_name} for cancelled run {run_id}")
+            raise SkipMessage()
+        with self.lock:
+            self.inflight.setdefault(run_id, {})[threading.get_ident()] = \
+                base_queue(message.queue_name) in INTERRUPTIBLE_QUEUES
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        run_id = message_run_id(message)
+        if not run_id:
+            return
+        with self.lock:
+            threads = self.inflight.get(run_id)
+            if threads is not None:
+                threads.pop(threading.get_ident(), None)
+                if not threads:
+                    del self.inflight[run_id]
+
+    after_skip_message = after_process_message
+
+
+class RetryPolicy(Middleware):
+    """Retries transient failures with per-queue backoff and dead-letters everything else"""
+
+    def __init__(self):
+        self.consecutive_failures = {}
+
+    @property
+    def actor_options(self):
+        return {"max_retries", "min_backoff", "max_backoff"}
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        if exception is None:
+            self.consecutive_failures.pop(message.actor_name, None)
+            return
+        if isinstance(exception, RunCancelled):
+            print(f"[broker] {message.actor_name} ({message.message_id}) stopped: {exception}")
+            return
+
+        actor = broker.get_actor(message.actor_name)
+        policy = RETRY_POLICIES.get(base_queue(message.queue_name), DEFAULT_RETRY_POLICY)
+        max_retries = actor.options.get("max_retries", policy["max_retries"])
+        retries = message.options.setdefault("retries", 0)
+        kind = classify_exception(exception)
+
+        message.options["traceback"] = traceback.format_exc(limit=30)
+        failures = self.consecutive_failures.get(message.actor_name, 0) + 1
+        self.consecutive_failures[message.actor_name] = failures
+
+        deadline = message.options.get("deadline")
+        if kind == "permanent" or retries >= max_retries or (deadline and time.time() >= deadline):
+            message.fail()
+            self.dead_letter(broker, message, exception, kind)
+            self.abandon(broker, message, exception)
+            return
+
+        message.options["retries"] += 1
+        message.options["requeue_timestamp"] = int(time.time() * 1000)
+        max_backoff = actor.options.get("max_backoff", policy["max_backoff"])
+        retry_after = getattr(exception, "retry_after", None)
+        if retry_after:
+            delay = int(float(retry_after) * 1000)
+        elif failures >= FAILURE_STORM_THRESHOLD:
+            # The actor keeps failing; stop spending worker slots on quick retries
+            delay = max_backoff
+        else:
+            min_backoff = actor.options.get("min_backoff", policy["min_backoff"])
+            _, delay = compute_backoff(retries, factor=min_backoff, max_backoff=max_backoff)
+        print(f"[broker] Retrying {message.actor_name} ({message.message_id}) in {delay}ms: {exception}")
+        # Slots expire TENANT_SLOT_TTL after their score, so date it from the next attempt
+        refresh_tenant_slot(broker, message, time.time() + delay / 1000)
+        broker.enqueue(message, delay=delay)
+
+    def abandon(self, broker, message, exception):
+        """Fail the node and run of a node task that will never complete, free its slot and wake waiters"""
+        node = node_message(message)
+        if not node:
+            return
+        run_id, node_id = node
+        try:
+            release_tenant_slot(broker, message)
+            # A cancelled run, or one the deadline sweep already failed, keeps its status
+            failed = runs_collection().update_one(
+                {"_id": as_object_id(run_id), "status": {"$in": ["queued", "running"]}},
+                {"$set": {"status": "failed", f"node_status.{node_id}": "failed", "error": str(exception),
+                          "completed_at": time.time()}}
+            )
+            if failed.modified_count:
+                notify_run_finished(run_id, "failed")
+        except Exception as e:
+            print(f"[broker] Failed to clean up after {message.message_id}: {e}")
+
+    def dead_letter(self, broker, message, exception, kind):
+        entry = message.asdict()
+        entry.update({
+            "error": str(exception),
+            "error_type": type(exception).__name__,
+            "classification": kind,
+            "failed_at": time.time(),
+            "run_id": dead_letter_run_id(entry),
+        })
+        print(f"[broker] Dead-lettering {message.actor_name} ({message.message_id}): {exception}")
+        try:
+            client = broker.client
+            pipe = client.pipeline()
+            pipe.hset(DEAD_LETTER_KEY, message.message_id, json_dumps(entry))
+            pipe.zadd(DEAD_LETTER_INDEX, {message.message_id: entry["failed_at"]})
+            if entry["run_id"]:
+                pipe.sadd(f"{DEAD_LETTER_KEY}:run:{entry['run_id']}", message.message_id)
+            pipe.execute()
+            # Keep the dead-letter store bounded
+            overflow = client.zcard(DEAD_LETTER_INDEX) - DEAD_LETTER_MAX
+            if overflow > 0:
+                oldest = client.zrange(DEAD_LETTER_INDEX, 0, overflow - 1)
+                pipe = client.pipeline()
+                pipe.zrem(DEAD_LETTER_INDEX, *oldest)
+                pipe.hdel(DEAD_LETTER_KEY, *oldest)
+                pipe.execute()
+        except Exception as e:
+            print(f"[broker] Failed to record dead letter {message.message_id}: {e}")
+
+
+def list_dead_letters(run_id: str = None, limit: int = 100) -> list:
+    """Return dead-lettered messages, newest first, optionally for one run"""
+    client = redis_broker.client
+    if run_id:
+        ids = list(client.smembers(f"{DEAD_LETTER_KEY}:run:{run_id}"))
+    else:
+        ids = client.zrevrange(DEAD_LETTER_INDEX, 0, limit - 1)
+    if not ids:
+        return []
+    entries = [json_loads(raw) for raw in client.hmget(DEAD_LETTER_KEY, ids) if raw]
+    entries.sort(key=lambda e: e.get("failed_at", 0), reverse=True)
+    return entries[:limit]
+
+
+def get_dead_letter(message_id: str):
+    raw = redis_broker.client.hget(DEAD_LETTER_KEY, message_id)
+    return json_loads(raw) if raw else None
+
+
+# Options of a dead-lettered message that describe its failed delivery, not the work itself
+REPLAY_DROPPED_OPTIONS = ("retries", "traceback", "requeue_timestamp", "redis_message_id", "eta")
+
+
+def replay_dead_letter(message_id: str):
+    """Re-enqueue a dead-lettered message with a fresh retry budget and drop it from the store"""
+    entry = get_dead_letter(message_id)
+    if not entry:
+        return None
+    # Keep the lane, deadline and time budget; only the failure bookkeeping starts over
+    options = {k: v for k, v in (entry.get("options") or {}).items() if k not in REPLAY_DROPPED_OPTIONS}
+    options["replayed_from"] = message_id
+    message = dramatiq.Message(
+        queue_name=entry["queue_name"],
+        actor_name=entry["actor_name"],
+        args=tuple(entry.get("args") or ()),
+        kwargs=entry.get("kwargs") or {},
+        options=options,
+    )
+    redis_broker.enqueue(message)
+    client = redis_broker.client
+    pipe = client.pipeline()
+    pipe.hdel(DEAD_LETTER_KEY, message_id)
+    pipe.zrem(DEAD_LETTER_INDEX, message_id)
+    if entry.get("run_id"):
+        pipe.srem(f"{DEAD_LETTER_KEY}:run:{entry['run_id']}", message_id)
+    pipe.execute()
+    return message
+
+
+def json_default(value):
+    """JSON form of values outside JSON, shared by messages and API responses: datetimes as
+    ISO 8601, sets as lists, anything else (ObjectId, UUID, Decimal, ...) as its string"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def json_dumps(data) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson refuses integers beyond 64 bits; the stdlib does not
+            pass
+    return json.dumps(data, separators=(",", ":"), default=json_default).encode("utf-8")
+
+
+def json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+_codec = threading.local()
+
+
+def _zstd():
+    # zstandard (de)compressors must not be shared between threads
+    if not hasattr(_codec, "compressor"):
+        _codec.compressor = zstandard.ZstdCompressor(level=BROKER_COMPRESS_LEVEL)
+        _codec.decompressor = zstandard.ZstdDecompressor()
+    return _codec.compressor, _codec.decompressor
+
+
+def compress_message(data: bytes) -> bytes:
+    if len(data) < BROKER_COMPRESS_MIN_BYTES:
+        return data
+    if zstandard is not None:
+        packed = ZSTD_MARKER + _zstd()[0].compress(data)
+    else:
+        packed = ZLIB_MARKER + zlib.compress(data, min(BROKER_COMPRESS_LEVEL, 9))
+    return packed if len(packed) < len(data) else data
+
+
+def decompress_message(data: bytes) -> bytes:
+    marker = data[:1]
+    if marker == ZSTD_MARKER:
+        if zstandard is None:
+            raise DecodeError("zstd-compressed message but zstandard is not installed", data, None)
+        return _zstd()[1].decompress(data[1:])
+    if marker == ZLIB_MARKER:
+        return zlib.decompress(data[1:])
+    return data
+
+
+class MessageEncoder(Encoder):
+    """Dramatiq encoder on orjson; large messages are compressed.
+
+    Uncompressed messages stay plain JSON, and every process decodes every codec, so old
+    and new processes interoperate as long as all of them have zstandard installed.
+    """
+
+    def encode(self, data) -> bytes:
+        raw = json_dumps(data)
+        stored = compress_message(raw)
+        if broker_message_bytes is not None:
+            broker_message_bytes.labels(kind="raw").inc(len(raw))
+            broker_message_bytes.labels(kind="stored").inc(len(stored))
+        return stored
+
+    def decode(self, data: bytes):
+        try:
+            return json_loads(decompress_message(data))
+        except (ValueError, zlib.error) as e:
+            raise DecodeError(f"failed to decode message {data[:64]!r}", data, e) from None
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise DecodeError(f"failed to decode message {data[:64]!r}", data, e) from None
+            raise
+
+
+def broker_metrics() -> dict:
+    """Redis memory and network counters plus the backlog and memory of every queue"""
+    client = redis_broker.client
+    memory = client.info("memory")
+    stats = client.info("stats")
+    queues = sorted(redis_broker.get_declared_queues() | redis_broker.get_declared_delay_queues())
+    pipe = client.pipeline(transaction=False)
+    for queue in queues:
+        key = f"{redis_broker.namespace}:{queue}.msgs"
+        pipe.hlen(key)
+        pipe.memory_usage(key, samples=50)
+    results = pipe.execute()
+    return {
+        "redis": {
+            "used_memory": memory.get("used_memory"),
+            "used_memory_peak": memory.get("used_memory_peak"),
+            "maxmemory": memory.get("maxmemory"),
+            "mem_fragmentation_ratio": memory.get("mem_fragmentation_ratio"),
+            "total_net_input_bytes": stats.get("total_net_input_bytes"),
+            "total_net_output_bytes": stats.get("total_net_output_bytes"),
+            "instantaneous_input_kbps": stats.get("instantaneous_input_kbps"),
+            "instantaneous_output_kbps": stats.get("instantaneous_output_kbps"),
+        },
+        "queues": {
+            queue: {"messages": results[2 * i], "bytes": results[2 * i + 1] or 0}
+            for i, queue in enumerate(queues)
+            if results[2 * i]
+        },
+        "compression": {
+            "codec": "zstd" if zstandard is not None else "zlib",
+            "min_bytes": BROKER_COMPRESS_MIN_BYTES,
+        },
+    }
+
+
+dramatiq.set_encoder(MessageEncoder())
+
+# Create Redis broker; the stock Retries middleware is replaced by RetryPolicy, and
+# Deadlines must run before TimeLimit reads the message's time_limit
+middleware = []
+for _middleware in default_middleware:
+    if _middleware in (Retries, AgeLimit):
+        continue
+    if _middleware is TimeLimit:
+        middleware.append(Deadlines())
+    middleware.append(_middleware())
+redis_broker = RedisBroker(url=REDIS_URL, middleware=middleware)
 
 # Add middleware only once
-redis_broker.add_middleware(Retries(retry_when=lambda m, e: True, max_retries=3))
+redis_broker.add_middleware(RetryPolicy())
+redis_broker.add_middleware(LaneContext())
+redis_broker.add_middleware(Cancellation())
 redis_broker.add_middleware(AgeLimit(max_age=60*60))
 
+# Declare every lane queue so workers started with --queues can consume them
+for _queue in BASE_QUEUES:
+    for _lane in LANES:
+        redis_broker.declare_queue(lane_queue(_queue, _lane))
+
 # Set as the default broker
 dramatiq.set_broker(redis_broker)
 
 # Export the broker for use in other modules
-__all__ = ['redis_broker'] 
\ No newline at end of file
+__all__ = [
+    'redis_broker', 'TransientError', 'PermanentError', 'classify_exception',
+    'RunCancelled', 'CancellationToken', 'request_cancellation', 'is_run_cancelled',
+    'TENANT_INFLIGHT_KEY', 'TENANTS_BACKLOGGED_KEY', 'request_pending_dispatch',
+    'DeadlineExceeded', 'current_deadline', 'remaining_budget', 'notify_run_finished', 'wait_for_run',
+    'list_dead_letters', 'get_dead_letter', 'replay_dead_letter',
+    'LANES', 'DEFAULT_LANE', 'lane_queue', 'current_lane', 'send_in_lane',
+    'scheduling_latency_percentiles', 'enqueue_many', 'SCHEDULES_CHANGED_CHANNEL',
+    'WEBHOOK_EVENTS_KEY', 'WEBHOOK_DRAIN_KEY', 'WEBHOOK_DUE_KEY', 'WEBHOOK_PROCESSING_KEY', 'WEBHOOK_BUFFER_MAX',
+    'current_message_id',
+    'INGEST_PROGRESS_CHANNEL', 'record_ingest_completed', 'ingest_throughput',
+    'json_dumps', 'json_loads', 'json_default', 'broker_metrics',
+]
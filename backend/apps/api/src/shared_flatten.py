@@ -0,0 +1,169 @@
+import io
+import os
+import re
+import json
+from decimal import Decimal
+from typing import Any, Iterator, Tuple, IO
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Shared by the API (/ingest/webhook) and the worker (ingest.webhook, JSON bodies of ingest.url).
+# Structured payloads become one "<JSONPath>: <value>" line per leaf, e.g.
+#   $.order.items[0].sku: A-12
+# so text nodes and embeddings see field names, while the structure itself is stored alongside.
+FLATTEN_MAX_DEPTH = int(os.getenv("FLATTEN_MAX_DEPTH", "32"))
+FLATTEN_MAX_CHARS = int(os.getenv("FLATTEN_MAX_CHARS", str(1_000_000)))
+
+# Same key syntax the text.transform json_path op accepts, so emitted paths can be fed back to it
+_PLAIN_KEY = re.compile(r"^[A-Za-z_][\w-]*$")
+
+
+def child_path(path: str, key) -> str:
+    if isinstance(key, int):
+        return f"{path}[{key}]"
+    key = str(key)
+    if _PLAIN_KEY.match(key):
+        return f"{path}.{key}"
+    if "\\" not in key:
+        if "'" not in key:
+            return f"{path}['{key}']"
+        if '"' not in key:
+            return f'{path}["{key}"]'
+    # Both quote kinds (or a backslash): escape within single quotes
+    escaped = key.replace("\\", "\\\\").replace("'", "\\'")
+    return f"{path}['{escaped}']"
+
+
+def format_scalar(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, Decimal):
+        # ijson yields non-integer numbers as Decimal; render them as json.loads' floats would be
+        value = float(value)
+    if isinstance(value, str):
+        # One leaf per line: multi-line strings are escaped rather than split
+        return json.dumps(value, ensure_ascii=False) if "\n" in value or "\r" in value else value
+    return str(value)
+
+
+class LineWriter:
+    """StringIO of "<path>: <value>" lines that stops accepting input past `max_chars`"""
+
+    def __init__(self, max_chars: int = FLATTEN_MAX_CHARS):
+        self.buffer = io.StringIO()
+        self.remaining = max_chars
+        self.full = False
+
+    def write(self, path: str, text: str):
+        if self.full:
+            return
+        line = f"{path}: {text}\n"
+        if len(line) > self.remaining:
+            self.buffer.write(line[:self.remaining])
+            self.buffer.write("\n... (truncated)\n")
+            self.full = True
+            return
+        self.buffer.write(line)
+        self.remaining -= len(line)
+
+    def getvalue(self) -> str:
+        return self.buffer.getvalue().rstrip("\n")
+
+
+def _children(path: str, node) -> Iterator[Tuple[str, Any]]:
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield child_path(path, key), value
+    else:
+        for index, value in enumerate(node):
+            yield child_path(path, index), value
+
+
+def flatten_to_text(value: Any, max_depth: int = FLATTEN_MAX_DEPTH, max_chars: int = FLATTEN_MAX_CHARS) -> str:
+    """Render a JSON-like value as JSONPath-keyed lines in one iterative pass.
+
+    Containers deeper than `max_depth` are summarised instead of expanded, and output stops
+    at `max_chars`; children are walked lazily, so a capped render of a huge list is cheap.
+    """
+    out = LineWriter(max_chars)
+    stack = [iter((("$", value),))]
+    while stack and not out.full:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        path, node = entry
+        if isinstance(node, (dict, list, tuple)):
+            if not node:
+                out.write(path, "{}" if isinstance(node, dict) else "[]")
+            elif len(stack) > max_depth:
+                out.write(path, f"<{'object' if isinstance(node, dict) else 'array'} beyond depth {max_depth}>")
+            else:
+                stack.append(_children(path, node))
+        else:
+            out.write(path, format_scalar(node))
+    return out.getvalue()
+
+
+def flatten_json_stream(stream: IO[bytes], max_depth: int = FLATTEN_MAX_DEPTH,
+                        max_chars: int = FLATTEN_MAX_CHARS) -> str:
+    """flatten_to_text for a JSON document read from a binary stream.
+
+    With ijson installed the document is never materialised: lines are emitted from parser
+    events and reading stops once `max_chars` is reached. Without it the stream is loaded.
+    """
+    if ijson is None:
+        return flatten_to_text(json.load(stream), max_depth, max_chars)
+
+    out = LineWriter(max_chars)
+    # Open containers: [path, is_array, current key or next index, children seen]
+    frames = []
+    skipping = 0
+
+    def value_path() -> str:
+        if not frames:
+            return "$"
+        path, is_array, position, _ = frames[-1]
+        return child_path(path, position)
+
+    def value_done():
+        if frames:
+            frames[-1][3] += 1
+            if frames[-1][1]:
+                frames[-1][2] += 1
+
+    for _, event, value in ijson.parse(stream):
+        if out.full:
+            break
+        if skipping:
+            # Inside a container beyond max_depth
+            if event in ("start_map", "start_array"):
+                skipping += 1
+            elif event in ("end_map", "end_array"):
+                skipping -= 1
+                if not skipping:
+                    value_done()
+            continue
+        if event == "map_key":
+            frames[-1][2] = value
+        elif event in ("start_map", "start_array"):
+            path = value_path()
+            if len(frames) >= max_depth:
+                out.write(path, f"<{'object' if event == 'start_map' else 'array'} beyond depth {max_depth}>")
+                skipping = 1
+            else:
+                frames.append([path, event == "start_array", 0 if event == "start_array" else None, 0])
+        elif event in ("end_map", "end_array"):
+            path, _, _, seen = frames.pop()
+            if not seen:
+                out.write(path, "{}" if event == "end_map" else "[]")
+            value_done()
+        else:
+            out.write(value_path(), format_scalar(value))
+            value_done()
+    return out.getvalue()
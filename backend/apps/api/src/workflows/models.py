@@ -2,6 +2,7 @@ from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from enum import Enum
+from ..runs.models import RunLane
 
 class NodeType(str, Enum):
     # Ingest nodes
@@ -43,6 +44,24 @@ class WorkflowEdge(BaseModel):
     sourceHandle: Optional[str] = Field(default=None, description="Source handle")
     targetHandle: Optional[str] = Field(default=None, description="Target handle")
 
+class WorkflowAnalysis(BaseModel):
+    """Static analysis computed when the workflow graph is saved"""
+    node_count: int = Field(default=0, description="Number of nodes")
+    critical_path: List[str] = Field(default_factory=list, description="Longest dependency chain, as node IDs")
+    critical_path_length: int = Field(default=0, description="Nodes on the critical path")
+    max_parallel_width: int = Field(default=0, description="Most nodes at the same depth, i.e. that can run at once")
+
+class WorkflowGraph(BaseModel):
+    """Request model for validating a graph without saving it"""
+    nodes: List[WorkflowNode] = Field(default_factory=list, description="Workflow nodes")
+    edges: List[WorkflowEdge] = Field(default_factory=list, description="Workflow edges")
+
+class WorkflowValidation(BaseModel):
+    """Result of validating a workflow graph"""
+    valid: bool = Field(description="Whether the graph can be saved")
+    problems: List[str] = Field(default_factory=list, description="Everything that makes the graph invalid")
+    analysis: Optional[WorkflowAnalysis] = Field(default=None, description="Analysis of a valid graph")
+
 class WorkflowCreate(BaseModel):
     """Request model for creating a workflow"""
     name: str = Field(..., description="Workflow name")
@@ -65,12 +84,84 @@ class Workflow(BaseModel):
     version: int = Field(default=1, description="Workflow version")
     nodes: List[WorkflowNode] = Field(default_factory=list, description="Workflow nodes")
     edges: List[WorkflowEdge] = Field(default_factory=list, description="Workflow edges")
+    analysis: Optional[WorkflowAnalysis] = Field(default=None, description="Static analysis of the graph")
     created_at: datetime = Field(default_factory=datetime.utcnow, description="Creation timestamp")
     updated_at: datetime = Field(default_factory=datetime.utcnow, description="Last update timestamp")
     created_by: Optional[str] = Field(default=None, description="User who created the workflow")
     is_active: bool = Field(default=True, description="Whether the workflow is active")
 
+class WorkflowSummary(BaseModel):
+    """Workflow as listed on the dashboard: metadata and graph size, without the graph"""
+    id: str = Field(description="Unique workflow identifier")
+    name: str = Field(description="Workflow name")
+    description: Optional[str] = Field(default=None, description="Workflow description")
+    version: int = Field(default=1, description="Workflow version")
+    node_count: int = Field(default=0, description="Number of nodes")
+    edge_count: int = Field(default=0, description="Number of edges")
+    created_at: Optional[datetime] = Field(default=None, description="Creation timestamp")
+    updated_at: Optional[datetime] = Field(default=None, description="Last update timestamp")
+
+class WorkflowSummaryList(BaseModel):
+    """Response model for listing workflow summaries"""
+    workflows: List[WorkflowSummary] = Field(description="List of workflow summaries")
+    total: Optional[int] = Field(default=None, description="Number of workflows, with include_total; may lag by LIST_COUNT_TTL")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor for the next page; absent on the last page")
+
 class WorkflowList(BaseModel):
     """Response model for listing workflows"""
     workflows: List[Workflow] = Field(description="List of workflows")
-    total: int = Field(description="Total number of workflows") 
\ No newline at end of file
+    total: Optional[int] = Field(default=None, description="Number of workflows, with include_total; may lag by LIST_COUNT_TTL")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor for the next page; absent on the last page")
+
+class ScheduleCreate(BaseModel):
+    """Request model for creating or replacing a workflow schedule"""
+    cron: Optional[str] = Field(default=None, description="Cron expression, e.g. '0 9 * * *'")
+    interval_seconds: Optional[int] = Field(default=None, ge=60, description="Fixed interval in seconds")
+    timezone: str = Field(default="UTC", description="IANA timezone the cron expression is evaluated in")
+    lane: RunLane = Field(default=RunLane.BATCH, description="Priority lane for scheduled runs")
+    inputs: Dict[str, Any] = Field(default_factory=dict, description="Run inputs")
+    enabled: bool = Field(default=True, description="Whether the schedule fires")
+
+class Schedule(BaseModel):
+    """Workflow schedule model"""
+    id: str = Field(description="Unique schedule identifier")
+    workflow_id: str = Field(description="Workflow ID this schedule runs")
+    cron: Optional[str] = Field(default=None, description="Cron expression")
+    interval_seconds: Optional[int] = Field(default=None, description="Fixed interval in seconds")
+    timezone: str = Field(default="UTC", description="IANA timezone")
+    lane: RunLane = Field(default=RunLane.BATCH, description="Priority lane for scheduled runs")
+    inputs: Dict[str, Any] = Field(default_factory=dict, description="Run inputs")
+    enabled: bool = Field(default=True, description="Whether the schedule fires")
+    next_fire_at: Optional[datetime] = Field(default=None, description="Next fire time (UTC), once computed by the scheduler")
+    last_fired_at: Optional[datetime] = Field(default=None, description="Last fire time (UTC)")
+    created_at: datetime = Field(description="Creation timestamp")
+    updated_at: datetime = Field(description="Last update timestamp")
+
+class ScheduleList(BaseModel):
+    """Response model for listing schedules"""
+    schedules: List[Schedule] = Field(description="List of schedules")
+    total: int = Field(description="Total number of schedules")
+
+class WebhookMode(str, Enum):
+    PER_EVENT = "per_event"    # one run per event
+    COALESCE = "coalesce"      # events arriving within window_ms share one run
+    DEBOUNCE = "debounce"      # one run once no event arrived for window_ms
+
+class WebhookConfig(BaseModel):
+    """Request model for enabling or updating a workflow's webhook trigger"""
+    mode: WebhookMode = Field(default=WebhookMode.PER_EVENT, description="How bursts of events map onto runs")
+    window_ms: int = Field(default=0, ge=0, le=300000, description="Coalescing/debounce window in milliseconds")
+    max_batch: int = Field(default=100, ge=1, le=1000, description="Most events one coalesced run receives")
+    lane: RunLane = Field(default=RunLane.MANUAL, description="Priority lane for triggered runs")
+
+class Webhook(BaseModel):
+    """Workflow webhook trigger model"""
+    workflow_id: str = Field(description="Workflow ID this webhook triggers")
+    path: str = Field(description="Trigger path; POST events to it")
+    token: Optional[str] = Field(default=None, description="Secret token, only returned when it is created or rotated")
+    mode: WebhookMode = Field(description="How bursts of events map onto runs")
+    window_ms: int = Field(description="Coalescing/debounce window in milliseconds")
+    max_batch: int = Field(description="Most events one coalesced run receives")
+    lane: RunLane = Field(description="Priority lane for triggered runs")
+    created_at: datetime = Field(description="Creation timestamp")
+    updated_at: datetime = Field(description="Last update timestamp")
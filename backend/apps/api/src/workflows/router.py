@@ -1,34 +1,54 @@
+import asyncio
+import secrets
+import dramatiq
 from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import List
+from fastapi.responses import JSONResponse, Response
+from typing import List, Optional, Union
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from croniter import croniter
 from .models import (
-    Workflow, WorkflowCreate, WorkflowUpdate, WorkflowList,
-    WorkflowNode, WorkflowEdge
+    Workflow, WorkflowCreate, WorkflowUpdate, WorkflowList, WorkflowSummary, WorkflowSummaryList,
+    WorkflowNode, WorkflowEdge, WorkflowGraph, WorkflowValidation, Schedule, ScheduleCreate, ScheduleList, Webhook, WebhookConfig
 )
 from ..auth.router import get_current_user
 from ..auth.models import User
-from ..database import get_workflows_collection
-from ..runs.models import RunCreate
+from ..pagination import keyset_query, keyset_sort, next_cursor, cached_count
+from ..database import (
+    get_workflows_collection, get_workflow_versions_collection, get_schedules_collection, get_runs_collection,
+    get_run_batches_collection
+)
+from ..runs.models import RunCreate, RunLane, RunBatchCreate, RunBatch, RunStatus
+from ..hooks.services import webhook_registry, hash_webhook_token
+from ..shared_workflow import compile_workflow, WorkflowCompileError
+from ..shared_broker import lane_queue, redis_broker, enqueue_many, wait_for_run, SCHEDULES_CHANGED_CHANNEL
 
 router = APIRouter()
 
+TERMINAL_RUN_STATUSES = (RunStatus.SUCCEEDED.value, RunStatus.FAILED.value, RunStatus.CANCELLED.value)
+CONCURRENT_EDIT = "Workflow was changed by another request; reload it and retry"
+
 @router.post("", response_model=Workflow)
 async def create_workflow(
     workflow: WorkflowCreate,
     current_user: User = Depends(get_current_user)
 ):
     """Create a new workflow"""
-    print(f"DEBUG: Creating workflow with data: {workflow}")
     collection = get_workflows_collection()
+    nodes, edges = graph_docs(workflow.nodes, workflow.edges)
+    compiled = compile_or_400(nodes, edges)
     
     # Create workflow document
     workflow_doc = {
         "name": workflow.name,
         "description": workflow.description,
         "version": 1,
-        "nodes": [node.dict() for node in workflow.nodes],
-        "edges": [edge.dict() for edge in workflow.edges],
+        "nodes": nodes,
+        "edges": edges,
+        "analysis": compiled["analysis"],
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow(),
         "created_by": current_user.id,
@@ -36,33 +56,113 @@ async def create_workflow(
     }
     
     result = await collection.insert_one(workflow_doc)
+    await save_version(str(result.inserted_id), 1, nodes, edges, compiled, current_user.id)
     workflow_doc["id"] = str(result.inserted_id)
     
     return Workflow(**workflow_doc)
 
-@router.get("", response_model=WorkflowList)
+def graph_docs(nodes: List[WorkflowNode], edges: List[WorkflowEdge]):
+    """Nodes and edges as stored: JSON types only, so node types are plain strings"""
+    return [node.model_dump(mode="json") for node in nodes], [edge.model_dump(mode="json") for edge in edges]
+
+def compile_or_400(nodes, edges):
+    """Compile a graph being saved; an invalid one is rejected before any run can start it"""
+    try:
+        return compile_workflow(nodes, edges)
+    except WorkflowCompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def next_version(wf_id: str, current: int) -> int:
+    """Number for a new snapshot: past every stored one, so a snapshot orphaned by an edit that
+    died before bumping the workflow is skipped rather than blocking later edits"""
+    latest = await get_workflow_versions_collection().find_one(
+        {"workflow_id": wf_id}, {"version": 1}, sort=[("version", -1)]
+    )
+    return max(current, latest["version"] if latest else 0) + 1
+
+async def save_version(wf_id: str, version: int, nodes, edges, compiled, created_by: str):
+    """Store the immutable snapshot runs of this version execute.
+
+    A snapshot already stored under the number (by a worker compiling it, or a repeated
+    request) is fine when it holds the same graph; a different one means a concurrent edit.
+    """
+    versions = get_workflow_versions_collection()
+    try:
+        await versions.insert_one({
+            "workflow_id": wf_id,
+            "version": version,
+            "nodes": nodes,
+            "edges": edges,
+            "compiled": compiled,
+            "created_at": datetime.utcnow(),
+            "created_by": created_by
+        })
+    except DuplicateKeyError:
+        stored = await versions.find_one({"workflow_id": wf_id, "version": version}, {"nodes": 1, "edges": 1})
+        if not stored or stored.get("nodes") != nodes or stored.get("edges") != edges:
+            raise HTTPException(status_code=409, detail=CONCURRENT_EDIT)
+
+@router.post("/validate", response_model=WorkflowValidation)
+async def validate_workflow(
+    graph: WorkflowGraph,
+    current_user: User = Depends(get_current_user)
+):
+    """Check a graph the way saving it would, and analyze it, without saving anything"""
+    nodes, edges = graph_docs(graph.nodes, graph.edges)
+    try:
+        compiled = compile_workflow(nodes, edges)
+    except WorkflowCompileError as e:
+        return WorkflowValidation(valid=False, problems=e.problems)
+    return WorkflowValidation(valid=True, analysis=compiled["analysis"])
+
+# Summary fields computed in Mongo, so list pages never transfer or parse the graphs
+WORKFLOW_SUMMARY_PROJECTION = {
+    "name": 1,
+    "description": 1,
+    "version": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "node_count": {"$size": {"$ifNull": ["$nodes", []]}},
+    "edge_count": {"$size": {"$ifNull": ["$edges", []]}},
+}
+
+@router.get("", response_model=Union[WorkflowSummaryList, WorkflowList])
 async def list_workflows(
-    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
     limit: int = Query(100, ge=1, le=1000),
+    include_total: bool = Query(False, description="Also return the number of workflows (cached briefly)"),
+    include_graph: bool = Query(False, description="Return full workflows with nodes and edges instead of summaries"),
     current_user: User = Depends(get_current_user)
 ):
-    """List workflows for the current user"""
+    """List workflows for the current user, most recently updated first"""
     collection = get_workflows_collection()
+    query = {"created_by": current_user.id, "is_active": True}
     
-    # Count total workflows
-    total = await collection.count_documents({"created_by": current_user.id, "is_active": True})
+    total = await cached_count(collection, query) if include_total else None
     
-    # Get workflows with pagination
-    cursor = collection.find(
-        {"created_by": current_user.id, "is_active": True}
-    ).skip(skip).limit(limit).sort("updated_at", -1)
+    # Keyset pagination on (updated_at, _id)
+    if include_graph:
+        docs = await collection.find(
+            keyset_query(query, "updated_at", cursor)
+        ).sort(keyset_sort("updated_at")).limit(limit + 1).to_list(length=limit + 1)
+        cursor_out = next_cursor(docs, limit, "updated_at")
+        workflows = []
+        for doc in docs:
+            doc["id"] = str(doc["_id"])
+            workflows.append(Workflow(**doc))
+        return WorkflowList(workflows=workflows, total=total, next_cursor=cursor_out)
     
-    workflows = []
-    async for doc in cursor:
-        doc["id"] = str(doc["_id"])
-        workflows.append(Workflow(**doc))
-    
-    return WorkflowList(workflows=workflows, total=total)
+    docs = await collection.aggregate([
+        {"$match": keyset_query(query, "updated_at", cursor)},
+        {"$sort": dict(keyset_sort("updated_at"))},
+        {"$limit": limit + 1},
+        {"$project": WORKFLOW_SUMMARY_PROJECTION},
+    ]).to_list(length=limit + 1)
+    cursor_out = next_cursor(docs, limit, "updated_at")
+    # Documents come from our own collection: construct without validation, serialize once
+    summaries = [WorkflowSummary.model_construct(id=str(doc.pop("_id")), **doc) for doc in docs]
+    body = WorkflowSummaryList.model_construct(workflows=summaries, total=total, next_cursor=cursor_out)
+    return Response(content=body.model_dump_json(), media_type="application/json")
 
 @router.get("/{wf_id}", response_model=Workflow)
 async def get_workflow(
@@ -96,7 +196,6 @@ async def update_workflow(
     current_user: User = Depends(get_current_user)
 ):
     """Update a workflow"""
-    print(f"DEBUG: Updating workflow {wf_id} with data: {workflow_update}")
     collection = get_workflows_collection()
     
     try:
@@ -115,23 +214,37 @@ async def update_workflow(
             update_data["name"] = workflow_update.name
         if workflow_update.description is not None:
             update_data["description"] = workflow_update.description
-        if workflow_update.nodes is not None:
-            update_data["nodes"] = [node.dict() for node in workflow_update.nodes]
-            update_data["version"] = existing.get("version", 1) + 1
-        if workflow_update.edges is not None:
-            update_data["edges"] = [edge.dict() for edge in workflow_update.edges]
         
-        # Update workflow
-        result = await collection.update_one(
-            {"_id": ObjectId(wf_id)},
-            {"$set": update_data}
-        )
+        # A graph change is a new version; runs keep executing the version they started on
+        update = {"$set": update_data}
+        compiled = None
+        if workflow_update.nodes is not None or workflow_update.edges is not None:
+            nodes, edges = graph_docs(workflow_update.nodes or [], workflow_update.edges or [])
+            if workflow_update.nodes is None:
+                nodes = existing.get("nodes", [])
+            if workflow_update.edges is None:
+                edges = existing.get("edges", [])
+            compiled = compile_or_400(nodes, edges)
         
-        if result.modified_count == 0:
-            raise HTTPException(status_code=400, detail="No changes made")
+        # The snapshot is stored before the workflow points at it, and the bump only applies
+        # to the version it was built from, so no run can start a version without a snapshot
+        query = {"_id": ObjectId(wf_id)}
+        if compiled is not None:
+            version = existing.get("version", 1)
+            new_version = await next_version(wf_id, version)
+            await save_version(wf_id, new_version, nodes, edges, compiled, current_user.id)
+            query["version"] = version if "version" in existing else {"$exists": False}
+            update_data.update({"nodes": nodes, "edges": edges, "analysis": compiled["analysis"],
+                                "version": new_version})
+        
+        # Update workflow
+        updated = await collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if not updated:
+            if compiled is not None:
+                raise HTTPException(status_code=409, detail=CONCURRENT_EDIT)
+            raise HTTPException(status_code=404, detail="Workflow not found")
         
         # Return updated workflow
-        updated = await collection.find_one({"_id": ObjectId(wf_id)})
         updated["id"] = str(updated["_id"])
         return Workflow(**updated)
         
@@ -178,12 +291,16 @@ async def delete_workflow(
 async def run_workflow(
     wf_id: str,
     run_data: RunCreate,
+    lane: RunLane = Query(RunLane.MANUAL, description="Priority lane for the run"),
+    wait: bool = Query(False, description="Hold the response until the run finishes"),
+    wait_ms: int = Query(10000, ge=1, le=60000, description="Longest time to wait when wait=true"),
     current_user: User = Depends(get_current_user)
 ):
-    """Start a workflow run"""
-    from ..database import get_runs_collection
-    import dramatiq
-    import json
+    """Start a workflow run.
+
+    With wait=true, small workflows whose nodes all run inline answer with their outputs in
+    the same request; runs that outlive wait_ms answer 202 and are polled as usual.
+    """
     
     # Get workflow
     collection = get_workflows_collection()
@@ -205,7 +322,10 @@ async def run_workflow(
     runs_collection = get_runs_collection()
     run_doc = {
         "workflow_id": wf_id,
+        # Pinned: editing the workflow mid-run does not change the graph this run executes
+        "workflow_version": workflow.get("version", 1),
         "status": "queued",
+        "lane": lane.value,
         "created_by": current_user.id,
         "created_at": datetime.utcnow(),
         "started_at": None,
@@ -213,7 +333,9 @@ async def run_workflow(
         "error": None,
         "node_status": {},
         "inputs": run_data.inputs,
-        "outputs": {}
+        "outputs": {},
+        # The worker turns this into an absolute deadline when the run starts
+        "timeout_ms": run_data.timeout_ms
     }
     
     result = await runs_collection.insert_one(run_doc)
@@ -221,20 +343,34 @@ async def run_workflow(
     
     # Enqueue workflow execution using Dramatiq
     try:
-        import dramatiq
-        from dramatiq import get_broker
-        
         # Create a message for the run_start actor and send it to the broker
-        broker = get_broker()
+        broker = dramatiq.get_broker()
         message = dramatiq.Message(
-            queue_name="default",
+            queue_name=lane_queue("default", lane.value),
             actor_name="run_start",
             args=[run_id],
             kwargs={},
-            options={}
+            options={"lane": lane.value}
         )
         broker.enqueue(message)
         
+        if wait:
+            status = await wait_for_run(run_id, wait_ms / 1000)
+            if status:
+                run = await runs_collection.find_one({"_id": ObjectId(run_id)})
+                return {
+                    "run_id": run_id,
+                    "status": run["status"],
+                    "outputs": run.get("outputs") or {},
+                    "error": run.get("error")
+                }
+            run = await runs_collection.find_one({"_id": ObjectId(run_id)}, {"status": 1})
+            return JSONResponse(status_code=202, content={
+                "run_id": run_id,
+                "status": run["status"],
+                "message": "Workflow still running"
+            })
+        
         return {
             "run_id": run_id,
             "status": "queued",
@@ -248,3 +384,288 @@ async def run_workflow(
             {"$set": {"status": "failed", "error": str(e)}}
         )
         raise HTTPException(status_code=500, detail=f"Failed to start workflow: {str(e)}")
+
+# Runs inserted and enqueued per round trip when submitting a batch
+RUN_BATCH_CHUNK = 1000
+
+@router.post("/{wf_id}/runs:batch", response_model=RunBatch)
+async def run_workflow_batch(
+    wf_id: str,
+    batch: RunBatchCreate,
+    lane: RunLane = Query(RunLane.BATCH, description="Priority lane for the runs"),
+    current_user: User = Depends(get_current_user)
+):
+    """Start one run per input set with bulk inserts and pipelined enqueues"""
+    workflow = await get_owned_workflow(wf_id, current_user)
+
+    now = datetime.utcnow()
+    batch_id = ObjectId()
+    await get_run_batches_collection().insert_one({
+        "_id": batch_id,
+        "workflow_id": wf_id,
+        "created_by": current_user.id,
+        "lane": lane.value,
+        "total": len(batch.inputs),
+        "created_at": now
+    })
+
+    runs_collection = get_runs_collection()
+    queue_name = lane_queue("default", lane.value)
+    counts = {"queued": 0, "failed": 0}
+    for start in range(0, len(batch.inputs), RUN_BATCH_CHUNK):
+        run_docs = [
+            {
+                "workflow_id": wf_id,
+                "workflow_version": workflow.get("version", 1),
+                "status": "queued",
+                "lane": lane.value,
+                "batch_id": str(batch_id),
+                "created_by": current_user.id,
+                "created_at": now,
+                "started_at": None,
+                "completed_at": None,
+                "error": None,
+                "node_status": {},
+                "inputs": inputs,
+                "outputs": {},
+                "timeout_ms": batch.timeout_ms
+            }
+            for inputs in batch.inputs[start:start + RUN_BATCH_CHUNK]
+        ]
+        result = await runs_collection.insert_many(run_docs)
+        messages = [
+            dramatiq.Message(
+                queue_name=queue_name,
+                actor_name="run_start",
+                args=[str(run_id)],
+                kwargs={},
+                options={"lane": lane.value}
+            )
+            for run_id in result.inserted_ids
+        ]
+        try:
+            await asyncio.to_thread(enqueue_many, messages)
+            counts["queued"] += len(messages)
+        except Exception as e:
+            # Same as a single run: runs that could not be enqueued are failed, not left queued
+            await runs_collection.update_many(
+                {"_id": {"$in": result.inserted_ids}},
+                {"$set": {"status": "failed", "error": f"Failed to enqueue run: {e}"}}
+            )
+            counts["failed"] += len(messages)
+
+    return RunBatch(
+        batch_id=str(batch_id),
+        workflow_id=wf_id,
+        total=len(batch.inputs),
+        counts={status: count for status, count in counts.items() if count},
+        completed=sum(counts.get(status, 0) for status in TERMINAL_RUN_STATUSES),
+        created_at=now
+    )
+
+async def get_owned_workflow(wf_id: str, current_user: User):
+    """Load an active workflow, enforcing ownership"""
+    try:
+        workflow = await get_workflows_collection().find_one({"_id": ObjectId(wf_id)})
+    except Exception as e:
+        if "invalid ObjectId" in str(e) or "is not a valid ObjectId" in str(e):
+            raise HTTPException(status_code=400, detail="Invalid workflow ID")
+        raise e
+    if not workflow or not workflow.get("is_active", True):
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    if workflow.get("created_by") != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return workflow
+
+def validate_schedule(schedule: ScheduleCreate):
+    if bool(schedule.cron) == bool(schedule.interval_seconds):
+        raise HTTPException(status_code=400, detail="Provide exactly one of cron or interval_seconds")
+    if schedule.cron and not croniter.is_valid(schedule.cron):
+        raise HTTPException(status_code=400, detail=f"Invalid cron expression: {schedule.cron}")
+    try:
+        ZoneInfo(schedule.timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {schedule.timezone}")
+
+def schedule_from_doc(doc) -> Schedule:
+    return Schedule(
+        id=str(doc["_id"]),
+        workflow_id=doc["workflow_id"],
+        cron=doc.get("cron"),
+        interval_seconds=doc.get("interval_seconds"),
+        timezone=doc.get("timezone", "UTC"),
+        lane=doc.get("lane", "batch"),
+        inputs=doc.get("inputs") or {},
+        enabled=doc.get("enabled", True),
+        next_fire_at=datetime.utcfromtimestamp(doc["next_fire_at"]) if doc.get("next_fire_at") else None,
+        last_fired_at=datetime.utcfromtimestamp(doc["last_fired_at"]) if doc.get("last_fired_at") else None,
+        created_at=doc["created_at"],
+        updated_at=doc["updated_at"]
+    )
+
+def notify_scheduler(schedule_id: str):
+    """Wake the scheduler so the change applies immediately instead of at its next resync"""
+    try:
+        redis_broker.client.publish(SCHEDULES_CHANGED_CHANNEL, schedule_id)
+    except Exception as e:
+        print(f"Failed to notify scheduler of schedule {schedule_id}: {e}")
+
+@router.post("/{wf_id}/schedules", response_model=Schedule)
+async def create_schedule(
+    wf_id: str,
+    schedule: ScheduleCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Schedule a workflow on a cron expression or a fixed interval"""
+    await get_owned_workflow(wf_id, current_user)
+    validate_schedule(schedule)
+
+    now = datetime.utcnow()
+    schedule_doc = {
+        "workflow_id": wf_id,
+        "created_by": current_user.id,
+        "cron": schedule.cron,
+        "interval_seconds": schedule.interval_seconds,
+        "timezone": schedule.timezone,
+        "lane": schedule.lane.value,
+        "inputs": schedule.inputs,
+        "enabled": schedule.enabled,
+        # Computed by the scheduler when it picks the schedule up
+        "next_fire_at": None,
+        "last_fired_at": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    result = await get_schedules_collection().insert_one(schedule_doc)
+    notify_scheduler(str(result.inserted_id))
+    return schedule_from_doc(schedule_doc)
+
+@router.get("/{wf_id}/schedules", response_model=ScheduleList)
+async def list_schedules(
+    wf_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """List a workflow's schedules"""
+    await get_owned_workflow(wf_id, current_user)
+    cursor = get_schedules_collection().find({"workflow_id": wf_id, "deleted": {"$ne": True}})
+    schedules = [schedule_from_doc(doc) async for doc in cursor]
+    return ScheduleList(schedules=schedules, total=len(schedules))
+
+@router.put("/{wf_id}/schedules/{schedule_id}", response_model=Schedule)
+async def update_schedule(
+    wf_id: str,
+    schedule_id: str,
+    schedule: ScheduleCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Replace a schedule; its next fire time is recomputed"""
+    await get_owned_workflow(wf_id, current_user)
+    validate_schedule(schedule)
+    if not ObjectId.is_valid(schedule_id):
+        raise HTTPException(status_code=400, detail="Invalid schedule ID")
+
+    collection = get_schedules_collection()
+    updated = await collection.find_one_and_update(
+        {"_id": ObjectId(schedule_id), "workflow_id": wf_id, "deleted": {"$ne": True}},
+        {"$set": {
+            "cron": schedule.cron,
+            "interval_seconds": schedule.interval_seconds,
+            "timezone": schedule.timezone,
+            "lane": schedule.lane.value,
+            "inputs": schedule.inputs,
+            "enabled": schedule.enabled,
+            "next_fire_at": None,
+            "updated_at": datetime.utcnow()
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    notify_scheduler(schedule_id)
+    return schedule_from_doc(updated)
+
+@router.delete("/{wf_id}/schedules/{schedule_id}")
+async def delete_schedule(
+    wf_id: str,
+    schedule_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Delete a schedule (soft delete, so the scheduler sees the change)"""
+    await get_owned_workflow(wf_id, current_user)
+    if not ObjectId.is_valid(schedule_id):
+        raise HTTPException(status_code=400, detail="Invalid schedule ID")
+
+    result = await get_schedules_collection().update_one(
+        {"_id": ObjectId(schedule_id), "workflow_id": wf_id, "deleted": {"$ne": True}},
+        {"$set": {"enabled": False, "deleted": True, "updated_at": datetime.utcnow()}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    notify_scheduler(schedule_id)
+    return {"message": "Schedule deleted successfully"}
+
+def webhook_from_doc(wf_id: str, hook, token: str = None) -> Webhook:
+    return Webhook(
+        workflow_id=wf_id,
+        path=f"/api/v1/hooks/{wf_id}/{token or '<token>'}",
+        token=token,
+        mode=hook["mode"],
+        window_ms=hook["window_ms"],
+        max_batch=hook["max_batch"],
+        lane=hook["lane"],
+        created_at=hook["created_at"],
+        updated_at=hook["updated_at"]
+    )
+
+@router.put("/{wf_id}/webhook", response_model=Webhook)
+async def put_webhook(
+    wf_id: str,
+    config: WebhookConfig,
+    rotate: bool = Query(False, description="Issue a new token; the old one stops working"),
+    current_user: User = Depends(get_current_user)
+):
+    """Enable or update the workflow's webhook trigger"""
+    workflow = await get_owned_workflow(wf_id, current_user)
+
+    now = datetime.utcnow()
+    hook = dict(workflow.get("webhook") or {})
+    token = None
+    if rotate or not hook.get("token_hash"):
+        # Only the hash is stored; the token is shown once
+        token = secrets.token_urlsafe(32)
+        hook["token_hash"] = hash_webhook_token(token)
+        hook["created_at"] = hook.get("created_at") or now
+    hook.update({
+        "mode": config.mode.value,
+        "window_ms": config.window_ms,
+        "max_batch": config.max_batch,
+        "lane": config.lane.value,
+        "updated_at": now
+    })
+    await get_workflows_collection().update_one({"_id": workflow["_id"]}, {"$set": {"webhook": hook}})
+    webhook_registry.invalidate(wf_id)
+    return webhook_from_doc(wf_id, hook, token)
+
+@router.get("/{wf_id}/webhook", response_model=Webhook)
+async def get_webhook(
+    wf_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the workflow's webhook trigger settings"""
+    workflow = await get_owned_workflow(wf_id, current_user)
+    if not workflow.get("webhook"):
+        raise HTTPException(status_code=404, detail="Webhook not enabled")
+    return webhook_from_doc(wf_id, workflow["webhook"])
+
+@router.delete("/{wf_id}/webhook")
+async def delete_webhook(
+    wf_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Disable the workflow's webhook trigger"""
+    workflow = await get_owned_workflow(wf_id, current_user)
+    if not workflow.get("webhook"):
+        raise HTTPException(status_code=404, detail="Webhook not enabled")
+    await get_workflows_collection().update_one({"_id": workflow["_id"]}, {"$unset": {"webhook": ""}})
+    webhook_registry.invalidate(wf_id)
+    return {"message": "Webhook disabled successfully"}
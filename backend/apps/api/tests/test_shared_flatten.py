@@ -0,0 +1,87 @@
+import io
+import json
+
+import pytest
+
+import shared_flatten
+from shared_flatten import flatten_json_stream, flatten_to_text
+
+DOC = {
+    "order": {"id": 17, "items": [{"sku": "A-12", "qty": 2}, {"sku": "B-7", "qty": 1}]},
+    "big": 1e20,
+    "ratio": 0.1,
+    "huge": 100000000000000000000,
+    "ok": True,
+    "note": None,
+    "empty": {},
+    "none": [],
+    "multi": "line one\nline two",
+    "with space": "x",
+    "it's": "single",
+    "a'b\"c": "both",
+    "back\\slash": "escaped",
+}
+
+EXPECTED = """$.order.id: 17
+$.order.items[0].sku: A-12
+$.order.items[0].qty: 2
+$.order.items[1].sku: B-7
+$.order.items[1].qty: 1
+$.big: 1e+20
+$.ratio: 0.1
+$.huge: 100000000000000000000
+$.ok: true
+$.note: null
+$.empty: {}
+$.none: []
+$.multi: "line one\\nline two"
+$['with space']: x
+$["it's"]: single
+$['a\\'b"c']: both
+$['back\\\\slash']: escaped"""
+
+
+def stream(value) -> io.BytesIO:
+    return io.BytesIO(json.dumps(value).encode())
+
+
+@pytest.fixture(params=["ijson", "loaded"])
+def streaming(request, monkeypatch):
+    """flatten_json_stream with the ijson parser and with the json.load fallback"""
+    if request.param == "ijson":
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(shared_flatten, "ijson", None)
+    return flatten_json_stream
+
+
+def test_in_memory():
+    assert flatten_to_text(DOC) == EXPECTED
+
+
+def test_streaming_matches_in_memory(streaming):
+    assert streaming(stream(DOC)) == EXPECTED
+
+
+def test_scalar_root(streaming):
+    assert flatten_to_text("hi") == streaming(stream("hi")) == "$: hi"
+    assert flatten_to_text(2.5) == streaming(stream(2.5)) == "$: 2.5"
+
+
+def test_depth_cap(streaming):
+    value = {"a": {"b": {"c": [1]}}, "d": [[1], 2]}
+    expected = "$.a.b: <object beyond depth 2>\n$.d[0]: <array beyond depth 2>\n$.d[1]: 2"
+    assert flatten_to_text(value, max_depth=2) == expected
+    assert streaming(stream(value), max_depth=2) == expected
+
+
+def test_size_cap(streaming):
+    value = {"items": list(range(100000))}
+    text = flatten_to_text(value, max_chars=40)
+    assert text == "$.items[0]: 0\n$.items[1]: 1\n$.items[2]: \n... (truncated)"
+    assert streaming(stream(value), max_chars=40) == text
+
+
+def test_keys_needing_quotes():
+    paths = [line.split(": ", 1)[0] for line in flatten_to_text(DOC).split("\n")]
+    assert paths[-4:] == ["$['with space']", "$[\"it's\"]", "$['a\\'b\"c']", "$['back\\\\slash']"]
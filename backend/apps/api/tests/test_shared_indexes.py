@@ -0,0 +1,39 @@
+import os
+from uuid import uuid4
+
+import pytest
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import PyMongoError
+
+from shared_indexes import INDEXES, apply_indexes, check_query_plans
+
+MONGO_URL = os.getenv("TEST_MONGO_URL", "mongodb://localhost:27017")
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"MongoDB is not reachable at {MONGO_URL}")
+    name = f"aiwf_test_{uuid4().hex[:8]}"
+    yield client[name]
+    client.drop_database(name)
+    client.close()
+
+
+def test_registered_queries_use_an_index(db):
+    assert apply_indexes(db) == []
+    assert check_query_plans(db) == []
+
+
+def test_conflicting_index_is_reported_not_rebuilt(db):
+    declared = INDEXES["runs"][0].document
+    db.runs.create_index([("created_by", ASCENDING)], name=declared["name"])
+
+    assert apply_indexes(db) == [f"runs.{declared['name']}"]
+    assert db.runs.index_information()[declared["name"]]["key"] == [("created_by", 1)]
+
+    assert apply_indexes(db, rebuild=True) == []
+    assert db.runs.index_information()[declared["name"]]["key"] == list(declared["key"].items())
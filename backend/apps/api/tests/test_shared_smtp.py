@@ -0,0 +1,137 @@
+import smtplib
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+import shared_smtp
+from shared_smtp import SMTPPool, SMTPPoolExhausted
+
+
+class Recorder:
+    """aiosmtpd handler keeping every accepted transaction"""
+
+    def __init__(self):
+        self.transactions = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.transactions.append({"peer": session.peer, "rcpt": list(envelope.rcpt_tos)})
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = Recorder()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def make_pool(controller, **kwargs):
+    kwargs.setdefault("starttls", False)
+    return SMTPPool(controller.hostname, controller.port, timeout=5, **kwargs)
+
+
+def message(to="a@example.com"):
+    msg = EmailMessage()
+    msg["From"] = "noreply@example.com"
+    msg["To"] = to
+    msg["Subject"] = "test"
+    msg.set_content("hello")
+    return msg
+
+
+def test_recipients_are_batched_over_one_session(smtp_server):
+    controller, handler = smtp_server
+    pool = make_pool(controller)
+    recipients = [f"user{i}@example.com" for i in range(5)]
+    result = pool.send_message(message(), "noreply@example.com", recipients, batch_size=2)
+    assert result == {"refused": {}, "batches": 3}
+    assert [t["rcpt"] for t in handler.transactions] == [recipients[0:2], recipients[2:4], recipients[4:]]
+    assert len({t["peer"] for t in handler.transactions}) == 1
+    pool.close()
+
+
+def test_sessions_are_reused_and_noop_checked(smtp_server, monkeypatch):
+    controller, handler = smtp_server
+    pool = make_pool(controller)
+    pool.send_message(message(), "noreply@example.com", ["a@example.com"])
+    # Idle past the keep-alive window: the session is NOOP-checked and still reused
+    pool._idle[0].last_used = time.time() - shared_smtp.SMTP_KEEPALIVE_CHECK - 1
+    pool.send_message(message(), "noreply@example.com", ["b@example.com"])
+    assert len({t["peer"] for t in handler.transactions}) == 1
+    pool.close()
+
+
+def test_dropped_session_is_replaced(smtp_server):
+    controller, handler = smtp_server
+    pool = make_pool(controller)
+    pool.send_message(message(), "noreply@example.com", ["a@example.com"])
+    # As if the server timed the idle session out
+    pool._idle[0].smtp.sock.shutdown(socket.SHUT_RDWR)
+    pool.send_message(message(), "noreply@example.com", ["b@example.com"])
+    assert [t["rcpt"] for t in handler.transactions] == [["a@example.com"], ["b@example.com"]]
+    assert len({t["peer"] for t in handler.transactions}) == 2
+    pool.close()
+
+
+def test_starttls_is_required_when_enabled(smtp_server):
+    controller, handler = smtp_server
+    # The stand-in does not offer STARTTLS; the pool must refuse rather than continue in plaintext
+    pool = make_pool(controller, starttls=True, username="user", password="secret")
+    with pytest.raises(smtplib.SMTPNotSupportedError):
+        pool.send_message(message(), "noreply@example.com", ["a@example.com"])
+    assert handler.transactions == []
+
+
+def test_busy_pool_times_out(smtp_server):
+    controller, handler = smtp_server
+    pool = make_pool(controller, size=1, acquire_timeout=0.1)
+    with pool.connection():
+        started = time.monotonic()
+        with pytest.raises(SMTPPoolExhausted):
+            pool.send_message(message(), "noreply@example.com", ["a@example.com"])
+        assert time.monotonic() - started < 2
+    # The slot is free again once the holder is done
+    pool.send_message(message(), "noreply@example.com", ["a@example.com"])
+    assert len(handler.transactions) == 1
+    pool.close()
+
+
+def send_unpooled(controller, msg):
+    with smtplib.SMTP(controller.hostname, controller.port, timeout=5) as smtp:
+        smtp.ehlo()
+        smtp.sendmail("noreply@example.com", ["a@example.com"], msg.as_string())
+
+
+def test_throughput_benchmark(smtp_server):
+    """Messages per second from 4 senders, one session per message vs the pool"""
+    controller, handler = smtp_server
+    count, msg = 200, message()
+
+    def rate(send):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(4) as senders:
+            list(senders.map(lambda _: send(), range(count)))
+        return count / (time.perf_counter() - started)
+
+    unpooled = rate(lambda: send_unpooled(controller, msg))
+    pool = make_pool(controller, size=4)
+    pooled = rate(lambda: pool.send_message(msg, "noreply@example.com", ["a@example.com"]))
+    pool.close()
+    print(f"\nSMTP throughput: {unpooled:.0f} msg/s unpooled, {pooled:.0f} msg/s pooled")
+    assert len(handler.transactions) == 2 * count
+    # 4 pooled sessions carried every pooled message
+    assert len({t["peer"] for t in handler.transactions[count:]}) <= 4
+    assert pooled > unpooled
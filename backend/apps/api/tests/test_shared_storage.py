@@ -0,0 +1,71 @@
+import os
+import socket
+from urllib.parse import urlparse
+from uuid import uuid4
+
+import pytest
+
+import shared_storage
+from shared_storage import S3Storage
+
+# MinIO from deploy/docker-compose.yml, published on the host
+S3_ENDPOINT_URL = os.getenv("TEST_S3_ENDPOINT_URL", "http://localhost:9000")
+
+
+def reachable(url: str) -> bool:
+    parsed = urlparse(url)
+    try:
+        socket.create_connection((parsed.hostname, parsed.port or 80), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    if shared_storage.boto3 is None:
+        pytest.skip("boto3 is not installed")
+    if not reachable(S3_ENDPOINT_URL):
+        pytest.skip(f"MinIO is not reachable at {S3_ENDPOINT_URL}")
+    monkeypatch.setenv("S3_ACCESS_KEY_ID", os.getenv("S3_ACCESS_KEY_ID", "minioadmin"))
+    monkeypatch.setenv("S3_SECRET_ACCESS_KEY", os.getenv("S3_SECRET_ACCESS_KEY", "minioadmin"))
+    backend = S3Storage(bucket=f"aiwf-test-{uuid4().hex[:8]}", endpoint_url=S3_ENDPOINT_URL)
+    yield backend
+    for page in backend.client.get_paginator("list_objects_v2").paginate(Bucket=backend.bucket):
+        for obj in page.get("Contents", []):
+            backend.client.delete_object(Bucket=backend.bucket, Key=obj["Key"])
+    backend.client.delete_bucket(Bucket=backend.bucket)
+
+
+def staged(tmp_path, data: bytes) -> str:
+    path = tmp_path / uuid4().hex
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_put_read_range_delete(storage, tmp_path):
+    data = bytes(range(256)) * 64
+    path = staged(tmp_path, data)
+
+    storage.put_file("blobs/abcdef", path)
+
+    assert not os.path.exists(path)
+    assert storage.exists("blobs/abcdef")
+    assert storage.size("blobs/abcdef") == len(data)
+    assert storage.read_range("blobs/abcdef", 100, 612) == data[100:612]
+    with storage.open("blobs/abcdef") as f:
+        f.seek(len(data) - 10)
+        assert f.read() == data[-10:]
+
+    storage.delete("blobs/abcdef")
+    assert not storage.exists("blobs/abcdef")
+
+
+def test_put_keeps_existing_object(storage, tmp_path):
+    storage.put_file("blobs/same", staged(tmp_path, b"first"))
+    path = staged(tmp_path, b"second")
+
+    storage.put_file("blobs/same", path)
+
+    assert not os.path.exists(path)
+    assert storage.read_range("blobs/same", 0, 5) == b"first"
@@ -0,0 +1,53 @@
+import pytest
+
+from shared_workflow import compile_workflow, WorkflowCompileError
+
+
+def node(node_id, node_type):
+    return {"id": node_id, "type": node_type, "config": {}}
+
+
+def edge(source, target):
+    return {"id": f"{source}-{target}", "source": source, "target": target}
+
+
+def problems(nodes, edges):
+    with pytest.raises(WorkflowCompileError) as exc:
+        compile_workflow(nodes, edges)
+    return exc.value.problems
+
+
+def test_chain_from_ingest_compiles():
+    compiled = compile_workflow(
+        [node("a", "ingest.webhook"), node("b", "ai.summarize"), node("c", "act.slack")],
+        [edge("a", "b"), edge("b", "c")],
+    )
+    assert compiled["order"] == ["a", "b", "c"]
+
+
+def test_single_ingest_node_compiles():
+    assert compile_workflow([node("a", "ingest.url")], [])["order"] == ["a"]
+
+
+def test_node_without_ingest_upstream_is_rejected():
+    found = problems(
+        [node("a", "ingest.pdf"), node("b", "ai.summarize"), node("c", "ai.classify"), node("d", "act.email")],
+        [edge("a", "b"), edge("c", "d")],
+    )
+    assert found == ["Nodes with no path from an ingest node: c, d"]
+
+
+def test_isolated_node_is_rejected():
+    found = problems(
+        [node("a", "ingest.pdf"), node("b", "ai.summarize"), node("c", "act.slack")],
+        [edge("a", "b")],
+    )
+    assert found == ["Nodes without edges: c"]
+
+
+def test_nodes_behind_a_cycle_are_reported_once():
+    found = problems(
+        [node("a", "ingest.pdf"), node("b", "text.transform"), node("c", "text.transform"), node("d", "act.slack")],
+        [edge("a", "b"), edge("b", "c"), edge("c", "b"), edge("c", "d")],
+    )
+    assert found == ["Cycle through: b, c", "Unreachable nodes (they depend on a cycle): d"]
@@ -1,4 +1,362 @@
+import os
 import time
-print("[scheduler] stub running (polls DB for due schedules in real impl)")
-while True:
-    time.sleep(30)
+import heapq
+import signal
+import socket
+import threading
+from uuid import uuid4
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Dict, Any, List, Optional, Tuple
+
+import dramatiq
+from croniter import croniter
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .shared_broker import (
+    redis_broker, enqueue_many, lane_queue, request_cancellation, request_pending_dispatch,
+    SCHEDULES_CHANGED_CHANNEL, TENANTS_BACKLOGGED_KEY
+)
+from .shared_indexes import apply_indexes
+
+# MongoDB connection
+mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
+mongo_client = MongoClient(mongo_url)
+db = mongo_client.aiwf
+
+# Leader lease; replicas that do not hold it stand by and retry every third of it
+SCHEDULER_LEASE = float(os.getenv("SCHEDULER_LEASE", "15"))
+# Safety-net resync for changes whose notification was missed
+SCHEDULER_SYNC_INTERVAL = float(os.getenv("SCHEDULER_SYNC_INTERVAL", "60"))
+# Most schedules fired (runs inserted and enqueued) per round trip
+SCHEDULER_FIRE_BATCH = int(os.getenv("SCHEDULER_FIRE_BATCH", "1000"))
+# How often runs past their deadline are failed and their remaining work cancelled, and
+# parked node tasks are offered slots freed without a completion (expired or lost slots)
+RUN_SWEEP_INTERVAL = float(os.getenv("RUN_SWEEP_INTERVAL", "15"))
+RUN_SWEEP_BATCH = 500
+# Scheduled runs go to the batch lane unless the schedule says otherwise
+SCHEDULE_LANE = "batch"
+
+LEADER_KEY = "aiwf:scheduler:leader"
+# Tolerated clock skew between API replicas and the scheduler when reading updated_at
+SYNC_SKEW = 5
+
+SCHEDULE_FIELDS = {
+    "workflow_id": 1, "created_by": 1, "cron": 1, "interval_seconds": 1, "timezone": 1,
+    "lane": 1, "inputs": 1, "enabled": 1, "next_fire_at": 1,
+}
+
+client = redis_broker.client
+
+# Only the holder may extend or drop the lease
+_renew = client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+_resign = client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def next_fire_time(schedule: Dict[str, Any], after: float, now: float) -> float:
+    """First fire time strictly after `after` that is not already in the past.
+
+    Fires missed while no scheduler was running are coalesced into one; interval
+    schedules stay aligned to their original grid.
+    """
+    interval = schedule.get("interval_seconds")
+    if interval:
+        interval = float(interval)
+        if after + interval > now:
+            return after + interval
+        return after + interval * (int((now - after) // interval) + 1)
+    tz = ZoneInfo(schedule.get("timezone") or "UTC")
+    start = datetime.fromtimestamp(max(after, now), tz)
+    return croniter(schedule["cron"], start).get_next(float)
+
+
+def ensure_indexes():
+    apply_indexes(db)
+
+
+class Scheduler:
+    """Fires workflow schedules from an in-memory min-heap of next fire times.
+
+    Only the replica holding the Redis leader lease fires schedules and sweeps
+    overdue runs. The heap holds (next_fire_at, schedule_id) pairs; entries
+    superseded by an edit or delete stay in the heap and are skipped when popped,
+    so every fire and update is O(log n).
+    """
+
+    def __init__(self):
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.leader = False
+        self.stopping = False
+        self.wakeup = threading.Event()
+        self.changed = False
+        self.heap: List[Tuple[float, str]] = []
+        self.due_at: Dict[str, float] = {}
+        self.schedules: Dict[str, Dict[str, Any]] = {}
+        self.synced_at: Optional[datetime] = None
+        self.next_full_sync = 0.0
+        self.next_sweep = 0.0
+
+    # Leadership
+
+    def acquire(self) -> bool:
+        return bool(client.set(LEADER_KEY, self.instance_id, nx=True, px=int(SCHEDULER_LEASE * 1000)))
+
+    def renew(self) -> bool:
+        return bool(_renew(keys=[LEADER_KEY], args=[self.instance_id, int(SCHEDULER_LEASE * 1000)]))
+
+    def resign(self):
+        if self.leader:
+            _resign(keys=[LEADER_KEY], args=[self.instance_id])
+            self.leader = False
+
+    def on_change(self, message):
+        self.changed = True
+        self.wakeup.set()
+
+    # Schedule state
+
+    def track(self, doc: Dict[str, Any], now: float, updates: List[UpdateOne], push: bool = True):
+        schedule_id = str(doc["_id"])
+        due = doc.get("next_fire_at")
+        if due is None:
+            # New or edited schedule; the API leaves the fire time to us
+            due = next_fire_time(doc, now, now)
+            updates.append(UpdateOne({"_id": doc["_id"], "next_fire_at": None}, {"$set": {"next_fire_at": due}}))
+        self.schedules[schedule_id] = doc
+        if self.due_at.get(schedule_id) == due:
+            return
+        self.due_at[schedule_id] = due
+        if push:
+            heapq.heappush(self.heap, (due, schedule_id))
+        else:
+            self.heap.append((due, schedule_id))
+
+    def untrack(self, schedule_id: str):
+        self.schedules.pop(schedule_id, None)
+        self.due_at.pop(schedule_id, None)
+
+    def load_all(self):
+        started = datetime.utcnow()
+        now = time.time()
+        self.heap, self.due_at, self.schedules = [], {}, {}
+        updates: List[UpdateOne] = []
+        for doc in db.schedules.find({"enabled": True}, SCHEDULE_FIELDS):
+            self.track(doc, now, updates, push=False)
+        heapq.heapify(self.heap)
+        if updates:
+            db.schedules.bulk_write(updates, ordered=False)
+        self.synced_at = started
+        self.next_full_sync = now + SCHEDULER_SYNC_INTERVAL
+        print(f"[scheduler] Loaded {len(self.due_at)} schedules")
+
+    def sync_changes(self):
+        """Apply schedules created, edited or disabled since the last sync"""
+        started = datetime.utcnow()
+        now = time.time()
+        updates: List[UpdateOne] = []
+        since = self.synced_at - timedelta(seconds=SYNC_SKEW) if self.synced_at else datetime.min
+        for doc in db.schedules.find({"updated_at": {"$gte": since}}, SCHEDULE_FIELDS):
+            if doc.get("enabled"):
+                self.track(doc, now, updates)
+            else:
+                self.untrack(str(doc["_id"]))
+        if updates:
+            db.schedules.bulk_write(updates, ordered=False)
+        self.synced_at = started
+        self.next_full_sync = now + SCHEDULER_SYNC_INTERVAL
+        # Drop stale entries once they outnumber live ones
+        if len(self.heap) > 2 * len(self.due_at) + 1024:
+            self.heap = [(due, sid) for sid, due in self.due_at.items()]
+            heapq.heapify(self.heap)
+
+    # Firing
+
+    def pop_due(self, now: float) -> List[Tuple[str, float]]:
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < SCHEDULER_FIRE_BATCH:
+            fire_at, schedule_id = heapq.heappop(self.heap)
+            if self.due_at.get(schedule_id) != fire_at:
+                continue
+            due.append((schedule_id, fire_at))
+        return due
+
+    def fire(self, due: List[Tuple[str, float]], now: float):
+        runs = []
+        updates = []
+        for schedule_id, fire_at in due:
+            doc = self.schedules[schedule_id]
+            next_at = next_fire_time(doc, fire_at, now)
+            self.due_at[schedule_id] = next_at
+            heapq.heappush(self.heap, (next_at, schedule_id))
+            runs.append({
+                "workflow_id": str(doc["workflow_id"]),
+                "status": "queued",
+                "lane": doc.get("lane") or SCHEDULE_LANE,
+                "created_by": doc.get("created_by"),
+                "created_at": datetime.utcnow(),
+                "started_at": None,
+                "completed_at": None,
+                "error": None,
+                "node_status": {},
+                "inputs": doc.get("inputs") or {},
+                "outputs": {},
+                "schedule_id": schedule_id,
+                "schedule_fire_key": f"{schedule_id}:{int(fire_at)}",
+                "scheduled_for": datetime.utcfromtimestamp(fire_at),
+            })
+            # Conditional, so an edit made while we were firing is not overwritten
+            updates.append(UpdateOne(
+                {"_id": doc["_id"], "next_fire_at": fire_at},
+                {"$set": {"next_fire_at": next_at, "last_fired_at": fire_at}}
+            ))
+
+        to_enqueue = self.insert_runs(runs)
+        if to_enqueue:
+            enqueue_many([
+                dramatiq.Message(
+                    queue_name=lane_queue("default", lane),
+                    actor_name="run_start",
+                    args=[str(run_id)],
+                    kwargs={},
+                    options={"lane": lane}
+                )
+                for run_id, lane in to_enqueue
+            ])
+            db.runs.update_many(
+                {"_id": {"$in": [run_id for run_id, _ in to_enqueue]}},
+                {"$set": {"enqueued_at": datetime.utcnow()}}
+            )
+        db.schedules.bulk_write(updates, ordered=False)
+        print(f"[scheduler] Fired {len(due)} schedules, enqueued {len(to_enqueue)} runs")
+
+    def insert_runs(self, runs: List[Dict[str, Any]]) -> List[Tuple[Any, str]]:
+        """Insert run documents; fires already recorded by an earlier attempt are not duplicated"""
+        try:
+            db.runs.insert_many(runs, ordered=False)
+            return [(run["_id"], run["lane"]) for run in runs]
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            failed = {err["index"] for err in errors}
+        inserted = [(run["_id"], run["lane"]) for i, run in enumerate(runs) if i not in failed]
+        # A previous leader may have crashed between inserting a run and enqueueing it
+        keys = [runs[i]["schedule_fire_key"] for i in failed]
+        orphaned = db.runs.find(
+            {"schedule_fire_key": {"$in": keys}, "status": "queued", "enqueued_at": None},
+            {"_id": 1, "lane": 1}
+        )
+        return inserted + [(run["_id"], run.get("lane") or SCHEDULE_LANE) for run in orphaned]
+
+    # Deadlines
+
+    def sweep_overdue_runs(self):
+        """Fail runs past their deadline and stop whatever node work they still have"""
+        now = time.time()
+        overdue = db.runs.find(
+            {"status": {"$in": ["queued", "running"]}, "deadline": {"$lt": now}},
+            {"_id": 1, "created_by": 1}
+        ).limit(RUN_SWEEP_BATCH)
+        failed = 0
+        for run in overdue:
+            result = db.runs.update_one(
+                {"_id": run["_id"], "status": {"$in": ["queued", "running"]}},
+                {"$set": {"status": "failed", "error": "Run exceeded its deadline", "completed_at": now}}
+            )
+            if result.modified_count:
+                request_cancellation(str(run["_id"]), tenant=run.get("created_by"))
+                failed += 1
+        if failed:
+            print(f"[scheduler] Failed {failed} overdue runs")
+        self.next_sweep = now + RUN_SWEEP_INTERVAL
+
+    def sweep_parked_nodes(self):
+        """Have a worker dispatch parked node tasks; completions normally do, but a slot that
+        expires or is freed by a crashed worker frees no one"""
+        if client.scard(TENANTS_BACKLOGGED_KEY):
+            request_pending_dispatch()
+
+    # Main loop
+
+    def tick(self) -> float:
+        """Run one leader iteration and return seconds until the next one is needed"""
+        now = time.time()
+        if self.changed or now >= self.next_full_sync:
+            self.changed = False
+            self.sync_changes()
+        if now >= self.next_sweep:
+            self.sweep_overdue_runs()
+            self.sweep_parked_nodes()
+        due = self.pop_due(now)
+        if due:
+            self.fire(due, now)
+            if self.heap and self.heap[0][0] <= time.time():
+                return 0.0
+        renew_in = SCHEDULER_LEASE / 3
+        sync_in = max(0.0, self.next_full_sync - time.time())
+        sweep_in = max(0.0, self.next_sweep - time.time())
+        fire_in = self.heap[0][0] - time.time() if self.heap else renew_in
+        return max(0.0, min(fire_in, renew_in, sync_in, sweep_in))
+
+    def run(self):
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{SCHEDULES_CHANGED_CHANNEL: self.on_change})
+        listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+        print(f"[scheduler] Started {self.instance_id}")
+        renew_at = 0.0
+        try:
+            while not self.stopping:
+                try:
+                    if not self.leader:
+                        if not self.acquire():
+                            self.wakeup.wait(SCHEDULER_LEASE / 3)
+                            self.wakeup.clear()
+                            continue
+                        self.leader = True
+                        renew_at = time.time() + SCHEDULER_LEASE / 3
+                        print(f"[scheduler] {self.instance_id} is now the leader")
+                        ensure_indexes()
+                        self.load_all()
+                    elif time.time() >= renew_at:
+                        if not self.renew():
+                            print(f"[scheduler] {self.instance_id} lost the leader lease")
+                            self.leader = False
+                            continue
+                        renew_at = time.time() + SCHEDULER_LEASE / 3
+                    timeout = min(self.tick(), max(0.0, renew_at - time.time()))
+                    if timeout > 0:
+                        self.wakeup.wait(timeout)
+                    self.wakeup.clear()
+                except Exception as e:
+                    print(f"[scheduler] Error in scheduler loop: {e}")
+                    self.resign()
+                    time.sleep(1)
+        finally:
+            self.resign()
+            listener.stop()
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        self.wakeup.set()
+
+
+def main():
+    scheduler = Scheduler()
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    scheduler.run()
+
+
+if __name__ == "__main__":
+    main()
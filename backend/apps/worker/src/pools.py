@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+from typing import Dict, Any, List
+from pymongo import MongoClient
+from .shared_broker import LANES, lane_queue
+from .shared_indexes import apply_indexes
+
+# Each pool is a separate `dramatiq` process group consuming its own queues, so slow
+# LLM calls or CPU-heavy parsing cannot starve orchestration messages.
+#   default - run_start / node_completed orchestration: small and latency sensitive
+#   actions - Slack/Sheets/Email/Notion/Twilio: I/O bound, many threads
+#   ingest  - URL fetch and webhook ingestion: I/O bound
+#   cpu     - PDF extraction and classification: one thread per process, one process per core
+#   ai      - LLM calls: bounded so provider rate limits are not blown through
+DEFAULT_POOLS: Dict[str, Dict[str, Any]] = {
+    "orchestration": {"queues": ["default"], "processes": 1, "threads": 8},
+    "actions": {"queues": ["actions"], "processes": 1, "threads": 32},
+    "ingest": {"queues": ["ingest"], "processes": 1, "threads": 8},
+    "cpu": {"queues": ["cpu"], "processes": os.cpu_count() or 2, "threads": 1},
+    "ai": {"queues": ["ai"], "processes": 1, "threads": 4},
+}
+
+# Module dramatiq imports in each pool; it registers every actor on the shared broker
+BROKER_MODULE = "src.broker"
+
+
+def load_pools() -> Dict[str, Dict[str, Any]]:
+    """Default pools, overridden per pool by the WORKER_POOLS JSON env var"""
+    pools = {name: dict(spec) for name, spec in DEFAULT_POOLS.items()}
+    overrides = json.loads(os.getenv("WORKER_POOLS", "{}"))
+    for name, spec in overrides.items():
+        if spec is None:
+            pools.pop(name, None)
+        else:
+            pools.setdefault(name, {}).update(spec)
+    enabled = os.getenv("WORKER_POOLS_ENABLED")
+    if enabled:
+        wanted = {name.strip() for name in enabled.split(",")}
+        pools = {name: spec for name, spec in pools.items() if name in wanted}
+    return pools
+
+
+def pool_command(spec: Dict[str, Any]) -> List[str]:
+    return [
+        sys.executable, "-m", "dramatiq", BROKER_MODULE,
+        "--processes", str(spec.get("processes", 1)),
+        "--threads", str(spec.get("threads", 8)),
+        # Every pool consumes all priority lanes of its queues; each lane queue has its own
+        # consumer, so a deep batch backlog does not delay interactive messages
+        "--queues", *[lane_queue(queue, lane) for queue in spec["queues"] for lane in LANES],
+    ]
+
+
+def ensure_indexes():
+    """Apply the index registry once per worker start, before any pool consumes messages"""
+    client = MongoClient(os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf"))
+    try:
+        apply_indexes(client.aiwf)
+    except Exception as e:
+        # Workers run without new indexes rather than not at all
+        print(f"[worker] Failed to apply indexes: {e}")
+    finally:
+        client.close()
+
+
+def main():
+    ensure_indexes()
+    pools = load_pools()
+    children: Dict[str, subprocess.Popen] = {}
+    for name, spec in pools.items():
+        print(f"[worker] Starting pool {name}: queues={spec['queues']} "
+              f"processes={spec.get('processes', 1)} threads={spec.get('threads', 8)}")
+        children[name] = subprocess.Popen(pool_command(spec))
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child in children.values():
+            if child.poll() is None:
+                child.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    exit_code = 0
+    while children:
+        for name, child in list(children.items()):
+            code = child.poll()
+            if code is None:
+                continue
+            del children[name]
+            if not stopping:
+                # A dead pool would silently stop a queue; take the container down so it restarts
+                print(f"[worker] Pool {name} exited with code {code}, stopping remaining pools")
+                exit_code = code or 1
+                stop(signal.SIGTERM, None)
+        time.sleep(0.5)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
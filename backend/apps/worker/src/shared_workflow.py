@@ -0,0 +1,250 @@
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Shared by the API (workflows are compiled when saved) and the worker (runs execute the
+# compiled snapshot of their workflow_version). A compiled workflow is plain data, stored
+# once per version in the workflow_versions collection:
+#   {"order": [node ids, topologically sorted],
+#    "steps": [{"id", "node", "dependencies", "dependents"}, ...] in that order,
+#    "analysis": {"node_count", "critical_path", "critical_path_length", "max_parallel_width"}}
+# where each node carries the `handler` it is dispatched to.
+COMPILER_VERSION = 2
+
+# Node type -> the worker actor that runs it; `inputs` is whether the actor takes the
+# upstream outputs after its config
+NODE_HANDLERS: Dict[str, Dict[str, Any]] = {
+    "ingest.pdf": {"actor": "ingest_pdf", "inputs": False},
+    "ingest.url": {"actor": "ingest_url", "inputs": False},
+    "ingest.webhook": {"actor": "ingest_webhook", "inputs": True},
+    "ai.rag_qa": {"actor": "rag_query", "inputs": True},
+    "ai.summarize": {"actor": "summarize_text", "inputs": True},
+    "ai.classify": {"actor": "classify_text", "inputs": True},
+    "text.transform": {"actor": "transform_text", "inputs": True},
+    "act.slack": {"actor": "post_slack", "inputs": True},
+    "act.sheets": {"actor": "append_sheets", "inputs": True},
+    "act.email": {"actor": "send_email", "inputs": True},
+    "act.notion": {"actor": "upsert_notion", "inputs": True},
+    "act.twilio": {"actor": "send_sms", "inputs": True},
+}
+
+# Node types that bring data into a run; every other node needs one of them upstream
+SOURCE_NODE_TYPES = {"ingest.pdf", "ingest.url", "ingest.webhook"}
+
+
+# Typed ports of each node type. An edge may name the output field it carries
+# (sourceHandle) and the input field it feeds (targetHandle); named handles must exist
+# and agree in kind. Edges without handles pass the whole output, as before.
+NODE_PORTS: Dict[str, Dict[str, Dict[str, str]]] = {
+    "ingest.pdf": {"in": {}, "out": {"document_id": "id", "content": "text"}},
+    "ingest.url": {"in": {}, "out": {"document_id": "id", "content": "text"}},
+    "ingest.webhook": {"in": {"data": "json"}, "out": {"document_id": "id", "content": "text", "data": "json"}},
+    "ai.rag_qa": {"in": {"query": "text", "content": "text", "document_id": "id"},
+                  "out": {"answer": "text", "citations": "json", "query": "text"}},
+    "ai.summarize": {"in": {"content": "text"}, "out": {"summary": "text", "original_length": "number"}},
+    "ai.classify": {"in": {"content": "text"},
+                    "out": {"category": "text", "confidence": "number", "all_categories": "json"}},
+    "text.transform": {"in": {"content": "text", "items": "json"},
+                       "out": {"transformed_text": "text", "items": "json", "count": "number"}},
+    "act.slack": {"in": {"content": "text", "text": "text", "summary": "text"},
+                  "out": {"timestamp": "text", "channel": "text"}},
+    "act.sheets": {"in": {"data": "json", "content": "text"}, "out": {"updatedRange": "text"}},
+    "act.email": {"in": {"content": "text", "text": "text"}, "out": {"messageId": "text"}},
+    "act.notion": {"in": {"content": "text", "text": "text"}, "out": {"page_id": "id"}},
+    "act.twilio": {"in": {"content": "text", "text": "text"}, "out": {"sid": "id"}},
+}
+
+
+class WorkflowCompileError(ValueError):
+    """Every problem found in a workflow graph, not just the first"""
+
+    def __init__(self, problems: List[str]):
+        super().__init__(f"Invalid workflow: {'; '.join(problems)}")
+        self.problems = problems
+
+
+def handle_problem(edge: Dict[str, Any], source_type: str, target_type: str) -> Optional[str]:
+    """Why the edge's named handles do not fit its endpoints, or None"""
+    label = edge.get("id") or f"{edge['source']}->{edge['target']}"
+    source_handle, target_handle = edge.get("sourceHandle"), edge.get("targetHandle")
+    produced = NODE_PORTS.get(source_type, {}).get("out", {})
+    accepted = NODE_PORTS.get(target_type, {}).get("in", {})
+    if source_handle and source_handle not in produced:
+        return f"Edge {label}: {source_type} has no output {source_handle}"
+    if target_handle and not accepted:
+        return f"Edge {label}: {target_type} takes no inputs"
+    if target_handle and target_handle not in accepted:
+        return f"Edge {label}: {target_type} has no input {target_handle}"
+    if source_handle and target_handle and produced[source_handle] != accepted[target_handle]:
+        return (f"Edge {label}: {source_type}.{source_handle} is {produced[source_handle]}, "
+                f"{target_type}.{target_handle} expects {accepted[target_handle]}")
+    return None
+
+
+def strongly_connected(node_ids: List[str], dependents: Dict[str, List[str]]) -> List[List[str]]:
+    """Tarjan's algorithm, iterative; components come out in reverse topological order"""
+    index: Dict[str, int] = {}
+    low: Dict[str, int] = {}
+    stack: List[str] = []
+    on_stack = set()
+    components = []
+    for root in node_ids:
+        if root in index:
+            continue
+        work = [(root, iter(dependents[root]))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node_id, children = work[-1]
+            child = next(children, None)
+            if child is not None:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(dependents[child])))
+                elif child in on_stack:
+                    low[node_id] = min(low[node_id], index[child])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node_id])
+            if low[node_id] == index[node_id]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node_id:
+                        break
+                components.append(component[::-1])
+    return components
+
+
+def analyze(order: List[str], dependencies: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Critical path and parallel width of a topologically ordered DAG, counting every node as one step.
+
+    `max_parallel_width` is the largest number of nodes at the same depth: how many node
+    tasks a run can have in flight at once when nodes take similar time.
+    """
+    depth: Dict[str, int] = {}
+    via: Dict[str, Optional[str]] = {}
+    for node_id in order:
+        parent = max(dependencies[node_id], key=depth.__getitem__, default=None)
+        depth[node_id] = depth[parent] + 1 if parent is not None else 1
+        via[node_id] = parent
+    widths: Dict[int, int] = {}
+    for d in depth.values():
+        widths[d] = widths.get(d, 0) + 1
+    path: List[str] = []
+    node_id = max(order, key=depth.__getitem__, default=None)
+    while node_id is not None:
+        path.append(node_id)
+        node_id = via[node_id]
+    return {
+        "node_count": len(order),
+        "critical_path": path[::-1],
+        "critical_path_length": len(path),
+        "max_parallel_width": max(widths.values(), default=0),
+    }
+
+
+def compile_workflow(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Validate a workflow graph, bind each node to its handler and analyze it, in O(nodes + edges).
+
+    Raises WorkflowCompileError listing duplicate node ids, unknown node types, edges to
+    missing nodes, handle mismatches, cycles, nodes that can never run because they
+    depend on a cycle, nodes without edges and nodes no ingest node feeds. The order is
+    deterministic: among nodes that are ready together, the one listed first in `nodes`
+    comes first.
+    """
+    problems: List[str] = []
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for node in nodes:
+        if node["id"] in by_id:
+            problems.append(f"Duplicate node id: {node['id']}")
+            continue
+        handler = NODE_HANDLERS.get(node.get("type"))
+        if handler is None:
+            problems.append(f"Node {node['id']} has unknown type: {node.get('type')}")
+        by_id[node["id"]] = {**node, "handler": handler}
+
+    dependencies: Dict[str, List[str]] = {node_id: [] for node_id in by_id}
+    dependents: Dict[str, List[str]] = {node_id: [] for node_id in by_id}
+    linked = set()
+    for edge in edges:
+        source, target = edge["source"], edge["target"]
+        missing = [end for end in (source, target) if end not in by_id]
+        if missing:
+            problems.extend(f"Edge {edge.get('id') or f'{source}->{target}'} references missing node {end}"
+                            for end in missing)
+            continue
+        problem = handle_problem(edge, by_id[source].get("type"), by_id[target].get("type"))
+        if problem:
+            problems.append(problem)
+        # Parallel edges (e.g. between different handles) are one dependency
+        if (source, target) not in linked:
+            linked.add((source, target))
+            dependencies[target].append(source)
+            dependents[source].append(target)
+
+    # Kahn's algorithm; nodes left unvisited are on a cycle or downstream of one
+    remaining = {node_id: len(deps) for node_id, deps in dependencies.items()}
+    ready = deque(node_id for node_id in by_id if not remaining[node_id])
+    order: List[str] = []
+    while ready:
+        node_id = ready.popleft()
+        order.append(node_id)
+        for dependent in dependents[node_id]:
+            remaining[dependent] -= 1
+            if not remaining[dependent]:
+                ready.append(dependent)
+    stuck_set = set()
+    if len(order) < len(by_id):
+        stuck = [node_id for node_id in by_id if remaining[node_id]]
+        stuck_set = set(stuck)
+        on_cycle = set()
+        for component in strongly_connected(stuck, {n: [d for d in dependents[n] if d in stuck_set] for n in stuck}):
+            if len(component) > 1 or component[0] in dependents[component[0]]:
+                on_cycle.update(component)
+                problems.append(f"Cycle through: {', '.join(component)}")
+        unreachable = [node_id for node_id in stuck if node_id not in on_cycle]
+        if unreachable:
+            problems.append(f"Unreachable nodes (they depend on a cycle): {', '.join(unreachable)}")
+
+    # Every node must get its data from an ingest node, directly or through its upstream nodes
+    isolated = [node_id for node_id in by_id
+                if len(by_id) > 1 and not dependencies[node_id] and not dependents[node_id]]
+    if isolated:
+        problems.append(f"Nodes without edges: {', '.join(isolated)}")
+    fed = {node_id for node_id, node in by_id.items() if node.get("type") in SOURCE_NODE_TYPES}
+    frontier = deque(fed)
+    while frontier:
+        for dependent in dependents[frontier.popleft()]:
+            if dependent not in fed:
+                fed.add(dependent)
+                frontier.append(dependent)
+    skipped = stuck_set.union(isolated)
+    unfed = [node_id for node_id, node in by_id.items()
+             if node_id not in fed and node_id not in skipped and node["handler"]]
+    if unfed:
+        problems.append(f"Nodes with no path from an ingest node: {', '.join(unfed)}")
+
+    if problems:
+        raise WorkflowCompileError(problems)
+
+    return {
+        "compiler": COMPILER_VERSION,
+        "order": order,
+        "steps": [
+            {
+                "id": node_id,
+                "node": by_id[node_id],
+                "dependencies": dependencies[node_id],
+                "dependents": dependents[node_id],
+            }
+            for node_id in order
+        ],
+        "analysis": analyze(order, dependencies),
+    }
@@ -1,3 +1,3 @@
 # Import all task modules to register actors
 import time
-from . import run_start, ingest_tasks, ai_tasks, action_tasks, common
+from . import run_start, ingest_tasks, ai_tasks, action_tasks, common, hook_tasks, index_tasks
@@ -1,35 +1,42 @@
 import dramatiq
 import time
 import os
+from datetime import datetime
 from typing import Dict, Any
+from email.mime.text import MIMEText
+from email.utils import make_msgid
 from pymongo import MongoClient
-from .common import node_completed
+from .common import node_completed, as_object_id
+from ..shared_broker import send_in_lane, remaining_budget, TransientError
+from .ledger import claim_action, ActionInProgress
+from .slack_client import get_slack_client
+from .sheets_buffer import get_sheets_client, rows_from_data
+from ..shared_smtp import get_smtp_pool, smtp_configured, SMTPPoolExhausted
 
 # MongoDB connection
 mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
 mongo_client = MongoClient(mongo_url)
 db = mongo_client.aiwf
 
-# Slack integration
-try:
-    from slack_sdk import WebClient
-    from slack_sdk.errors import SlackApiError
-    SLACK_AVAILABLE = True
-except ImportError:
-    SLACK_AVAILABLE = False
-    print("Slack SDK not available - using fallback responses")
-
 @dramatiq.actor(queue_name="actions")
 def post_slack(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
     """Post message to Slack channel"""
+    ledger = None
     try:
         print(f"[actions] Posting to Slack for node {node_id} in run {run_id}")
         
+        # Retries of an already-completed execution return the stored result
+        ledger = claim_action(run_id, node_id, "act.slack", config, inputs)
+        if ledger.replayed:
+            send_in_lane(node_completed, run_id, node_id, ledger.outputs)
+            return
+        
         # Log start
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting Slack post"
         })
@@ -42,86 +49,97 @@ def post_slack(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[s
         if not message and inputs:
             message = inputs.get("content", inputs.get("text", inputs.get("summary", "No message content")))
         
-        # Try to use real Slack API
-        if SLACK_AVAILABLE and os.getenv("SLACK_BOT_TOKEN"):
-            try:
-                client = WebClient(token=os.getenv("SLACK_BOT_TOKEN"))
-                
-                # Post message to Slack
-                response = client.chat_postMessage(
-                    channel=channel,
-                    text=message,
-                    username="AI Workflow Bot"
-                )
-                
-                # Extract response data
-                timestamp = response.get("ts", str(time.time()))
-                success = response.get("ok", False)
-                
-                if success:
-                    print(f"[actions] Successfully posted to Slack channel {channel}")
-                else:
-                    raise Exception(f"Slack API returned error: {response.get('error', 'Unknown error')}")
-                    
-            except SlackApiError as e:
-                print(f"[actions] Slack API error: {e.response['error']}")
-                timestamp = f"error_{int(time.time())}"
-                # Continue with fallback behavior
-            except Exception as e:
-                print(f"[actions] Error with Slack integration: {e}")
-                timestamp = f"fallback_{int(time.time())}"
+        # Post through the shared client so connections and rate-limit state are reused
+        client = get_slack_client()
+        thread_ts = None
+        if client:
+            response = client.post_message(
+                channel,
+                message,
+                thread_window=float(config.get("thread_window", 0) or 0),
+                username="AI Workflow Bot"
+            )
+            timestamp = response["ts"]
+            thread_ts = response.get("thread_ts")
+            print(f"[actions] Successfully posted to Slack channel {channel}")
         else:
-            # Fallback behavior when Slack is not available
-            print(f"[actions] Slack SDK not available or token missing - simulating post")
+            # Fallback behavior when Slack is not configured
+            print("[actions] Slack token missing - simulating post")
             timestamp = f"simulated_{int(time.time())}"
         
+        # Record the result as soon as the side effect happened, so a failure in the
+        # bookkeeping below cannot make a retry repeat it
+        outputs = {
+            "timestamp": timestamp,
+            "thread_ts": thread_ts,
+            "channel": channel,
+            "message": message,
+            "type": "slack_post"
+        }
+        
+        ledger.complete(outputs)
+        
         # Log completion
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Slack post completed",
             "outputs": {"timestamp": timestamp, "channel": channel, "message": message[:100]}
         })
         
         # Mark node as completed and trigger dependent nodes
-        outputs = {
-            "timestamp": timestamp,
-            "channel": channel,
-            "message": message,
-            "type": "slack_post"
-        }
-        
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
+    except ActionInProgress:
+        raise
     except Exception as e:
+        if ledger:
+            ledger.release()
         print(f"[actions] Error posting to Slack: {e}")
         # Log error
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"Slack post failed: {str(e)}"
         })
         # Update run status
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
+    except BaseException:
+        # Time limit or cancellation interrupted the attempt; free the claim for the retry
+        if ledger:
+            ledger.release()
+        raise
 
 @dramatiq.actor(queue_name="actions")
 def append_sheets(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
     """Append data to Google Sheets"""
+    ledger = None
     try:
         print(f"[actions] Appending to Sheets for node {node_id} in run {run_id}")
         
+        # Retries of an already-completed execution return the stored result
+        ledger = claim_action(run_id, node_id, "act.sheets", config, inputs)
+        if ledger.replayed:
+            send_in_lane(node_completed, run_id, node_id, ledger.outputs)
+            return
+        
         # Log start
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting Sheets append"
         })
@@ -134,66 +152,92 @@ def append_sheets(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dic
             raise ValueError("Spreadsheet ID is required for Sheets append")
         
         # Get data from inputs
-        data = inputs.get("data", inputs.get("content", []))
-        if isinstance(data, str):
-            data = [data]
+        rows = rows_from_data(inputs.get("data", inputs.get("content", config.get("values"))))
+        if not rows:
+            raise ValueError("No rows provided for Sheets append")
+        
+        client = get_sheets_client()
+        if client:
+            # Rows from concurrent runs are coalesced into one values:append per sheet
+            result = client.append(spreadsheet_id, sheet_name, rows, timeout=remaining_budget(120))
+            updated_range = result["updatedRange"]
+        else:
+            print("[actions] Google credentials missing - simulating Sheets append")
+            updated_range = f"{sheet_name}!A1:A{len(rows)}"
         
-        # TODO: Implement actual Google Sheets API integration
-        # For now, simulate Sheets append
-        import time
-        time.sleep(1)  # Simulate API call
+        # Record the result as soon as the side effect happened, so a failure in the
+        # bookkeeping below cannot make a retry repeat it
+        outputs = {
+            "updatedRange": updated_range,
+            "spreadsheet_id": spreadsheet_id,
+            "sheet_name": sheet_name,
+            "rows_added": len(rows),
+            "type": "sheets_append"
+        }
         
-        # Simulate Sheets response
-        updated_range = f"{sheet_name}!A1:B{len(data)}"
+        ledger.complete(outputs)
         
         # Log completion
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Sheets append completed",
             "outputs": {"updatedRange": updated_range}
         })
         
         # Mark node as completed and trigger dependent nodes
-        outputs = {
-            "updatedRange": updated_range,
-            "spreadsheet_id": spreadsheet_id,
-            "sheet_name": sheet_name,
-            "rows_added": len(data),
-            "type": "sheets_append"
-        }
-        
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
+    except ActionInProgress:
+        raise
     except Exception as e:
+        if ledger:
+            ledger.release()
         print(f"[actions] Error appending to Sheets: {e}")
         # Log error
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"Sheets append failed: {str(e)}"
         })
         # Mark node as failed
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
+    except BaseException:
+        # Time limit or cancellation interrupted the attempt; free the claim for the retry
+        if ledger:
+            ledger.release()
+        raise
 
 @dramatiq.actor(queue_name="actions")
 def send_email(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
     """Send email via SMTP"""
+    ledger = None
     try:
         print(f"[actions] Sending email for node {node_id} in run {run_id}")
         
+        # Retries of an already-completed execution return the stored result
+        ledger = claim_action(run_id, node_id, "act.email", config, inputs)
+        if ledger.replayed:
+            send_in_lane(node_completed, run_id, node_id, ledger.outputs)
+            return
+        
         # Log start
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting email send"
         })
@@ -210,62 +254,102 @@ def send_email(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[s
         if not body and inputs:
             body = inputs.get("content", inputs.get("text", "No email content"))
         
-        # TODO: Implement actual SMTP integration
-        # For now, simulate email sending
-        import time
-        time.sleep(1)  # Simulate SMTP call
+        recipients = [a.strip() for a in to_email.split(",") if a.strip()] if isinstance(to_email, str) else list(to_email)
+        from_email = config.get("from", os.getenv("FROM_EMAIL", "noreply@aiwf.local"))
+        
+        msg = MIMEText(body, "plain")
+        msg["Subject"] = subject
+        msg["From"] = from_email
+        msg["To"] = ", ".join(recipients)
+        message_id = make_msgid()
+        msg["Message-ID"] = message_id
         
-        # Simulate email response
-        message_id = f"msg_{int(time.time())}"
+        if smtp_configured():
+            # Reuses a pooled, logged-in session; large recipient lists go out in batches
+            try:
+                result = get_smtp_pool().send_message(msg, from_email, recipients)
+            except SMTPPoolExhausted as e:
+                # Every session is busy; back off instead of queueing more threads on the pool
+                raise TransientError(str(e))
+            if len(result["refused"]) == len(recipients):
+                raise ValueError(f"All recipients refused: {list(result['refused'])}")
+        else:
+            print("[actions] SMTP not configured - simulating email send")
+            message_id = f"simulated_{message_id}"
+        
+        # Record the result as soon as the side effect happened, so a failure in the
+        # bookkeeping below cannot make a retry repeat it
+        outputs = {
+            "messageId": message_id,
+            "to": to_email,
+            "subject": subject,
+            "body": body,
+            "type": "email_send"
+        }
+        
+        ledger.complete(outputs)
         
         # Log completion
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Email send completed",
             "outputs": {"messageId": message_id}
         })
         
         # Mark node as completed and trigger dependent nodes
-        outputs = {
-            "messageId": message_id,
-            "to": to_email,
-            "subject": subject,
-            "body": body,
-            "type": "email_send"
-        }
-        
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
+    except ActionInProgress:
+        raise
     except Exception as e:
+        if ledger:
+            ledger.release()
         print(f"[actions] Error sending email: {e}")
         # Log error
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"Email send failed: {str(e)}"
         })
         # Mark node as failed
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
+    except BaseException:
+        # Time limit or cancellation interrupted the attempt; free the claim for the retry
+        if ledger:
+            ledger.release()
+        raise
 
 @dramatiq.actor(queue_name="actions")
 def upsert_notion(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
     """Upsert data to Notion database"""
+    ledger = None
     try:
         print(f"[actions] Upserting to Notion for node {node_id} in run {run_id}")
         
+        # Retries of an already-completed execution return the stored result
+        ledger = claim_action(run_id, node_id, "act.notion", config, inputs)
+        if ledger.replayed:
+            send_in_lane(node_completed, run_id, node_id, ledger.outputs)
+            return
+        
         # Log start
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting Notion upsert"
         })
@@ -284,60 +368,84 @@ def upsert_notion(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dic
         
         # TODO: Implement actual Notion API integration
         # For now, simulate Notion upsert
-        import time
         time.sleep(1)  # Simulate API call
         
         # Simulate Notion response
         page_id = f"page_{int(time.time())}"
         
+        # Record the result as soon as the side effect happened, so a failure in the
+        # bookkeeping below cannot make a retry repeat it
+        outputs = {
+            "page_id": page_id,
+            "database_id": database_id,
+            "title": page_title,
+            "content": content,
+            "type": "notion_upsert"
+        }
+        
+        ledger.complete(outputs)
+        
         # Log completion
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Notion upsert completed",
             "outputs": {"page_id": page_id}
         })
         
         # Mark node as completed and trigger dependent nodes
-        outputs = {
-            "page_id": page_id,
-            "database_id": database_id,
-            "title": page_title,
-            "content": content,
-            "type": "notion_upsert"
-        }
-        
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
+    except ActionInProgress:
+        raise
     except Exception as e:
+        if ledger:
+            ledger.release()
         print(f"[actions] Error upserting to Notion: {e}")
         # Log error
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"Notion upsert failed: {str(e)}"
         })
         # Mark node as failed
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
+    except BaseException:
+        # Time limit or cancellation interrupted the attempt; free the claim for the retry
+        if ledger:
+            ledger.release()
+        raise
 
 @dramatiq.actor(queue_name="actions")
 def send_sms(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
     """Send SMS via Twilio"""
+    ledger = None
     try:
         print(f"[actions] Sending SMS for node {node_id} in run {run_id}")
         
+        # Retries of an already-completed execution return the stored result
+        ledger = claim_action(run_id, node_id, "act.twilio", config, inputs)
+        if ledger.replayed:
+            send_in_lane(node_completed, run_id, node_id, ledger.outputs)
+            return
+        
         # Log start
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting SMS send"
         })
@@ -355,44 +463,60 @@ def send_sms(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str
         
         # TODO: Implement actual Twilio API integration
         # For now, simulate SMS sending
-        import time
         time.sleep(1)  # Simulate API call
         
         # Simulate Twilio response
         sid = f"SM{int(time.time())}"
         
+        # Record the result as soon as the side effect happened, so a failure in the
+        # bookkeeping below cannot make a retry repeat it
+        outputs = {
+            "sid": sid,
+            "to": to_number,
+            "message": message,
+            "type": "twilio_sms"
+        }
+        
+        ledger.complete(outputs)
+        
         # Log completion
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "SMS send completed",
             "outputs": {"sid": sid}
         })
         
         # Mark node as completed and trigger dependent nodes
-        outputs = {
-            "sid": sid,
-            "to": to_number,
-            "message": message,
-            "type": "twilio_sms"
-        }
-        
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
+    except ActionInProgress:
+        raise
     except Exception as e:
+        if ledger:
+            ledger.release()
         print(f"[actions] Error sending SMS: {e}")
         # Log error
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"SMS send failed: {str(e)}"
         })
         # Mark node as failed
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
+    except BaseException:
+        # Time limit or cancellation interrupted the attempt; free the claim for the retry
+        if ledger:
+            ledger.release()
+        raise
@@ -1,9 +1,14 @@
 import dramatiq
 import time
 import os
+from datetime import datetime
 from typing import Dict, Any
 from pymongo import MongoClient
-from .common import node_completed
+from .common import node_completed, as_object_id
+from ..shared_broker import (
+    TransientError, DeadlineExceeded, CancellationToken, send_in_lane, remaining_budget, parse_retry_after
+)
+from .transform_engine import compile_pipeline
 
 # MongoDB connection
 mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
@@ -12,6 +17,7 @@ db = mongo_client.aiwf
 
 # OpenAI integration
 try:
+    import openai
     from openai import OpenAI
     openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     OPENAI_AVAILABLE = True
@@ -19,6 +25,22 @@ except ImportError:
     OPENAI_AVAILABLE = False
     print("OpenAI not available - using fallback responses")
 
+# Upper bound for one OpenAI request; shortened to whatever is left of the node's budget
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+def budgeted_openai_client():
+    return openai_client.with_options(timeout=remaining_budget(OPENAI_TIMEOUT))
+
+def raise_if_transient(e: Exception):
+    """Let rate limits and connection failures reach the retry policy instead of the fallback answer"""
+    if isinstance(e, DeadlineExceeded):
+        raise e
+    if OPENAI_AVAILABLE and isinstance(e, (openai.RateLimitError, openai.APIConnectionError,
+                                           openai.APITimeoutError, openai.InternalServerError)):
+        response = getattr(e, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        raise TransientError(f"OpenAI API error: {e}", retry_after=parse_retry_after(retry_after)) from e
+
 @dramatiq.actor(queue_name="ai")
 def rag_query(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
     """Perform RAG query on documents"""
@@ -30,6 +52,7 @@ def rag_query(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[st
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting RAG query"
         })
@@ -63,7 +86,7 @@ Please provide a comprehensive answer based on the document content. If the answ
 
 Answer:"""
 
-                response = openai_client.chat.completions.create(
+                response = budgeted_openai_client().chat.completions.create(
                     model="gpt-3.5-turbo",
                     messages=[
                         {"role": "system", "content": "You are a helpful assistant that answers questions based on provided document content. Be accurate and cite relevant parts of the document."},
@@ -77,6 +100,7 @@ Answer:"""
                 citations = ["AI-generated response based on document content"]
                 
             except Exception as e:
+                raise_if_transient(e)
                 print(f"[ai] OpenAI API error: {e}")
                 answer = f"Error using OpenAI API: {str(e)}. Falling back to document excerpt."
                 citations = ["Error response"]
@@ -90,6 +114,7 @@ Answer:"""
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "RAG query completed",
             "outputs": {"answer": answer, "citations": citations}
@@ -103,7 +128,7 @@ Answer:"""
             "type": "text"
         }
         
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
     except Exception as e:
         print(f"[ai] Error in RAG query: {e}")
@@ -111,14 +136,17 @@ Answer:"""
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"RAG query failed: {str(e)}"
         })
         # Update run status
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
 
 @dramatiq.actor(queue_name="ai")
 def summarize_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
@@ -131,6 +159,7 @@ def summarize_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Di
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting text summarization"
         })
@@ -162,7 +191,7 @@ Text to summarize:
 
 Summary (approximately {max_length} words):"""
 
-                response = openai_client.chat.completions.create(
+                response = budgeted_openai_client().chat.completions.create(
                     model="gpt-3.5-turbo",
                     messages=[
                         {"role": "system", "content": f"You are a helpful assistant that creates {summary_type} summaries. Keep summaries around {max_length} words."},
@@ -175,6 +204,7 @@ Summary (approximately {max_length} words):"""
                 summary = response.choices[0].message.content
                 
             except Exception as e:
+                raise_if_transient(e)
                 print(f"[ai] OpenAI API error: {e}")
                 # Fallback summary
                 words = content.split()
@@ -191,6 +221,7 @@ Summary (approximately {max_length} words):"""
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Text summarization completed",
             "outputs": {"summary": summary, "original_length": len(content)}
@@ -204,7 +235,7 @@ Summary (approximately {max_length} words):"""
             "type": "text"
         }
         
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
     except Exception as e:
         print(f"[ai] Error in text summarization: {e}")
@@ -212,16 +243,19 @@ Summary (approximately {max_length} words):"""
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"Text summarization failed: {str(e)}"
         })
         # Update run status
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
 
-@dramatiq.actor(queue_name="ai")
+@dramatiq.actor(queue_name="cpu")
 def classify_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
     """Classify text content"""
     try:
@@ -232,6 +266,7 @@ def classify_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dic
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting text classification"
         })
@@ -259,6 +294,7 @@ def classify_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dic
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Text classification completed",
             "outputs": {"category": predicted_category, "confidence": max_confidence}
@@ -272,7 +308,7 @@ def classify_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dic
             "type": "classification"
         }
         
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
     except Exception as e:
         print(f"[ai] Error in text classification: {e}")
@@ -281,18 +317,50 @@ def classify_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dic
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"Text classification failed: {str(e)}"
         })
         # Mark node as failed
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
+
+def transform_outputs(config: Dict[str, Any], inputs: Dict[str, Any], checkpoint=None) -> Dict[str, Any]:
+    """Node outputs of text.transform; pure, so the orchestrator can also run it inline"""
+    # Compiled pipelines are cached per config, so repeated runs skip regex/template parsing
+    pipeline = compile_pipeline(config)
+    transform_type = pipeline.label
+    
+    # Batch mode: one invocation transforms every record in `items`
+    items = inputs.get("items", config.get("items"))
+    if isinstance(items, list):
+        transformed_items = pipeline.apply_batch(items, checkpoint=checkpoint)
+        return {
+            "items": transformed_items,
+            "count": len(transformed_items),
+            "transform_type": transform_type,
+            "type": "json"
+        }
+    
+    # Get content from inputs
+    content = inputs.get("content", "")
+    if not content:
+        raise ValueError("No content provided for transformation")
+    
+    return {
+        "transformed_text": pipeline.apply(content),
+        "original_text": content,
+        "transform_type": transform_type,
+        "type": "text"
+    }
 
 @dramatiq.actor(queue_name="ai")
 def transform_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
-    """Transform text content"""
+    """Transform text content or a batch of records with a compiled operation chain"""
     try:
         print(f"[ai] Transforming text for node {node_id} in run {run_id}")
         
@@ -301,54 +369,30 @@ def transform_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Di
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting text transformation"
         })
         
-        # Get content from inputs
-        content = inputs.get("content", "")
-        if not content:
-            raise ValueError("No content provided for transformation")
-        
-        # Get transformation type from config
-        transform_type = config.get("type", "uppercase")
-        
-        # TODO: Implement actual AI text transformation
-        # For now, simulate transformation
-        import time
-        time.sleep(1)  # Simulate processing time
-        
-        # Simple text transformations (placeholder)
-        if transform_type == "uppercase":
-            transformed = content.upper()
-        elif transform_type == "lowercase":
-            transformed = content.lower()
-        elif transform_type == "title_case":
-            transformed = content.title()
-        elif transform_type == "reverse":
-            transformed = content[::-1]
-        else:
-            transformed = content  # Default to no change
+        outputs = transform_outputs(config, inputs, checkpoint=CancellationToken(run_id).check)
         
         # Log completion
+        if "items" in outputs:
+            logged = {"items_count": outputs["count"], "transform_type": outputs["transform_type"]}
+        else:
+            logged = {"transformed_text": outputs["transformed_text"]}
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Text transformation completed",
-            "outputs": {"transformed_text": transformed}
+            "outputs": logged
         })
         
         # Mark node as completed and trigger dependent nodes
-        outputs = {
-            "transformed_text": transformed,
-            "original_text": content,
-            "transform_type": transform_type,
-            "type": "text"
-        }
-        
-        node_completed.send(run_id, node_id, outputs)
+        send_in_lane(node_completed, run_id, node_id, outputs)
         
     except Exception as e:
         print(f"[ai] Error in text transformation: {e}")
@@ -357,11 +401,14 @@ def transform_text(run_id: str, node_id: str, config: Dict[str, Any], inputs: Di
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"Text transformation failed: {str(e)}"
         })
         # Mark node as failed
         db.runs.update_one(
-            {"_id": run_id},
+            {"_id": as_object_id(run_id)},
             {"$set": {f"node_status.{node_id}": "failed", "error": str(e)}}
         )
+        # Surface the failure so the retry policy can retry or dead-letter it
+        raise e
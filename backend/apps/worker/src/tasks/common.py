@@ -1,14 +1,25 @@
 import dramatiq
 import time
 import os
+from datetime import datetime
 from typing import Dict, Any
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from bson import ObjectId
+from . import fair_scheduler
+from ..shared_broker import is_run_cancelled
 
 # MongoDB connection
 mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
 mongo_client = MongoClient(mongo_url)
 db = mongo_client.aiwf
 
+def as_object_id(value):
+    """Ids travel through messages as strings; API-created runs and workflows are stored under ObjectIds"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+@dramatiq.actor(queue_name="default")
 def node_completed(run_id: str, node_id: str, outputs: Dict[str, Any]):
     """Handle node completion and enqueue dependent nodes"""
     try:
@@ -19,47 +30,60 @@ def node_completed(run_id: str, node_id: str, outputs: Dict[str, Any]):
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": f"Node {node_id} completed",
             "outputs": outputs
         })
         
         # Get run and workflow
-        run = db.runs.find_one({"_id": run_id})
+        run = db.runs.find_one({"_id": as_object_id(run_id)})
         if not run:
             return
         
+        from .run_start import (
+            load_snapshot, get_ready_nodes, advance_run, complete_run_if_done, dispatch_pending_tasks
+        )
+        # The version pinned when the run started, compiled once per process
         workflow_id = run["workflow_id"]
-        workflow = db.workflows.find_one({"_id": workflow_id})
-        if not workflow:
+        snapshot = load_snapshot(workflow_id, run.get("workflow_version"))
+        if not snapshot:
             return
+        _, nodes, execution_plan = snapshot
+        tenant = run.get("created_by")
+        lane, deadline = run.get("lane"), run.get("deadline")
         
-        # Update node status
-        db.runs.update_one(
-            {"_id": run_id},
-            {"$set": {f"node_status.{node_id}": "completed"}}
-        )
+        # Update node status; a sink node's outputs become the run's outputs
+        update = {f"node_status.{node_id}": "completed"}
+        if node_id in execution_plan and not execution_plan[node_id]["dependents"]:
+            update[f"outputs.{node_id}"] = outputs
+        run = db.runs.find_one_and_update(
+            {"_id": as_object_id(run_id)}, {"$set": update},
+            projection={"node_status": 1, "status": 1}, return_document=ReturnDocument.AFTER
+        ) or run
+        node_status = run.get("node_status", {})
         
-        # Check if all nodes are completed
-        from .run_start import compute_execution_plan, get_ready_nodes, enqueue_node_task
-        execution_plan = compute_execution_plan(workflow)
-        all_completed = all(
-            db.runs.find_one({"_id": run_id}).get("node_status", {}).get(nid) == "completed"
-            for nid in execution_plan.keys()
-        )
+        # Free the owner's concurrency slot for this node
+        if tenant:
+            fair_scheduler.release(tenant, str(run_id), node_id)
+        
+        # A cancelled or failed (e.g. overdue) run schedules nothing further; its freed slot goes to parked work
+        if run.get("status") in ("cancelled", "failed") or is_run_cancelled(str(run_id)):
+            print(f"[worker] Run {run_id} is {run.get('status')}, not enqueueing dependents")
+            dispatch_pending_tasks()
+            return
+        
+        if not complete_run_if_done(str(run_id), execution_plan, node_status):
+            # Start dependent nodes that are ready; cheap ones run inline right here
+            ready_nodes = get_ready_nodes(run_id, execution_plan, node_status)
+            advance_run(str(run_id), workflow_id, nodes, execution_plan, node_status,
+                        [(ready_node_id, outputs) for ready_node_id in ready_nodes],
+                        tenant=tenant, lane=lane, deadline=deadline)
         
-        if all_completed:
-            # Mark run as completed
-            db.runs.update_one(
-                {"_id": run_id},
-                {"$set": {"status": "succeeded", "completed_at": time.time()}}
-            )
-            print(f"[worker] Run {run_id} completed successfully")
-        else:
-            # Enqueue dependent nodes that are ready
-            ready_nodes = get_ready_nodes(run_id, execution_plan)
-            for ready_node_id in ready_nodes:
-                enqueue_node_task(run_id, workflow_id, ready_node_id, workflow["nodes"], outputs)
+        # Hand freed capacity to parked nodes, fairly across tenants
+        dispatch_pending_tasks()
                 
     except Exception as e:
-        print(f"[worker] Error handling node completion: {e}") 
\ No newline at end of file
+        print(f"[worker] Error handling node completion: {e}")
+        # Retried by the retry policy; claims of nodes started here were released for the retry
+        raise 
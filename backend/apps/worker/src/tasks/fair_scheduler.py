@@ -0,0 +1,123 @@
+import os
+import json
+import time
+from typing import Dict, Any, Optional
+from ..shared_broker import redis_broker, TENANT_INFLIGHT_KEY, TENANTS_BACKLOGGED_KEY
+
+# Node tasks one tenant (run.created_by) may have in flight across all of its runs
+TENANT_MAX_INFLIGHT = int(os.getenv("TENANT_MAX_INFLIGHT", "50"))
+# Slots not released within this window (crashed or dead-lettered nodes) are reclaimed
+TENANT_SLOT_TTL = float(os.getenv("TENANT_SLOT_TTL", "900"))
+# {"user_id": weight}; a tenant with weight 2 is dispatched twice as often while backlogged
+TENANT_WEIGHTS: Dict[str, float] = json.loads(os.getenv("TENANT_WEIGHTS", "{}"))
+# Interactive lanes skip the per-tenant cap so node tests never queue behind batch work
+UNCAPPED_LANES = {"interactive"}
+
+INFLIGHT_KEY = TENANT_INFLIGHT_KEY
+PENDING_KEY = "aiwf:tenant:{}:pending"
+VTIME_KEY = "aiwf:tenants:vtime"
+BACKLOGGED_KEY = TENANTS_BACKLOGGED_KEY
+
+client = redis_broker.client
+
+# Atomically reclaim stale slots and take one if the tenant is under its cap
+_acquire = client.register_script("""
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    return 1
+end
+return 0
+""")
+
+
+# Atomically pop a parked task and take its slot, if the tenant is under its cap
+_pop_pending = client.register_script("""
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return false
+end
+local raw = redis.call('LPOP', KEYS[2])
+if not raw then
+    return false
+end
+local task = cjson.decode(raw)
+redis.call('ZADD', KEYS[1], ARGV[3], task['run_id'] .. ':' .. task['node_id'])
+return raw
+""")
+
+
+def _slot(run_id: str, node_id: str) -> str:
+    return f"{run_id}:{node_id}"
+
+
+def try_acquire(tenant: str, run_id: str, node_id: str) -> bool:
+    now = time.time()
+    return bool(_acquire(
+        keys=[INFLIGHT_KEY.format(tenant)],
+        args=[now - TENANT_SLOT_TTL, TENANT_MAX_INFLIGHT, now, _slot(run_id, node_id)]
+    ))
+
+
+def release(tenant: str, run_id: str, node_id: str):
+    client.zrem(INFLIGHT_KEY.format(tenant), _slot(run_id, node_id))
+
+
+def _charge(tenant: str):
+    """Advance the tenant's virtual time by 1/weight for every task dispatched"""
+    client.zincrby(VTIME_KEY, 1.0 / float(TENANT_WEIGHTS.get(tenant, 1.0)), tenant)
+
+
+def admit(tenant: Optional[str], lane: str, run_id: str, node_id: str, task: Dict[str, Any]) -> bool:
+    """Reserve a slot for the node, or park it in the tenant's pending queue.
+
+    Returns True when the caller should enqueue the node now.
+    """
+    if not tenant or lane in UNCAPPED_LANES:
+        return True
+    if client.llen(PENDING_KEY.format(tenant)) == 0 and try_acquire(tenant, run_id, node_id):
+        _charge(tenant)
+        return True
+    # A tenant that was idle starts at the current minimum virtual time, not at its old (lower) one
+    floor = client.zrange(VTIME_KEY, 0, 0, withscores=True)
+    if floor:
+        current = client.zscore(VTIME_KEY, tenant)
+        if current is None or current < floor[0][1]:
+            client.zadd(VTIME_KEY, {tenant: floor[0][1]})
+    pipe = client.pipeline()
+    pipe.rpush(PENDING_KEY.format(tenant), json.dumps(task, default=str))
+    pipe.sadd(BACKLOGGED_KEY, tenant)
+    pipe.execute()
+    return False
+
+
+def next_pending(limit: int = 10):
+    """Yield parked tasks in weighted-fair order while tenants have free slots.
+
+    Tenants are visited by ascending virtual time, so a tenant with 10,000 queued
+    nodes gets its share but cannot starve a tenant that just submitted one run.
+    """
+    dispatched = 0
+    while dispatched < limit:
+        backlogged = {t.decode() if isinstance(t, bytes) else t for t in client.smembers(BACKLOGGED_KEY)}
+        if not backlogged:
+            return
+        scores = {t: client.zscore(VTIME_KEY, t) or 0.0 for t in backlogged}
+        progressed = False
+        for tenant in sorted(scores, key=scores.get):
+            now = time.time()
+            raw = _pop_pending(
+                keys=[INFLIGHT_KEY.format(tenant), PENDING_KEY.format(tenant)],
+                args=[now - TENANT_SLOT_TTL, TENANT_MAX_INFLIGHT, now]
+            )
+            if raw is None:
+                if client.llen(PENDING_KEY.format(tenant)) == 0:
+                    client.srem(BACKLOGGED_KEY, tenant)
+                continue
+            _charge(tenant)
+            dispatched += 1
+            progressed = True
+            yield json.loads(raw)
+            break
+        if not progressed:
+            return
@@ -0,0 +1,163 @@
+import dramatiq
+import json
+import time
+import os
+from datetime import datetime
+from typing import Dict, Any, List
+from pymongo import MongoClient
+from bson import ObjectId
+from uuid import uuid4
+from ..shared_broker import (
+    redis_broker, lane_queue, enqueue_many, send_in_lane, current_message_id, DEFAULT_LANE,
+    WEBHOOK_EVENTS_KEY, WEBHOOK_DRAIN_KEY, WEBHOOK_DUE_KEY, WEBHOOK_PROCESSING_KEY
+)
+
+# MongoDB connection
+mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
+mongo_client = MongoClient(mongo_url)
+db = mongo_client.aiwf
+
+# Events taken off the buffer per round trip
+WEBHOOK_DRAIN_CHUNK = int(os.getenv("WEBHOOK_DRAIN_CHUNK", "1000"))
+# A debounced webhook under a constant stream of events still fires this many windows after its first event
+WEBHOOK_DEBOUNCE_MAX_WINDOWS = int(os.getenv("WEBHOOK_DEBOUNCE_MAX_WINDOWS", "10"))
+# A drain's unfinished chunk outlives every retry of the drain, then is dropped
+WEBHOOK_PROCESSING_TTL = int(os.getenv("WEBHOOK_PROCESSING_TTL", str(24 * 3600)))
+
+# The unfinished chunk of an earlier attempt if there is one, else the next chunk of the
+# buffer, moved atomically to the drain's processing list
+_take_events = redis_broker.client.register_script("""
+local events = redis.call('LRANGE', KEYS[2], 0, -1)
+if #events == 0 then
+    events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #events == 0 then
+        return events
+    end
+    redis.call('RPUSH', KEYS[2], unpack(events))
+    redis.call('LTRIM', KEYS[1], #events, -1)
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return events
+""")
+
+
+def parse_event(raw) -> Dict[str, Any]:
+    """Buffered event -> the payload a run sees; JSON bodies are decoded, anything else stays text"""
+    event = json.loads(raw)
+    body = event.get("body", "")
+    content_type = event.get("content_type") or ""
+    if "json" in content_type or body[:1] in ("{", "["):
+        try:
+            return json.loads(body)
+        except ValueError:
+            pass
+    return body
+
+
+def take_events(workflow_id: str, processing: str, limit: int) -> List[bytes]:
+    """Events to start runs for; they stay in `processing` until finish_events, so a failed
+    attempt leaves them for the retry instead of losing them"""
+    return _take_events(keys=[WEBHOOK_EVENTS_KEY.format(workflow_id), processing],
+                        args=[limit, WEBHOOK_PROCESSING_TTL])
+
+
+def finish_events(processing: str):
+    redis_broker.client.delete(processing)
+
+
+@dramatiq.actor(queue_name="default")
+def drain_webhook_events(workflow_id: str):
+    """Turn a workflow's buffered webhook events into runs, one per event or one per coalesced batch"""
+    try:
+        client = redis_broker.client
+        workflow = db.workflows.find_one({"_id": ObjectId(workflow_id)}, {"webhook": 1, "is_active": 1, "created_by": 1, "version": 1})
+        hook = (workflow or {}).get("webhook")
+        if not hook or not workflow.get("is_active", True):
+            # Disabled since the events were accepted
+            client.delete(WEBHOOK_EVENTS_KEY.format(workflow_id), WEBHOOK_DRAIN_KEY.format(workflow_id),
+                          WEBHOOK_DUE_KEY.format(workflow_id),
+                          WEBHOOK_PROCESSING_KEY.format(workflow_id, current_message_id()))
+            print(f"[hooks] Webhook of workflow {workflow_id} is disabled, dropped buffered events")
+            return
+
+        lane = hook.get("lane", DEFAULT_LANE)
+        window_ms = hook.get("window_ms", 0)
+        if hook.get("mode") == "debounce" and window_ms:
+            now_ms = time.time() * 1000
+            due = client.get(WEBHOOK_DUE_KEY.format(workflow_id))
+            first = client.get(WEBHOOK_DRAIN_KEY.format(workflow_id))
+            max_due = float(first) + window_ms * WEBHOOK_DEBOUNCE_MAX_WINDOWS if first else now_ms
+            if due and now_ms < min(float(due), max_due):
+                # Events kept arriving; wait for the window to go quiet
+                client.pexpire(WEBHOOK_DRAIN_KEY.format(workflow_id), window_ms + 60_000)
+                send_in_lane(drain_webhook_events, workflow_id, lane=lane,
+                             delay=int(min(float(due), max_due) - now_ms) + 1)
+                return
+
+        # Release the drain first: events arriving from here on schedule the next drain
+        client.delete(WEBHOOK_DRAIN_KEY.format(workflow_id), WEBHOOK_DUE_KEY.format(workflow_id))
+
+        per_run = 1 if hook.get("mode", "per_event") == "per_event" else hook.get("max_batch", 100)
+        # Keyed by the drain message, which keeps its id across retries and redeliveries
+        processing = WEBHOOK_PROCESSING_KEY.format(workflow_id, current_message_id() or uuid4().hex)
+        total = 0
+        while True:
+            events = take_events(workflow_id, processing, WEBHOOK_DRAIN_CHUNK)
+            if not events:
+                break
+            payloads = [parse_event(raw) for raw in events]
+            groups = [payloads[i:i + per_run] for i in range(0, len(payloads), per_run)]
+            total += start_runs(workflow_id, workflow.get("created_by"), lane, groups, per_run > 1,
+                                version=workflow.get("version", 1))
+            finish_events(processing)
+
+        print(f"[hooks] Started {total} runs from webhook events of workflow {workflow_id}")
+
+    except Exception as e:
+        print(f"[hooks] Error draining webhook events of workflow {workflow_id}: {e}")
+        raise e
+
+
+def start_runs(workflow_id: str, created_by: str, lane: str, groups: List[List[Any]], coalesced: bool,
+               version: int = None) -> int:
+    """Insert and enqueue one run per group of payloads, pinned to the workflow version they were drained under"""
+    now = datetime.utcnow()
+    runs = [
+        {
+            "workflow_id": workflow_id,
+            "workflow_version": version,
+            "status": "queued",
+            "lane": lane,
+            "trigger": "webhook",
+            "created_by": created_by,
+            "created_at": now,
+            "started_at": None,
+            "completed_at": None,
+            "error": None,
+            "node_status": {},
+            # ingest.webhook nodes read `data`; coalesced runs get the list of events
+            "inputs": {"data": group, "events": len(group)} if coalesced else {"data": group[0]},
+            "outputs": {},
+            "timeout_ms": None
+        }
+        for group in groups
+    ]
+    run_ids = db.runs.insert_many(runs).inserted_ids
+    try:
+        enqueue_many([
+            dramatiq.Message(
+                queue_name=lane_queue("default", lane),
+                actor_name="run_start",
+                args=[str(run_id)],
+                kwargs={},
+                options={"lane": lane}
+            )
+            for run_id in run_ids
+        ])
+    except Exception as e:
+        db.runs.update_many(
+            {"_id": {"$in": run_ids}},
+            {"$set": {"status": "failed", "error": f"Failed to enqueue run: {e}"}}
+        )
+        raise
+    return len(run_ids)
@@ -0,0 +1,236 @@
+import dramatiq
+import json
+import time
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from pymongo import MongoClient
+from .ingest_tasks import fetch_url_text
+from .ai_tasks import OPENAI_AVAILABLE, budgeted_openai_client, raise_if_transient
+from ..shared_broker import (
+    redis_broker, classify_exception, record_ingest_completed, INGEST_PROGRESS_CHANNEL, RETRY_POLICIES
+)
+
+try:
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import Distance, PointStruct, VectorParams
+except ImportError:
+    QdrantClient = None
+
+try:
+    from prometheus_client import Counter, Histogram
+    ingest_documents = Counter("aiwf_ingest_documents_total", "Background URL ingests finished", ["status"])
+    ingest_stage_seconds = Histogram(
+        "aiwf_ingest_stage_seconds",
+        "Time spent in each stage of a background URL ingest",
+        ["stage"],
+        buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+    )
+except ImportError:
+    ingest_documents = None
+    ingest_stage_seconds = None
+
+# MongoDB connection
+mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
+mongo_client = MongoClient(mongo_url)
+db = mongo_client.aiwf
+
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+INGEST_CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "200"))
+# Extracted text beyond this is dropped, which keeps the stored document under Mongo's size limit
+INGEST_MAX_CHARS = int(os.getenv("INGEST_MAX_CHARS", str(2_000_000)))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Chunks per embeddings request; progress is written after each batch
+EMBEDDING_BATCH = int(os.getenv("EMBEDDING_BATCH", "64"))
+QDRANT_URL = os.getenv("QDRANT_URL") or f"http://{os.getenv('QDRANT_HOST', 'qdrant')}:{os.getenv('QDRANT_PORT', '6333')}"
+QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "documents")
+
+_qdrant = None
+_qdrant_collections = set()
+
+
+def update_fetch(document_id: str, fields: Dict[str, Any]):
+    """Write progress to the url_fetches document and publish it to subscribers"""
+    db.url_fetches.update_one({"document_id": document_id}, {"$set": fields})
+    try:
+        redis_broker.client.publish(
+            INGEST_PROGRESS_CHANNEL.format(document_id),
+            json.dumps({"document_id": document_id, **fields}, default=str)
+        )
+    except Exception as e:
+        # Pollers still see the update
+        print(f"[ingest] Failed to publish progress of {document_id}: {e}")
+
+
+class StageTimer:
+    """Marks the stage on the status document and records how long it took"""
+
+    def __init__(self, document_id: str, stage: str):
+        self.document_id = document_id
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        update_fetch(self.document_id, {"stage": self.stage, f"stages.{self.stage}.started_at": datetime.utcnow()})
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            seconds = time.monotonic() - self.started
+            if ingest_stage_seconds is not None:
+                ingest_stage_seconds.labels(stage=self.stage).observe(seconds)
+            update_fetch(self.document_id, {f"stages.{self.stage}.seconds": round(seconds, 4)})
+        return False
+
+
+def chunk_text(text: str, size: int = INGEST_CHUNK_SIZE, overlap: int = INGEST_CHUNK_OVERLAP) -> List[Dict[str, Any]]:
+    """Overlapping chunks, cut at a sentence or line end in the second half of the window when there is one"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = max(text.rfind(".", start + size // 2, end), text.rfind("\n", start + size // 2, end))
+            if cut != -1:
+                end = cut + 1
+        piece = text[start:end].strip()
+        if piece:
+            chunks.append({"id": len(chunks), "text": piece, "start": start, "end": end})
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def embeddings_enabled() -> bool:
+    return OPENAI_AVAILABLE and bool(os.getenv("OPENAI_API_KEY"))
+
+
+def embed_chunks(document_id: str, chunks: List[Dict[str, Any]]) -> List[List[float]]:
+    vectors = []
+    for i in range(0, len(chunks), EMBEDDING_BATCH):
+        batch = [chunk["text"] for chunk in chunks[i:i + EMBEDDING_BATCH]]
+        try:
+            response = budgeted_openai_client().embeddings.create(model=EMBEDDING_MODEL, input=batch)
+        except Exception as e:
+            raise_if_transient(e)
+            raise
+        vectors.extend(item.embedding for item in response.data)
+        update_fetch(document_id, {"progress.embedded": len(vectors)})
+    return vectors
+
+
+def qdrant_client() -> Optional["QdrantClient"]:
+    global _qdrant
+    if QdrantClient is None:
+        return None
+    if _qdrant is None:
+        _qdrant = QdrantClient(url=QDRANT_URL)
+    return _qdrant
+
+
+def store_vectors(document_id: str, url: str, chunks: List[Dict[str, Any]], vectors: List[List[float]]) -> bool:
+    client = qdrant_client()
+    if client is None or not vectors:
+        return False
+    if QDRANT_COLLECTION not in _qdrant_collections:
+        if not client.collection_exists(QDRANT_COLLECTION):
+            client.create_collection(
+                QDRANT_COLLECTION,
+                vectors_config=VectorParams(size=len(vectors[0]), distance=Distance.COSINE)
+            )
+        _qdrant_collections.add(QDRANT_COLLECTION)
+    # Point ids derive from the document and chunk, so a retried ingest overwrites its own points
+    points = [
+        PointStruct(
+            id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"{document_id}:{chunk['id']}")),
+            vector=vector,
+            payload={"document_id": document_id, "chunk": chunk["id"], "text": chunk["text"], "url": url}
+        )
+        for chunk, vector in zip(chunks, vectors)
+    ]
+    for i in range(0, len(points), EMBEDDING_BATCH):
+        client.upsert(QDRANT_COLLECTION, points=points[i:i + EMBEDDING_BATCH])
+    return True
+
+
+@dramatiq.actor(queue_name="ingest")
+def fetch_and_index(document_id: str):
+    """Fetch, chunk, embed and store a URL requested through POST /ingest/fetch.
+
+    Each stage is written to the url_fetches document (`stage`, `stages.<name>`, `progress`)
+    and published on INGEST_PROGRESS_CHANNEL; the stored document and vectors are keyed by
+    document_id, so a retry redoes the work without duplicating it.
+    """
+    fetch = db.url_fetches.find_one_and_update(
+        {"document_id": document_id},
+        {"$set": {"status": "running", "started_at": datetime.utcnow(), "error": None}, "$inc": {"attempts": 1}}
+    )
+    if not fetch:
+        print(f"[ingest] URL fetch {document_id} not found")
+        return
+    attempts = fetch.get("attempts", 0) + 1
+    url = fetch["url"]
+    try:
+        print(f"[ingest] Indexing {url} as document {document_id}")
+
+        # Text is extracted as it downloads (JSON is parsed from the stream), so one stage covers both
+        with StageTimer(document_id, "fetching"):
+            content, _ = fetch_url_text(url)
+            content = content[:INGEST_MAX_CHARS]
+            update_fetch(document_id, {"progress.characters": len(content)})
+
+        with StageTimer(document_id, "chunking"):
+            chunks = chunk_text(content)
+            update_fetch(document_id, {"progress.chunks": len(chunks), "progress.embedded": 0})
+
+        vectors = []
+        if embeddings_enabled() and chunks:
+            with StageTimer(document_id, "embedding"):
+                vectors = embed_chunks(document_id, chunks)
+        else:
+            update_fetch(document_id, {"stages.embedding.skipped": True})
+
+        with StageTimer(document_id, "storing"):
+            now = datetime.utcnow()
+            db.documents.update_one(
+                {"document_id": document_id},
+                {"$set": {
+                    "document_id": document_id,
+                    "type": "url",
+                    "content": content,
+                    "chunks": chunks,
+                    "metadata": {
+                        "url": url,
+                        "content_length": len(content),
+                        "requested_by": fetch.get("requested_by"),
+                        "fetched_at": now
+                    }
+                }},
+                upsert=True
+            )
+            indexed = store_vectors(document_id, url, chunks, vectors)
+
+        update_fetch(document_id, {
+            "status": "completed",
+            "stage": None,
+            "indexed": indexed,
+            "completed_at": datetime.utcnow()
+        })
+        record_ingest_completed(document_id)
+        if ingest_documents is not None:
+            ingest_documents.labels(status="completed").inc()
+        print(f"[ingest] Indexed {url}: {len(chunks)} chunks, {len(vectors)} vectors")
+
+    except Exception as e:
+        print(f"[ingest] Error indexing {url} ({document_id}): {e}")
+        final = classify_exception(e) == "permanent" or attempts > RETRY_POLICIES["ingest"]["max_retries"]
+        update_fetch(document_id, {
+            "status": "failed" if final else "retrying",
+            "error": str(e),
+            "completed_at": datetime.utcnow() if final else None
+        })
+        if final and ingest_documents is not None:
+            ingest_documents.labels(status="failed").inc()
+        raise e
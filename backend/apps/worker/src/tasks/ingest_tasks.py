@@ -1,49 +1,83 @@
 import dramatiq
 import time
 import os
+from datetime import datetime
 import requests
-from typing import Dict, Any
+from typing import Dict, Any, Tuple, BinaryIO
 from pymongo import MongoClient
 from .common import node_completed
+from .ledger import claim_action, ActionInProgress
+from ..shared_broker import CancellationToken, remaining_budget
+from ..shared_flatten import flatten_to_text, flatten_json_stream
+from ..shared_storage import get_storage
 
 # MongoDB connection
 mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
 mongo_client = MongoClient(mongo_url)
 db = mongo_client.aiwf
 
-@dramatiq.actor(queue_name="ingest")
+def open_uploaded_file(config: Dict[str, Any]) -> Tuple[BinaryIO, str]:
+    """Seekable reader for the node's file and a label for it.
+
+    Files are found by `storage_key`, or by `uploaded_file_id`/`selected_file` through
+    `uploaded_files`; a bare `file_path` only works where the uploading API's disk is mounted.
+    """
+    storage_key = config.get("storage_key")
+    file_path = config.get("file_path")
+    file_id = config.get("uploaded_file_id") or config.get("selected_file")
+    if not storage_key and file_id:
+        file_doc = db.uploaded_files.find_one({"file_id": file_id}, {"storage_key": 1, "file_path": 1})
+        if not file_doc:
+            raise ValueError(f"Uploaded file {file_id} not found")
+        storage_key = file_doc.get("storage_key")
+        file_path = file_path or file_doc.get("file_path")
+    if storage_key:
+        return get_storage().open(storage_key), storage_key
+    if file_path:
+        return open(file_path, "rb"), file_path
+    raise ValueError("No file_path provided in config")
+
+@dramatiq.actor(queue_name="cpu")
 def ingest_pdf(run_id: str, node_id: str, config: Dict[str, Any]):
     """Process PDF document upload"""
+    ledger = None
     try:
         print(f"[ingest] Processing PDF for node {node_id} in run {run_id}")
         
+        # Retries of an already-completed execution return the stored result
+        ledger = claim_action(run_id, node_id, "ingest.pdf", config, {})
+        if ledger.replayed:
+            node_completed(run_id, node_id, ledger.outputs)
+            return
+        
         # Log start
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting PDF processing"
         })
         
-        # Get file path from config
-        file_path = config.get("file_path")
-        if not file_path:
-            raise ValueError("No file_path provided in config")
+        # Resolve the uploaded file; it may live on another host or in an object store
+        file, file_path = open_uploaded_file(config)
         
-        # Extract text content from PDF
-        try:
-            import PyPDF2
-            with open(file_path, 'rb') as file:
+        # Extract text content from PDF; reads are ranged, so only the bytes PyPDF2 touches are fetched
+        with file:
+            try:
+                import PyPDF2
                 pdf_reader = PyPDF2.PdfReader(file)
                 content = ""
+                token = CancellationToken(run_id)
                 for page in pdf_reader.pages:
+                    token.check()
                     content += page.extract_text() + "\n"
-        except ImportError:
-            # Fallback if PyPDF2 is not available
-            content = f"PDF file processed: {file_path}. Content extraction requires PyPDF2 library."
-        except Exception as e:
-            content = f"Error processing PDF: {str(e)}"
+            except ImportError:
+                # Fallback if PyPDF2 is not available
+                content = f"PDF file processed: {file_path}. Content extraction requires PyPDF2 library."
+            except Exception as e:
+                content = f"Error processing PDF: {str(e)}"
         
         # Store document in database
         doc_id = db.documents.insert_one({
@@ -63,36 +97,79 @@ def ingest_pdf(run_id: str, node_id: str, config: Dict[str, Any]):
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "PDF processing completed",
             "outputs": {"document_id": str(doc_id), "content_length": len(content)}
         })
         
         # Mark node as completed and trigger dependent nodes
-        node_completed(run_id, node_id, {"document_id": str(doc_id), "content": content})
+        outputs = {"document_id": str(doc_id), "content": content}
+        ledger.complete(outputs)
+        node_completed(run_id, node_id, outputs)
         
+    except ActionInProgress:
+        raise
     except Exception as e:
+        if ledger:
+            ledger.release()
         print(f"[ingest] Error processing PDF: {e}")
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"PDF processing failed: {str(e)}"
         })
         raise e
 
+def fetch_url_text(url: str, timeout: float = 30) -> Tuple[str, int]:
+    """Download a URL and extract its text (JSON as JSONPath-keyed lines, HTML without markup); returns (text, status code)"""
+    response = requests.get(url, timeout=timeout, stream=True)
+    try:
+        response.raise_for_status()
+        if "json" in response.headers.get("content-type", ""):
+            # Parsed while it downloads; large documents are never held whole
+            response.raw.decode_content = True
+            return flatten_json_stream(response.raw), response.status_code
+        try:
+            from bs4 import BeautifulSoup
+        except ImportError:
+            # Fallback if BeautifulSoup is not available
+            return response.text, response.status_code
+        soup = BeautifulSoup(response.content, 'html.parser')
+        # Remove script and style elements
+        for script in soup(["script", "style"]):
+            script.decompose()
+        content = soup.get_text()
+        # Clean up whitespace
+        lines = (line.strip() for line in content.splitlines())
+        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+        return ' '.join(chunk for chunk in chunks if chunk), response.status_code
+    finally:
+        # Streamed responses hold their connection until closed
+        response.close()
+
 @dramatiq.actor(queue_name="ingest")
 def ingest_url(run_id: str, node_id: str, config: Dict[str, Any]):
     """Fetch and process content from URL"""
+    ledger = None
     try:
         print(f"[ingest] Fetching URL for node {node_id} in run {run_id}")
         
+        # Retries of an already-completed execution return the stored result
+        ledger = claim_action(run_id, node_id, "ingest.url", config, {})
+        if ledger.replayed:
+            node_completed(run_id, node_id, ledger.outputs)
+            return
+        
         # Log start
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting URL fetch"
         })
@@ -104,26 +181,11 @@ def ingest_url(run_id: str, node_id: str, config: Dict[str, Any]):
         
         # Fetch content from URL
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # Extract text content
-            try:
-                from bs4 import BeautifulSoup
-                soup = BeautifulSoup(response.content, 'html.parser')
-                # Remove script and style elements
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                content = soup.get_text()
-                # Clean up whitespace
-                lines = (line.strip() for line in content.splitlines())
-                chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                content = ' '.join(chunk for chunk in chunks if chunk)
-            except ImportError:
-                # Fallback if BeautifulSoup is not available
-                content = response.text
+            content, status_code = fetch_url_text(url, timeout=remaining_budget(30))
+            CancellationToken(run_id).check()
         except Exception as e:
             content = f"Error fetching URL {url}: {str(e)}"
+            status_code = getattr(getattr(e, "response", None), "status_code", None)
         
         # Store document in database
         doc_id = db.documents.insert_one({
@@ -134,7 +196,7 @@ def ingest_url(run_id: str, node_id: str, config: Dict[str, Any]):
                 "node_id": node_id,
                 "run_id": run_id,
                 "url": url,
-                "status_code": response.status_code if 'response' in locals() else None
+                "status_code": status_code
             },
             "created_at": time.time()
         }).inserted_id
@@ -144,80 +206,110 @@ def ingest_url(run_id: str, node_id: str, config: Dict[str, Any]):
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "URL fetch completed",
             "outputs": {"document_id": str(doc_id), "content_length": len(content)}
         })
         
         # Mark node as completed and trigger dependent nodes
-        node_completed(run_id, node_id, {"document_id": str(doc_id), "content": content})
+        outputs = {"document_id": str(doc_id), "content": content}
+        ledger.complete(outputs)
+        node_completed(run_id, node_id, outputs)
         
+    except ActionInProgress:
+        raise
     except Exception as e:
+        if ledger:
+            ledger.release()
         print(f"[ingest] Error fetching URL: {e}")
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"URL fetch failed: {str(e)}"
         })
         raise e
 
+def webhook_outputs(run_id: str, node_id: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Store the webhook payload as a document; also run inline by the orchestrator"""
+    # Get webhook data from inputs
+    webhook_data = inputs.get("data", {})
+    if not webhook_data:
+        raise ValueError("No webhook data provided in inputs")
+    
+    # Plain-text bodies are the content; structured ones become JSONPath-keyed lines
+    content = webhook_data if isinstance(webhook_data, str) else flatten_to_text(webhook_data)
+    
+    # Store document in database
+    doc_id = db.documents.insert_one({
+        "type": "webhook",
+        "content": content,
+        "metadata": {
+            "source": "webhook",
+            "node_id": node_id,
+            "run_id": run_id,
+            "webhook_data": webhook_data
+        },
+        "created_at": time.time()
+    }).inserted_id
+    
+    # `data` keeps the structure for downstream nodes that want fields rather than text
+    return {"document_id": str(doc_id), "content": content, "data": webhook_data}
+
 @dramatiq.actor(queue_name="ingest")
 def ingest_webhook(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]):
     """Process webhook data"""
+    ledger = None
     try:
         print(f"[ingest] Processing webhook for node {node_id} in run {run_id}")
         
+        # Retries of an already-completed execution return the stored result
+        ledger = claim_action(run_id, node_id, "ingest.webhook", config, inputs)
+        if ledger.replayed:
+            node_completed(run_id, node_id, ledger.outputs)
+            return
+        
         # Log start
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Starting webhook processing"
         })
         
-        # Get webhook data from inputs
-        webhook_data = inputs.get("data", {})
-        if not webhook_data:
-            raise ValueError("No webhook data provided in inputs")
-        
-        # Process webhook data
-        content = str(webhook_data)
-        
-        # Store document in database
-        doc_id = db.documents.insert_one({
-            "type": "webhook",
-            "content": content,
-            "metadata": {
-                "source": "webhook",
-                "node_id": node_id,
-                "run_id": run_id,
-                "webhook_data": webhook_data
-            },
-            "created_at": time.time()
-        }).inserted_id
+        outputs = webhook_outputs(run_id, node_id, inputs)
         
         # Log completion
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "INFO",
             "message": "Webhook processing completed",
-            "outputs": {"document_id": str(doc_id), "content_length": len(content)}
+            "outputs": {"document_id": outputs["document_id"], "content_length": len(outputs["content"])}
         })
         
         # Mark node as completed and trigger dependent nodes
-        node_completed(run_id, node_id, {"document_id": str(doc_id), "content": content})
+        ledger.complete(outputs)
+        node_completed(run_id, node_id, outputs)
         
+    except ActionInProgress:
+        raise
     except Exception as e:
+        if ledger:
+            ledger.release()
         print(f"[ingest] Error processing webhook: {e}")
         db.run_logs.insert_one({
             "run_id": run_id,
             "node_id": node_id,
             "timestamp": time.time(),
+            "logged_at": datetime.utcnow(),
             "level": "ERROR",
             "message": f"Webhook processing failed: {str(e)}"
         })
@@ -0,0 +1,37 @@
+import os
+from typing import Dict, Any, Callable, Optional
+
+# Node types cheap enough to run inside the orchestrator instead of as their own message:
+# no external calls, bounded CPU.
+INLINE_NODE_TYPES = {
+    t.strip() for t in os.getenv("INLINE_NODE_TYPES", "ingest.webhook,text.transform").split(",") if t.strip()
+}
+# Most nodes one orchestration step executes inline before handing the rest to the queues
+INLINE_MAX_NODES = int(os.getenv("INLINE_MAX_NODES", "25"))
+
+Executor = Callable[[str, str, Dict[str, Any], Dict[str, Any]], Dict[str, Any]]
+
+
+def _transform(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]) -> Dict[str, Any]:
+    from .ai_tasks import transform_outputs
+    return transform_outputs(config, inputs)
+
+
+def _webhook(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]) -> Dict[str, Any]:
+    from .ingest_tasks import webhook_outputs
+    return webhook_outputs(run_id, node_id, inputs)
+
+
+# Executors return the node's outputs and raise on failure; they never notify node_completed
+INLINE_EXECUTORS: Dict[str, Executor] = {
+    "ingest.webhook": _webhook,
+    "text.transform": _transform,
+}
+
+
+def inline_executor(node: Dict[str, Any]) -> Optional[Executor]:
+    """Executor for nodes the planner may run inline, or None for nodes that need their own task"""
+    node_type = node.get("type")
+    if node_type not in INLINE_NODE_TYPES:
+        return None
+    return INLINE_EXECUTORS.get(node_type)
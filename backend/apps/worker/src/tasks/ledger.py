@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import hashlib
+from typing import Dict, Any, Optional
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from ..shared_indexes import INDEXES
+
+# MongoDB connection
+mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
+mongo_client = MongoClient(mongo_url)
+db = mongo_client.aiwf
+
+# A claim older than this is assumed to belong to a crashed worker and may be taken over
+ACTION_LEDGER_LEASE = float(os.getenv("ACTION_LEDGER_LEASE", "300"))
+
+_indexes_ready = False
+
+
+class ActionInProgress(Exception):
+    """Another attempt of the same action holds a live claim; retry later"""
+
+
+def ensure_ledger_indexes():
+    global _indexes_ready
+    if not _indexes_ready:
+        # Also applied at worker start; claims must not run without the unique key
+        db.action_ledger.create_indexes(INDEXES["action_ledger"])
+        _indexes_ready = True
+
+
+def action_key(run_id: str, node_id: str, config: Dict[str, Any], inputs: Dict[str, Any]) -> str:
+    """Stable key for one node execution; identical across Dramatiq retry attempts"""
+    payload = json.dumps({"config": config, "inputs": inputs}, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+    return f"{run_id}:{node_id}:{digest}"
+
+
+class LedgerEntry:
+    """Claim on a side-effecting node execution.
+
+    `replayed` is True when an earlier attempt already completed; `outputs` then holds
+    its stored result and the caller must not execute the side effect again.
+    """
+
+    def __init__(self, key: str, outputs: Optional[Dict[str, Any]] = None):
+        self.key = key
+        self.outputs = outputs
+        self.replayed = outputs is not None
+
+    def complete(self, outputs: Dict[str, Any]):
+        db.action_ledger.update_one(
+            {"key": self.key},
+            {"$set": {"status": "completed", "outputs": outputs, "completed_at": time.time()}}
+        )
+        self.outputs = outputs
+
+    def release(self):
+        """Drop an unfinished claim so the next retry executes the action again"""
+        if not self.replayed:
+            db.action_ledger.delete_one({"key": self.key, "status": "in_progress"})
+
+
+def claim_action(run_id: str, node_id: str, node_type: str,
+                 config: Dict[str, Any], inputs: Dict[str, Any]) -> LedgerEntry:
+    """Claim an action execution, or return the stored result of a completed one"""
+    ensure_ledger_indexes()
+    key = action_key(run_id, node_id, config, inputs)
+    now = time.time()
+    try:
+        db.action_ledger.insert_one({
+            "key": key,
+            "run_id": run_id,
+            "node_id": node_id,
+            "node_type": node_type,
+            "status": "in_progress",
+            "claimed_at": now
+        })
+        return LedgerEntry(key)
+    except DuplicateKeyError:
+        pass
+
+    existing = db.action_ledger.find_one({"key": key})
+    if existing and existing.get("status") == "completed":
+        print(f"[ledger] Replaying stored result for {node_type} node {node_id} in run {run_id}")
+        return LedgerEntry(key, existing.get("outputs") or {})
+
+    # Take over a stale claim left behind by a crashed attempt
+    taken = db.action_ledger.update_one(
+        {"key": key, "status": "in_progress", "claimed_at": {"$lt": now - ACTION_LEDGER_LEASE}},
+        {"$set": {"claimed_at": now}}
+    )
+    if taken.modified_count:
+        return LedgerEntry(key)
+    raise ActionInProgress(f"{node_type} node {node_id} in run {run_id} is already executing")
@@ -1,17 +1,33 @@
 import dramatiq
 import time
 import os
-from typing import Dict, List, Any
-from pymongo import MongoClient
+from datetime import datetime
+from collections import deque, OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
-
-# Import broker configuration
+from ..shared_broker import (
+    redis_broker, send_in_lane, current_lane, is_run_cancelled, notify_run_finished, DEFAULT_LANE
+)
+from ..shared_workflow import compile_workflow, NODE_HANDLERS
+from . import fair_scheduler
+from .common import as_object_id
+from .ledger import claim_action
 
 # MongoDB connection
 mongo_url = os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")
 mongo_client = MongoClient(mongo_url)
 db = mongo_client.aiwf
 
+# Run-level time budget when the run does not set timeout_ms
+RUN_TIMEOUT_MS = int(os.getenv("RUN_TIMEOUT_MS", str(60 * 60 * 1000)))
+# Workflow versions are immutable, so each process keeps the most recently used ones compiled
+WORKFLOW_SNAPSHOT_CACHE = int(os.getenv("WORKFLOW_SNAPSHOT_CACHE", "256"))
+
+Snapshot = Tuple[int, List[Dict[str, Any]], Dict[str, Dict[str, Any]]]
+_snapshots: "OrderedDict[Tuple[str, int], Snapshot]" = OrderedDict()
+
 @dramatiq.actor(queue_name="default")
 def run_start(run_id: str):
     """Main workflow execution orchestrator"""
@@ -24,29 +40,33 @@ def run_start(run_id: str):
             print(f"[worker] Run {run_id} not found")
             return
         
-        # Get workflow - workflow_id should also be an ObjectId
+        # Compiled graph of the run's workflow version; runs without one (scheduled runs) get the current version
         workflow_id = run.get("workflow_id")
-        if isinstance(workflow_id, str):
-            workflow_id = ObjectId(workflow_id)
-        workflow = db.workflows.find_one({"_id": workflow_id})
-        if not workflow:
+        snapshot = load_snapshot(workflow_id, run.get("workflow_version"))
+        if not snapshot:
             print(f"[worker] Workflow {workflow_id} not found")
             return
+        version, nodes, execution_plan = snapshot
         
-        # Update run status to running
-        db.runs.update_one(
-            {"_id": ObjectId(run_id)},
-            {"$set": {"status": "running", "started_at": time.time()}}
+        # Claim the run and pin its version; a duplicate run_start message (e.g. re-enqueued by the scheduler) is a no-op
+        started_at = time.time()
+        deadline = started_at + (run.get("timeout_ms") or RUN_TIMEOUT_MS) / 1000
+        claimed = db.runs.update_one(
+            {"_id": ObjectId(run_id), "status": "queued"},
+            {"$set": {"status": "running", "started_at": started_at, "deadline": deadline,
+                      "workflow_version": version}}
         )
+        if not claimed.modified_count:
+            print(f"[worker] Run {run_id} already started, skipping")
+            return
         
-        # Compute execution DAG
-        execution_plan = compute_execution_plan(workflow)
-        
-        # Enqueue initial nodes (nodes with no dependencies)
+        # Start initial nodes (nodes with no dependencies) with the run's inputs
         initial_nodes = [node for node in execution_plan if not execution_plan[node]["dependencies"]]
+        run_inputs = run.get("inputs") or {}
         
-        for node_id in initial_nodes:
-            enqueue_node_task(run_id, workflow_id, node_id, workflow["nodes"], {})
+        advance_run(run_id, workflow_id, nodes, execution_plan, run.get("node_status") or {},
+                    [(node_id, run_inputs) for node_id in initial_nodes],
+                    tenant=run.get("created_by"), lane=run.get("lane", DEFAULT_LANE), deadline=deadline)
         
         print(f"[worker] Run {run_id} started with {len(initial_nodes)} initial nodes")
         
@@ -57,146 +77,339 @@ def run_start(run_id: str):
             {"_id": ObjectId(run_id)},
             {"$set": {"status": "failed", "error": str(e)}}
         )
+        notify_run_finished(run_id, "failed")
+
+def load_snapshot(workflow_id, version: Optional[int] = None) -> Optional[Snapshot]:
+    """(version, nodes, execution plan) of a compiled workflow version; None if the workflow is gone.
 
-def compute_execution_plan(workflow: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
-    """Compute execution order and dependencies for workflow nodes"""
-    nodes = {node["id"]: node for node in workflow.get("nodes", [])}
-    edges = workflow.get("edges", [])
+    Snapshots are stored once per version by the API and never change, so after the first
+    load a run's orchestration steps read neither the workflow nor its graph.
+    """
+    workflow_id = str(workflow_id)
+    if version is None:
+        workflow = db.workflows.find_one({"_id": as_object_id(workflow_id)}, {"version": 1})
+        if not workflow:
+            return None
+        version = workflow.get("version", 1)
     
-    # Build dependency graph
-    dependencies = {}
-    dependents = {}
+    key = (workflow_id, version)
+    snapshot = _snapshots.get(key)
+    if snapshot:
+        _snapshots.move_to_end(key)
+        return snapshot
     
-    for edge in edges:
-        source = edge["source"]
-        target = edge["target"]
-        
-        if target not in dependencies:
-            dependencies[target] = []
-        dependencies[target].append(source)
+    doc = db.workflow_versions.find_one({"workflow_id": workflow_id, "version": version}, {"compiled": 1})
+    compiled = doc["compiled"] if doc else compile_unversioned(workflow_id, version)
+    if compiled is None:
+        return None
+    
+    steps = compiled["steps"]
+    execution_plan = {
+        step["id"]: {"node": step["node"], "dependencies": step["dependencies"], "dependents": step["dependents"]}
+        for step in steps
+    }
+    snapshot = (version, [step["node"] for step in steps], execution_plan)
+    _snapshots[key] = snapshot
+    if len(_snapshots) > WORKFLOW_SNAPSHOT_CACHE:
+        _snapshots.popitem(last=False)
+    return snapshot
+
+def compile_unversioned(workflow_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """Compile a workflow saved before versions were stored, storing the snapshot for later runs"""
+    workflow = db.workflows.find_one({"_id": as_object_id(workflow_id)})
+    if not workflow:
+        return None
+    compiled = compile_workflow(workflow.get("nodes", []), workflow.get("edges", []))
+    if workflow.get("version", 1) != version:
+        # Only the current graph of an unversioned workflow exists
+        print(f"[worker] Version {version} of workflow {workflow_id} was not kept, "
+              f"using version {workflow.get('version', 1)}")
+        return compiled
+    try:
+        db.workflow_versions.insert_one({
+            "workflow_id": workflow_id,
+            "version": version,
+            "nodes": workflow.get("nodes", []),
+            "edges": workflow.get("edges", []),
+            "compiled": compiled,
+            "created_at": datetime.utcnow(),
+            "created_by": workflow.get("created_by")
+        })
+    except DuplicateKeyError:
+        # Another worker stored it first
+        pass
+    return compiled
+
+def node_timeout_ms(node: Dict) -> int:
+    """Per-node time budget from `timeout_ms` in the node's config, if set"""
+    config = node.get("config") or {}
+    return config.get("timeout_ms") or (config.get("config") or {}).get("timeout_ms")
+
+def claim_node(run_id: str, node_id: str, status: str) -> bool:
+    """Move a node out of "not started"; False when another orchestration step already took it.
+
+    Two parents completing at once both see their shared child as ready, so every start of a
+    node goes through this conditional update.
+    """
+    claimed = db.runs.update_one(
+        {"_id": ObjectId(run_id), f"node_status.{node_id}": {"$exists": False}},
+        {"$set": {f"node_status.{node_id}": status}}
+    )
+    return bool(claimed.modified_count)
+
+def release_inline_claims(run_id: str, node_ids: List[str]):
+    """Put inline nodes whose results were never written back to not started"""
+    for node_id in node_ids:
+        db.runs.update_one(
+            {"_id": ObjectId(run_id), f"node_status.{node_id}": "running"},
+            {"$unset": {f"node_status.{node_id}": ""}}
+        )
+
+def advance_run(run_id: str, workflow_id, nodes: List[Dict], execution_plan: Dict[str, Dict],
+                node_status: Dict[str, str], ready: List[Tuple[str, Dict[str, Any]]],
+                tenant: str = None, lane: str = None, deadline: float = None):
+    """Start ready nodes: cheap ones run right here, the rest are enqueued on their queues.
+
+    `ready` pairs node ids with their inputs. A node run inline makes its dependents ready
+    immediately, so a chain of cheap nodes finishes without a queue round trip per node.
+    Their statuses, sink outputs and logs are written in one update at the end.
+    """
+    from .inline import inline_executor, INLINE_MAX_NODES
+    
+    if is_run_cancelled(run_id):
+        print(f"[worker] Run {run_id} was cancelled, not starting nodes")
+        return
+    
+    nodes_by_id = {n["id"]: n for n in nodes}
+    node_status = dict(node_status)
+    pending = deque(ready)
+    started = {node_id for node_id, _ in ready}
+    completed: Dict[str, Dict[str, Any]] = {}
+    remote: List[Tuple[str, Dict[str, Any]]] = []
+    logs = []
+    failure = None
+    # Inline nodes marked "running" whose results are not written yet
+    claimed: List[str] = []
+    
+    try:
+        while pending:
+            node_id, inputs = pending.popleft()
+            node = nodes_by_id.get(node_id)
+            executor = inline_executor(node) if node else None
+            if (executor is None or len(completed) >= INLINE_MAX_NODES
+                    or (deadline and time.time() >= deadline)):
+                remote.append((node_id, inputs))
+                continue
+            if not claim_node(run_id, node_id, "running"):
+                continue
+            claimed.append(node_id)
+            
+            started_at = time.time()
+            config = node.get("config", {})
+            ledger = None
+            try:
+                # Same ledger as the node's actor, so a redelivered step replays instead of re-executing
+                ledger = claim_action(run_id, node_id, node["type"], config, inputs)
+                if ledger.replayed:
+                    outputs = ledger.outputs
+                else:
+                    outputs = executor(run_id, node_id, config, inputs)
+                    ledger.complete(outputs)
+            except Exception as e:
+                if ledger:
+                    ledger.release()
+                print(f"[worker] Inline node {node_id} failed in run {run_id}: {e}")
+                failure = (node_id, e)
+                break
+            except BaseException:
+                if ledger:
+                    ledger.release()
+                raise
+            
+            completed[node_id] = outputs
+            node_status[node_id] = "completed"
+            logs.append({
+                "run_id": run_id,
+                "node_id": node_id,
+                "timestamp": time.time(),
+                "logged_at": datetime.utcnow(),
+                "level": "INFO",
+                "message": f"Node {node_id} completed inline in {(time.time() - started_at) * 1000:.1f}ms",
+                "outputs": outputs
+            })
+            
+            for dependent in execution_plan[node_id]["dependents"]:
+                if dependent in started or dependent in node_status:
+                    continue
+                if all(node_status.get(dep) == "completed" for dep in execution_plan[dependent]["dependencies"]):
+                    started.add(dependent)
+                    pending.append((dependent, outputs))
         
-        if source not in dependents:
-            dependents[source] = []
-        dependents[source].append(target)
+        run = None
+        if completed or failure:
+            update = {f"node_status.{nid}": "completed" for nid in completed}
+            for nid, outputs in completed.items():
+                # Sink outputs are the run's outputs
+                if not execution_plan[nid]["dependents"]:
+                    update[f"outputs.{nid}"] = outputs
+            if failure:
+                node_id, error = failure
+                update[f"node_status.{node_id}"] = "failed"
+                logs.append({
+                    "run_id": run_id,
+                    "node_id": node_id,
+                    "timestamp": time.time(),
+                    "logged_at": datetime.utcnow(),
+                    "level": "ERROR",
+                    "message": f"Node {node_id} failed inline: {error}"
+                })
+            run = db.runs.find_one_and_update(
+                {"_id": ObjectId(run_id)}, {"$set": update},
+                projection={"node_status": 1, "status": 1}, return_document=ReturnDocument.AFTER
+            )
+        claimed = []
+    except BaseException:
+        # Without this the claimed nodes would stay "running" forever; back to not started,
+        # a retry of this step claims them again and the ledger replays finished ones
+        release_inline_claims(run_id, claimed)
+        raise
     
-    # Create execution plan
-    execution_plan = {}
-    for node_id, node in nodes.items():
-        execution_plan[node_id] = {
-            "node": node,
-            "dependencies": dependencies.get(node_id, []),
-            "dependents": dependents.get(node_id, []),
-            "status": "pending",
-            "inputs": {},
-            "outputs": {}
-        }
+    if logs:
+        db.run_logs.insert_many(logs)
+    if failure:
+        # A cancelled run, or one the deadline sweep already failed, keeps its status
+        failed = db.runs.update_one(
+            {"_id": ObjectId(run_id), "status": {"$in": ["queued", "running"]}},
+            {"$set": {"status": "failed", "error": str(failure[1]), "completed_at": time.time()}}
+        )
+        if failed.modified_count:
+            notify_run_finished(run_id, "failed")
+        return
+    if run:
+        complete_run_if_done(run_id, execution_plan, run.get("node_status") or {})
     
-    return execution_plan
+    for node_id, inputs in remote:
+        enqueue_node_task(run_id, workflow_id, node_id, nodes, inputs,
+                          tenant=tenant, lane=lane, deadline=deadline)
+
+def complete_run_if_done(run_id: str, execution_plan: Dict[str, Dict], node_status: Dict[str, str]) -> bool:
+    """Mark the run succeeded once every node completed; exactly one caller wins"""
+    if not all(node_status.get(nid) == "completed" for nid in execution_plan):
+        return False
+    finished = db.runs.update_one(
+        {"_id": ObjectId(run_id), "status": "running"},
+        {"$set": {"status": "succeeded", "completed_at": time.time()}}
+    )
+    if not finished.modified_count:
+        return False
+    print(f"[worker] Run {run_id} completed successfully")
+    notify_run_finished(run_id, "succeeded")
+    return True
 
-def enqueue_node_task(run_id: str, workflow_id: str, node_id: str, nodes: List[Dict], inputs: Dict[str, Any]):
-    """Enqueue a node task for execution"""
+def enqueue_node_task(run_id: str, workflow_id: str, node_id: str, nodes: List[Dict], inputs: Dict[str, Any],
+                      tenant: str = None, lane: str = None, deadline: float = None):
+    """Enqueue a node task, or park it when the run's owner is at their concurrency cap"""
     try:
+        if is_run_cancelled(run_id):
+            print(f"[worker] Run {run_id} was cancelled, not enqueueing node {node_id}")
+            return
+        
         # Find the node
         node = next((n for n in nodes if n["id"] == node_id), None)
         if not node:
             print(f"[worker] Node {node_id} not found")
             return
         
-        node_type = node["type"]
+        if not claim_node(run_id, node_id, "queued"):
+            print(f"[worker] Node {node_id} already started in run {run_id}")
+            return
         
-        # Log task enqueuing
-        db.run_logs.insert_one({
+        lane = lane or current_lane()
+        task = {
             "run_id": run_id,
+            "workflow_id": str(workflow_id),
             "node_id": node_id,
-            "timestamp": time.time(),
-            "level": "INFO",
-            "message": f"Enqueuing node {node_id} ({node_type})",
-            "inputs": inputs
-        })
+            "node": node,
+            "inputs": inputs,
+            "lane": lane,
+            "tenant": tenant,
+            "deadline": deadline
+        }
+        if not fair_scheduler.admit(tenant, lane, run_id, node_id, task):
+            db.run_logs.insert_one({
+                "run_id": run_id,
+                "node_id": node_id,
+                "timestamp": time.time(),
+                "logged_at": datetime.utcnow(),
+                "level": "INFO",
+                "message": f"Node {node_id} deferred: tenant at concurrency cap"
+            })
+            # A slot freed between the cap check and parking would otherwise go unused
+            dispatch_pending_tasks()
+            return
         
-        # Enqueue based on node type
-        if node_type.startswith("ingest."):
-            enqueue_ingest_task(run_id, node_id, node, inputs)
-        elif node_type.startswith("ai."):
-            enqueue_ai_task(run_id, node_id, node, inputs)
-        elif node_type.startswith("act."):
-            enqueue_action_task(run_id, node_id, node, inputs)
-        else:
-            print(f"[worker] Unknown node type: {node_type}")
+        dispatch_node_task(run_id, node_id, node, inputs, lane, deadline, tenant)
             
     except Exception as e:
         print(f"[worker] Error enqueuing node {node_id}: {e}")
 
-def enqueue_ingest_task(run_id: str, node_id: str, node: Dict, inputs: Dict[str, Any]):
-    """Enqueue ingest node tasks"""
-    node_type = node["type"]
-    
-    if node_type == "ingest.pdf":
-        from .ingest_tasks import ingest_pdf
-        ingest_pdf.send(run_id, node_id, node.get("config", {}))
-    elif node_type == "ingest.url":
-        from .ingest_tasks import ingest_url
-        ingest_url.send(run_id, node_id, node.get("config", {}))
-    elif node_type == "ingest.webhook":
-        from .ingest_tasks import ingest_webhook
-        ingest_webhook.send(run_id, node_id, node.get("config", {}))
-    else:
-        print(f"[worker] Unknown ingest type: {node_type}")
-
-def enqueue_ai_task(run_id: str, node_id: str, node: Dict, inputs: Dict[str, Any]):
-    """Enqueue AI node tasks"""
-    node_type = node["type"]
-    
-    if node_type == "ai.rag_qa":
-        from .ai_tasks import rag_query
-        rag_query.send(run_id, node_id, node.get("config", {}), inputs)
-    elif node_type == "ai.summarize":
-        from .ai_tasks import summarize_text
-        summarize_text.send(run_id, node_id, node.get("config", {}), inputs)
-    elif node_type == "ai.classify":
-        from .ai_tasks import classify_text
-        classify_text.send(run_id, node_id, node.get("config", {}), inputs)
-    elif node_type == "text.transform":
-        from .ai_tasks import transform_text
-        transform_text.send(run_id, node_id, node.get("config", {}), inputs)
-    else:
-        print(f"[worker] Unknown AI type: {node_type}")
-
-def enqueue_action_task(run_id: str, node_id: str, node: Dict, inputs: Dict[str, Any]):
-    """Enqueue action node tasks"""
+def dispatch_node_task(run_id: str, node_id: str, node: Dict, inputs: Dict[str, Any], lane: str,
+                       deadline: float = None, tenant: str = None):
+    """Send an admitted node task to its actor's queue in the run's lane.
+
+    The message carries the tenant so the retry policy frees its slot if it is dead-lettered.
+    """
     node_type = node["type"]
     
-    if node_type == "act.slack":
-        from .action_tasks import post_slack
-        post_slack.send(run_id, node_id, node.get("config", {}), inputs)
-    elif node_type == "act.sheets":
-        from .action_tasks import append_sheets
-        append_sheets.send(run_id, node_id, node.get("config", {}), inputs)
-    elif node_type == "act.email":
-        from .action_tasks import send_email
-        send_email.send(run_id, node_id, node.get("config", {}), inputs)
-    elif node_type == "act.notion":
-        from .action_tasks import upsert_notion
-        upsert_notion.send(run_id, node_id, node.get("config", {}), inputs)
-    elif node_type == "act.twilio":
-        from .action_tasks import send_sms
-        send_sms.send(run_id, node_id, node.get("config", {}), inputs)
-    else:
-        print(f"[worker] Unknown action type: {node_type}")
-
-
-
-def get_ready_nodes(run_id: str, execution_plan: Dict[str, Dict]) -> List[str]:
-    """Get nodes that are ready to execute (all dependencies completed)"""
-    run = db.runs.find_one({"_id": ObjectId(run_id)})
-    if not run:
-        return []
+    # Log task enqueuing
+    db.run_logs.insert_one({
+        "run_id": run_id,
+        "node_id": node_id,
+        "timestamp": time.time(),
+        "logged_at": datetime.utcnow(),
+        "level": "INFO",
+        "message": f"Enqueuing node {node_id} ({node_type})",
+        "inputs": inputs
+    })
     
-    node_status = run.get("node_status", {})
+    # Send to the actor the node was bound to when its workflow version was compiled
+    handler = node.get("handler") or NODE_HANDLERS.get(node_type)
+    if handler is None:
+        print(f"[worker] Unknown node type: {node_type}")
+        return
+    config = node.get("config", {})
+    args = (run_id, node_id, config, inputs) if handler["inputs"] else (run_id, node_id, config)
+    send_in_lane(redis_broker.get_actor(handler["actor"]), *args,
+                 lane=lane, deadline=deadline, timeout_ms=node_timeout_ms(node), tenant=tenant, node_id=node_id)
+
+def dispatch_pending_tasks():
+    """Dispatch parked node tasks, fairly across tenants, into freed capacity"""
+    for task in fair_scheduler.next_pending():
+        if is_run_cancelled(task["run_id"]):
+            # Drop parked work of cancelled runs and hand the slot back
+            if task.get("tenant"):
+                fair_scheduler.release(task["tenant"], task["run_id"], task["node_id"])
+            continue
+        dispatch_node_task(task["run_id"], task["node_id"], task["node"], task["inputs"], task["lane"],
+                           task.get("deadline"), task.get("tenant"))
+
+@dramatiq.actor(queue_name="default")
+def dispatch_pending():
+    """Sweep parked node tasks into free slots; sent by the scheduler and after a node is dead-lettered"""
+    dispatch_pending_tasks()
+
+def get_ready_nodes(run_id: str, execution_plan: Dict[str, Dict], node_status: Dict[str, str] = None) -> List[str]:
+    """Get nodes that are ready to execute (all dependencies completed, not yet started)"""
+    if node_status is None:
+        run = db.runs.find_one({"_id": ObjectId(run_id)})
+        if not run:
+            return []
+        node_status = run.get("node_status", {})
     ready_nodes = []
     
     for node_id, plan in execution_plan.items():
-        if node_status.get(node_id) == "completed":
+        # Queued, running, completed and failed nodes were all started by an earlier step
+        if node_id in node_status:
             continue
             
         # Check if all dependencies are completed
@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional, Tuple
+from ..shared_broker import parse_retry_after, TransientError, PermanentError
+
+SHEETS_API_URL = os.getenv("SHEETS_API_URL", "https://sheets.googleapis.com/v4/spreadsheets/")
+# Flush a spreadsheet's buffer once it holds this many rows, or after this many seconds
+SHEETS_BATCH_ROWS = int(os.getenv("SHEETS_BATCH_ROWS", "500"))
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "1.0"))
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+
+SHEETS_SCOPE = "https://www.googleapis.com/auth/spreadsheets"
+
+# Service-account auth is optional; without it GOOGLE_CREDENTIALS is used as a bearer token
+try:
+    from google.oauth2 import service_account
+    from google.auth.transport.requests import Request as GoogleAuthRequest
+    GOOGLE_AUTH_AVAILABLE = True
+except ImportError:
+    GOOGLE_AUTH_AVAILABLE = False
+
+_RANGE_RE = re.compile(r"^(?P<sheet>.+)!(?P<c1>[A-Z]+)(?P<r1>\d+)(?::(?P<c2>[A-Z]+)(?P<r2>\d+))?$")
+
+
+class SheetsError(Exception):
+    """Raised when an append could not be written; the waiting actor re-raises it"""
+
+
+class SheetsTransientError(SheetsError, TransientError):
+    """Quota or Sheets-side failures that outlasted the in-process retries; the actor is retried"""
+
+
+class SheetsPermanentError(SheetsError, PermanentError):
+    """4xx responses (bad spreadsheet id, missing permission, malformed range); never retried"""
+
+
+class _TokenProvider:
+    """Caches an OAuth access token and refreshes it shortly before expiry"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = None
+        raw = os.getenv("SHEETS_CREDENTIALS_JSON")
+        if raw and GOOGLE_AUTH_AVAILABLE:
+            info = json.loads(raw)
+            self._credentials = service_account.Credentials.from_service_account_info(info, scopes=[SHEETS_SCOPE])
+        self._static_token = os.getenv("GOOGLE_CREDENTIALS")
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._credentials or self._static_token)
+
+    def token(self) -> str:
+        if not self._credentials:
+            return self._static_token
+        with self._lock:
+            if not self._credentials.valid:
+                self._credentials.refresh(GoogleAuthRequest())
+            return self._credentials.token
+
+
+class _Waiter:
+    def __init__(self, rows: List[List[Any]]):
+        self.rows = rows
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Exception] = None
+
+
+def _split_range(updated_range: str) -> Optional[Tuple[str, str, int, str]]:
+    match = _RANGE_RE.match(updated_range)
+    if not match:
+        return None
+    return match["sheet"], match["c1"], int(match["r1"]), match["c2"] or match["c1"]
+
+
+class _AppendBuffer:
+    """Coalesces rows for one sheet; the first waiter of each batch performs the flush"""
+
+    def __init__(self, client: "SheetsClient", spreadsheet_id: str, sheet_name: str):
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.cond = threading.Condition()
+        self.pending: List[_Waiter] = []
+        self.pending_rows = 0
+        self.has_leader = False
+
+    def append(self, rows: List[List[Any]], timeout: float) -> Dict[str, Any]:
+        waiter = _Waiter(rows)
+        with self.cond:
+            self.pending.append(waiter)
+            self.pending_rows += len(rows)
+            if self.pending_rows >= SHEETS_BATCH_ROWS:
+                self.cond.notify_all()
+            leader = not self.has_leader
+            if leader:
+                self.has_leader = True
+                deadline = time.time() + SHEETS_FLUSH_INTERVAL
+                try:
+                    while self.pending_rows < SHEETS_BATCH_ROWS:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self.cond.wait(remaining)
+                except BaseException:
+                    # Interrupted while collecting: the next append leads, without our rows
+                    self._withdraw(waiter)
+                    self.has_leader = False
+                    raise
+                batch, self.pending, self.pending_rows = self.pending, [], 0
+                self.has_leader = False
+        if leader:
+            self._flush(batch)
+        if not waiter.done.wait(timeout):
+            with self.cond:
+                withdrawn = self._withdraw(waiter)
+            if withdrawn:
+                raise SheetsTransientError(f"Timed out waiting for Sheets append to {self.spreadsheet_id}")
+            # A flush already took the rows; failing now would make the retry append them twice
+            waiter.done.wait()
+        if waiter.error:
+            raise waiter.error
+        return waiter.result
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Take a waiter's rows out of the batch being collected; False once a flush took them"""
+        if waiter not in self.pending:
+            return False
+        self.pending.remove(waiter)
+        self.pending_rows -= len(waiter.rows)
+        return True
+
+    def _flush(self, batch: List[_Waiter]):
+        rows = [row for waiter in batch for row in waiter.rows]
+        try:
+            result = self.client.append_values(self.spreadsheet_id, self.sheet_name, rows)
+            updated_range = result.get("updates", {}).get("updatedRange", "")
+            parsed = _split_range(updated_range)
+            offset = 0
+            for waiter in batch:
+                # Report each run the slice of the combined range its rows landed in
+                if parsed and waiter.rows:
+                    sheet, c1, r1, c2 = parsed
+                    start = r1 + offset
+                    waiter_range = f"{sheet}!{c1}{start}:{c2}{start + len(waiter.rows) - 1}"
+                else:
+                    waiter_range = updated_range
+                waiter.result = {
+                    "updatedRange": waiter_range,
+                    "batchRange": updated_range,
+                    "batchRows": len(rows),
+                    "rows_added": len(waiter.rows),
+                }
+                offset += len(waiter.rows)
+        except Exception as e:
+            for waiter in batch:
+                waiter.error = e
+        finally:
+            for waiter in batch:
+                if waiter.result is None and waiter.error is None:
+                    # The leader was interrupted (time limit, cancellation) inside the call
+                    waiter.error = SheetsTransientError(f"Sheets append to {self.spreadsheet_id} was interrupted")
+                waiter.done.set()
+
+
+class SheetsClient:
+    """Pooled Sheets API session with per-sheet append buffers and quota-aware retries"""
+
+    def __init__(self, tokens: _TokenProvider):
+        self.tokens = tokens
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self._buffers: Dict[Tuple[str, str], _AppendBuffer] = {}
+        self._buffers_lock = threading.Lock()
+
+    def append_values(self, spreadsheet_id: str, sheet_name: str, rows: List[List[Any]]) -> Dict[str, Any]:
+        """Single values:append call, retried with backoff on 429 and 5xx responses"""
+        url = f"{SHEETS_API_URL}{spreadsheet_id}/values/{sheet_name}:append"
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            response = self.session.post(
+                url,
+                headers={"Authorization": f"Bearer {self.tokens.token()}"},
+                params={"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"},
+                json={"values": rows},
+                timeout=30
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == SHEETS_MAX_RETRIES:
+                    break
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = retry_after if retry_after is not None else min(2 ** attempt, 32) + random.random()
+                print(f"[actions] Sheets returned {response.status_code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            if response.status_code >= 400:
+                raise SheetsPermanentError(f"Sheets API error {response.status_code}: {response.text[:200]}")
+            return response.json()
+        raise SheetsTransientError(f"Sheets API quota exceeded for {spreadsheet_id} after {SHEETS_MAX_RETRIES} retries")
+
+    def append(self, spreadsheet_id: str, sheet_name: str, rows: List[List[Any]],
+               timeout: float = 120) -> Dict[str, Any]:
+        """Queue rows for the sheet and block until the batch containing them is written"""
+        key = (spreadsheet_id, sheet_name)
+        with self._buffers_lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = _AppendBuffer(self, spreadsheet_id, sheet_name)
+        return buffer.append(rows, timeout)
+
+
+_client: Optional[SheetsClient] = None
+_client_lock = threading.Lock()
+
+
+def get_sheets_client() -> Optional[SheetsClient]:
+    """Return the shared client, or None when no Google credentials are configured"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            tokens = _TokenProvider()
+            if not tokens.configured:
+                return None
+            _client = SheetsClient(tokens)
+        return _client
+
+
+def rows_from_data(data: Any) -> List[List[Any]]:
+    """Normalize node input into a list of rows"""
+    if data is None or data == "":
+        return []
+    if not isinstance(data, list):
+        data = [data]
+    rows = []
+    for item in data:
+        if isinstance(item, list):
+            rows.append(item)
+        elif isinstance(item, dict):
+            rows.append(list(item.values()))
+        else:
+            rows.append([item])
+    return rows
@@ -0,0 +1,158 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, Optional
+from ..shared_broker import remaining_budget, parse_retry_after, TransientError, PermanentError
+
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+# Slack allows roughly one message per second per channel
+SLACK_CHANNEL_INTERVAL = float(os.getenv("SLACK_CHANNEL_INTERVAL", "1.0"))
+# Longest a post waits in-process for its channel slot; beyond that the actor is re-enqueued
+# with a delay (SlackError.retry_after) instead of holding an actions-pool thread
+SLACK_MAX_PACING_WAIT = float(os.getenv("SLACK_MAX_PACING_WAIT", "3"))
+
+
+# Slack API error codes that a later attempt can succeed with; every other one is permanent
+SLACK_TRANSIENT_ERRORS = {"ratelimited", "internal_error", "fatal_error", "service_unavailable", "request_timeout"}
+
+
+class SlackError(Exception):
+    """Raised when Slack rejects a request; the actor lets it propagate so RetryPolicy can act"""
+
+    def __init__(self, error: str, retry_after: Optional[float] = None):
+        super().__init__(f"Slack API error: {error}")
+        self.error = error
+        self.retry_after = retry_after
+
+
+class SlackTransientError(SlackError, TransientError):
+    """Rate limits and Slack-side failures; retried after `retry_after` when Slack gives one"""
+
+
+class SlackPermanentError(SlackError, PermanentError):
+    """API errors no retry fixes, e.g. channel_not_found or invalid_auth; dead-lettered at once"""
+
+
+def slack_error(error: str, retry_after: Optional[float] = None) -> SlackError:
+    if error in SLACK_TRANSIENT_ERRORS:
+        return SlackTransientError(error, retry_after=retry_after)
+    return SlackPermanentError(error)
+
+
+class _ChannelState:
+    """When one channel may next be posted to; the lock is only held to book a slot, never while waiting"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_allowed = 0.0
+        self.thread_ts: Optional[str] = None
+        self.thread_started = 0.0
+
+
+class SlackClient:
+    """Process-wide Slack Web API client with a pooled HTTP session and per-channel pacing"""
+
+    def __init__(self, token: str, base_url: str = SLACK_API_URL):
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json; charset=utf-8",
+        })
+        self._channels: Dict[str, _ChannelState] = {}
+        self._channels_lock = threading.Lock()
+
+    def _channel(self, channel: str) -> _ChannelState:
+        with self._channels_lock:
+            state = self._channels.get(channel)
+            if state is None:
+                state = self._channels[channel] = _ChannelState()
+            return state
+
+    def _call(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = self.session.post(self.base_url + method, json=payload, timeout=remaining_budget(10))
+        if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get("Retry-After")) or 1.0
+            raise SlackTransientError("ratelimited", retry_after=retry_after)
+        if response.status_code >= 500:
+            raise SlackTransientError(f"http_{response.status_code}",
+                                      retry_after=parse_retry_after(response.headers.get("Retry-After")))
+        if response.status_code >= 400:
+            raise SlackPermanentError(f"http_{response.status_code}")
+        result = response.json()
+        if not result.get("ok"):
+            raise slack_error(result.get("error", "unknown_error"))
+        return result
+
+    def _book_slot(self, state: _ChannelState) -> float:
+        """Reserve the channel's next send time; raise instead of waiting longer than allowed"""
+        with state.lock:
+            now = time.time()
+            slot = max(now, state.next_allowed)
+            wait = slot - now
+            if wait > min(SLACK_MAX_PACING_WAIT, remaining_budget(SLACK_MAX_PACING_WAIT)):
+                raise SlackTransientError("ratelimited", retry_after=wait)
+            state.next_allowed = slot + SLACK_CHANNEL_INTERVAL
+            return wait
+
+    def post_message(self, channel: str, text: str, thread_window: float = 0,
+                     username: Optional[str] = None) -> Dict[str, Any]:
+        """Post to a channel, pacing posts per channel and honouring Retry-After.
+
+        A post whose channel slot is more than SLACK_MAX_PACING_WAIT away, or that Slack
+        rate-limits, raises SlackTransientError with `retry_after`; the retry middleware
+        re-enqueues the message with that delay, so a hot channel never parks other actions'
+        threads. Errors a retry cannot fix raise SlackPermanentError.
+
+        With thread_window > 0, messages posted to the same channel within that many seconds
+        of the first one are sent as replies in its thread instead of as new channel messages.
+        """
+        state = self._channel(channel)
+        wait = self._book_slot(state)
+        if wait > 0:
+            time.sleep(wait)
+
+        payload: Dict[str, Any] = {"channel": channel, "text": text}
+        if username:
+            payload["username"] = username
+        now = time.time()
+        with state.lock:
+            threaded = bool(thread_window and state.thread_ts and now - state.thread_started < thread_window)
+            if threaded:
+                payload["thread_ts"] = state.thread_ts
+
+        try:
+            result = self._call("chat.postMessage", payload)
+        except SlackError as e:
+            if e.retry_after is not None:
+                # Hold the whole channel back until Slack says we may post again
+                with state.lock:
+                    state.next_allowed = max(state.next_allowed, time.time() + e.retry_after)
+            raise
+
+        if thread_window and not threaded:
+            with state.lock:
+                state.thread_ts = result.get("ts")
+                state.thread_started = now
+        result["thread_ts"] = payload.get("thread_ts")
+        return result
+
+
+_client: Optional[SlackClient] = None
+_client_lock = threading.Lock()
+
+
+def get_slack_client() -> Optional[SlackClient]:
+    """Return the shared client, or None when no bot token is configured"""
+    global _client
+    token = os.getenv("SLACK_BOT_TOKEN")
+    if not token:
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = SlackClient(token)
+        return _client
@@ -0,0 +1,300 @@
+import re
+import json
+import string
+from functools import lru_cache
+from typing import Dict, Any, List, Callable, Optional
+from ..shared_broker import PermanentError
+
+# Legacy single-op configs ({"type": "uppercase"}) map onto case modes
+LEGACY_CASE_TYPES = {
+    "uppercase": "upper",
+    "lowercase": "lower",
+    "title_case": "title",
+    "reverse": "reverse",
+}
+
+CASE_FUNCS: Dict[str, Callable[[str], str]] = {
+    "upper": str.upper,
+    "lower": str.lower,
+    "title": str.title,
+    "capitalize": str.capitalize,
+    "swapcase": str.swapcase,
+    "strip": str.strip,
+    "reverse": lambda s: s[::-1],
+}
+
+REGEX_FLAGS = {
+    "i": re.IGNORECASE,
+    "m": re.MULTILINE,
+    "s": re.DOTALL,
+    "x": re.VERBOSE,
+}
+
+_JSONPATH_TOKEN = re.compile(r"\.([A-Za-z_][\w-]*)|\[(\d+|\*|'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")\]|\.\*")
+_JSONPATH_ESCAPE = re.compile(r"\\(.)")
+
+
+class TransformError(PermanentError, ValueError):
+    """Raised when a transform config cannot be compiled or applied; retrying never helps"""
+
+
+class _Missing(dict):
+    """format_map mapping that renders unknown fields as empty strings"""
+    def __missing__(self, key):
+        return ""
+
+
+def _as_text(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def _on_field(fn: Callable[[str], str], field: Optional[str]) -> Callable[[Any], Any]:
+    """Lift a str -> str function onto a record, optionally targeting one field"""
+    if field:
+        def apply(value):
+            if isinstance(value, dict):
+                if field in value:
+                    value = dict(value)
+                    value[field] = fn(_as_text(value[field]))
+                return value
+            return fn(_as_text(value))
+        return apply
+    return lambda value: fn(_as_text(value))
+
+
+def _compile_case(spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    mode = spec.get("mode", "upper")
+    if mode not in CASE_FUNCS:
+        raise TransformError(f"Unknown case mode: {mode}")
+    if spec.get("field"):
+        return _on_field(CASE_FUNCS[mode], spec["field"])
+    fn = CASE_FUNCS[mode]
+
+    def apply(value):
+        # Upper-casing the JSON of a record would corrupt its keys; records need a field
+        if not isinstance(value, str):
+            raise TransformError(f"case {mode} applies to text; set field to transform a record")
+        return fn(value)
+    return apply
+
+
+def _compile_regex_replace(spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    pattern = spec.get("pattern")
+    if not pattern:
+        raise TransformError("regex_replace requires a pattern")
+    flags = 0
+    for flag in spec.get("flags", ""):
+        if flag not in REGEX_FLAGS:
+            raise TransformError(f"Unknown regex flag: {flag}")
+        flags |= REGEX_FLAGS[flag]
+    try:
+        compiled = re.compile(pattern, flags)
+    except re.error as e:
+        raise TransformError(f"Invalid regex {pattern!r}: {e}")
+    replacement = spec.get("replacement", "")
+    count = int(spec.get("count", 0))
+    return _on_field(lambda s: compiled.sub(replacement, s, count=count), spec.get("field"))
+
+
+def _compile_template(spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    template = spec.get("template")
+    if template is None:
+        raise TransformError("template requires a template string")
+    try:
+        # Parse once so malformed templates fail at compile time
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise TransformError(f"Invalid template: {e}")
+    for _, field_name, _, _ in parsed:
+        if field_name is None:
+            continue
+        # format_map only looks fields up by name; {}, {0}, {a[0]} and {a.b} would fail per record
+        if not field_name or field_name.isdigit() or any(c in field_name for c in ".[]"):
+            raise TransformError(f"Invalid template field {{{field_name}}}: only named fields are supported")
+
+    def render(value):
+        if isinstance(value, dict):
+            fields = _Missing(value)
+            fields.setdefault("value", value)
+        else:
+            fields = _Missing(value=value, content=value)
+        try:
+            return template.format_map(fields)
+        except (ValueError, TypeError) as e:
+            # e.g. a numeric format spec applied to a text field
+            raise TransformError(f"Template could not be rendered: {e}")
+    return render
+
+
+def _resolve_dotted(value: Any, path: str) -> Any:
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def _compile_extract(spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    fields = spec.get("fields")
+    if not fields:
+        raise TransformError("extract requires fields")
+    # Accept ["a", "b.c"] or {"out_name": "b.c"}
+    if isinstance(fields, list):
+        mapping = {f.split(".")[-1]: f for f in fields}
+    else:
+        mapping = dict(fields)
+
+    def extract(value):
+        if not isinstance(value, dict):
+            return {name: None for name in mapping}
+        return {name: _resolve_dotted(value, path) for name, path in mapping.items()}
+    return extract
+
+
+def compile_jsonpath(path: str) -> Callable[[Any], Any]:
+    """Compile a JSONPath subset: $, .key, ['key'] (backslash escapes), [index], [*] and .*"""
+    if not path.startswith("$"):
+        raise TransformError(f"JSON path must start with '$': {path}")
+    steps = []
+    pos = 1
+    while pos < len(path):
+        match = _JSONPATH_TOKEN.match(path, pos)
+        if not match:
+            raise TransformError(f"Unsupported JSON path syntax at {path[pos:]!r}")
+        key, bracket = match.group(1), match.group(2)
+        if key is not None:
+            steps.append(("key", key))
+        elif bracket is None or bracket == "*":
+            steps.append(("wildcard", None))
+        elif bracket.isdigit():
+            steps.append(("index", int(bracket)))
+        else:
+            steps.append(("key", _JSONPATH_ESCAPE.sub(r"\1", bracket[1:-1])))
+        pos = match.end()
+    wildcard = any(kind == "wildcard" for kind, _ in steps)
+
+    def resolve(value):
+        current = [value]
+        for kind, arg in steps:
+            nxt = []
+            for item in current:
+                if kind == "key":
+                    if isinstance(item, dict) and arg in item:
+                        nxt.append(item[arg])
+                elif kind == "index":
+                    if isinstance(item, list) and -len(item) <= arg < len(item):
+                        nxt.append(item[arg])
+                elif isinstance(item, dict):
+                    nxt.extend(item.values())
+                elif isinstance(item, list):
+                    nxt.extend(item)
+            current = nxt
+        if wildcard:
+            return current
+        return current[0] if current else None
+    return resolve
+
+
+def _compile_json_path(spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    path = spec.get("path")
+    if not path:
+        raise TransformError("json_path requires a path")
+    resolve = compile_jsonpath(path)
+
+    def apply(value):
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                return None
+        return resolve(value)
+    return apply
+
+
+def _dedupe_lines(text: str) -> str:
+    return "\n".join(dict.fromkeys(text.splitlines()))
+
+
+def _compile_dedupe_lines(spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    return _on_field(_dedupe_lines, spec.get("field"))
+
+
+OPERATIONS: Dict[str, Callable[[Dict[str, Any]], Callable[[Any], Any]]] = {
+    "case": _compile_case,
+    "regex_replace": _compile_regex_replace,
+    "template": _compile_template,
+    "extract": _compile_extract,
+    "json_path": _compile_json_path,
+    "dedupe_lines": _compile_dedupe_lines,
+}
+
+
+class TransformPipeline:
+    """A compiled chain of transform operations applied to batches of records"""
+
+    def __init__(self, steps: List[Callable[[Any], Any]], names: List[str], label: str):
+        self.steps = steps
+        self.names = names
+        # Reported as transform_type: the config's own type for single-op configs
+        self.label = label
+
+    def apply(self, value: Any) -> Any:
+        for step in self.steps:
+            value = step(value)
+        return value
+
+    def apply_batch(self, values: List[Any], checkpoint: Optional[Callable[[], None]] = None) -> List[Any]:
+        """Run each operation over the whole batch before moving to the next.
+
+        `checkpoint` is called between operations, e.g. to observe run cancellation.
+        """
+        for step in self.steps:
+            if checkpoint:
+                checkpoint()
+            values = list(map(step, values))
+        return values
+
+
+def _normalize_operations(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    operations = config.get("operations")
+    if operations:
+        return operations
+    # Fall back to the single-op configs used by existing workflows
+    legacy = config.get("type") or config.get("operation") or "uppercase"
+    if legacy in LEGACY_CASE_TYPES:
+        return [{"op": "case", "mode": LEGACY_CASE_TYPES[legacy]}]
+    if legacy in OPERATIONS:
+        return [dict(config, op=legacy)]
+    return []
+
+
+@lru_cache(maxsize=256)
+def _compile_cached(config_key: str) -> TransformPipeline:
+    config = json.loads(config_key)
+    steps, names = [], []
+    for spec in _normalize_operations(config):
+        op = spec.get("op")
+        if op not in OPERATIONS:
+            raise TransformError(f"Unknown transform operation: {op}")
+        steps.append(OPERATIONS[op](spec))
+        names.append(op)
+    if config.get("operations"):
+        label = ",".join(names)
+    else:
+        label = config.get("type") or config.get("operation") or "uppercase"
+    return TransformPipeline(steps, names, label)
+
+
+def compile_pipeline(config: Dict[str, Any]) -> TransformPipeline:
+    """Compile a node config into a pipeline, reusing earlier compilations of the same config"""
+    op_config = {k: v for k, v in config.items() if k != "items"}
+    return _compile_cached(json.dumps(op_config, sort_keys=True, default=str))
@@ -0,0 +1,78 @@
+import time
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+from src import shared_broker
+from src.shared_broker import PermanentError, RetryPolicy
+
+
+class FakeRuns:
+    def __init__(self):
+        self.updates = []
+
+    def update_one(self, query, update):
+        self.updates.append((query, update))
+        return SimpleNamespace(modified_count=1)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.removed = []
+        self.added = []
+
+    def zrem(self, key, member):
+        self.removed.append((key, member))
+        return 0
+
+    def zadd(self, key, mapping, xx=False):
+        self.added.append((key, mapping, xx))
+
+
+def message(actor_name, args, options):
+    return SimpleNamespace(actor_name=actor_name, args=args, options=options, message_id="m1")
+
+
+def abandon(monkeypatch, msg):
+    runs, finished = FakeRuns(), []
+    monkeypatch.setattr(shared_broker, "runs_collection", lambda: runs)
+    monkeypatch.setattr(shared_broker, "notify_run_finished", lambda run_id, status: finished.append((run_id, status)))
+    broker = SimpleNamespace(client=FakeRedis())
+    RetryPolicy().abandon(broker, msg, PermanentError("channel_not_found"))
+    return runs.updates, finished, broker.client.removed
+
+
+def test_dead_lettered_node_fails_node_and_run(monkeypatch):
+    run_id = str(ObjectId())
+    updates, finished, removed = abandon(monkeypatch, message(
+        "post_slack", (run_id, "n1", {}, {}), {"node_id": "n1", "tenant": "u1"}
+    ))
+    (query, update), = updates
+    assert query == {"_id": ObjectId(run_id), "status": {"$in": ["queued", "running"]}}
+    assert update["$set"]["status"] == "failed"
+    assert update["$set"]["node_status.n1"] == "failed"
+    assert update["$set"]["error"] == "channel_not_found"
+    assert finished == [(run_id, "failed")]
+    assert removed == [(shared_broker.TENANT_INFLIGHT_KEY.format("u1"), f"{run_id}:n1")]
+
+
+def test_other_actors_are_not_runs(monkeypatch):
+    updates, finished, removed = abandon(monkeypatch, message(
+        "drain_webhook_events", (str(ObjectId()),), {}
+    ))
+    assert updates == [] and finished == [] and removed == []
+
+
+def test_retry_keeps_tenant_slot_until_next_attempt(monkeypatch):
+    run_id, enqueued = str(ObjectId()), []
+    msg = SimpleNamespace(actor_name="post_slack", args=(run_id, "n1", {}, {}), message_id="m1",
+                          queue_name="io", options={"node_id": "n1", "tenant": "u1"})
+    actor = SimpleNamespace(options={"min_backoff": 60000, "max_backoff": 60000})
+    broker = SimpleNamespace(client=FakeRedis(), get_actor=lambda name: actor,
+                             enqueue=lambda message, delay: enqueued.append(delay))
+    monkeypatch.setattr(shared_broker, "compute_backoff", lambda retries, factor, max_backoff: (retries, max_backoff))
+    RetryPolicy().after_process_message(broker, msg, exception=ConnectionError("reset"))
+    (key, mapping, xx), = broker.client.added
+    assert key == shared_broker.TENANT_INFLIGHT_KEY.format("u1") and xx
+    assert mapping[f"{run_id}:n1"] >= time.time() + 59
+    assert enqueued == [60000]
@@ -0,0 +1,185 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from src.shared_broker import RetryPolicy, classify_exception
+from src.tasks import sheets_buffer
+from src.tasks.sheets_buffer import SheetsClient, SheetsPermanentError, SheetsTransientError
+
+
+class FakeSheets(BaseHTTPRequestHandler):
+    """values:append stand-in; `responses` holds canned (status, body) replies, else the rows are appended"""
+
+    requests = []
+    responses = []
+    next_row = 1
+    delay = 0
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(type(self).delay)
+        type(self).requests.append(payload["values"])
+        if type(self).responses:
+            status, body = type(self).responses.pop(0)
+        else:
+            rows = len(payload["values"])
+            first = type(self).next_row
+            type(self).next_row += rows
+            status, body = 200, {"updates": {"updatedRange": f"Sheet1!A{first}:C{first + rows - 1}"}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sheets(monkeypatch):
+    FakeSheets.requests = []
+    FakeSheets.responses = []
+    FakeSheets.next_row = 1
+    FakeSheets.delay = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSheets)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(sheets_buffer, "SHEETS_API_URL", f"http://127.0.0.1:{server.server_port}/")
+    monkeypatch.setattr(sheets_buffer, "SHEETS_FLUSH_INTERVAL", 0.05)
+    monkeypatch.setattr(sheets_buffer, "SHEETS_MAX_RETRIES", 1)
+    monkeypatch.setattr(sheets_buffer, "random", SimpleNamespace(random=lambda: 0))
+    monkeypatch.setattr(sheets_buffer, "parse_retry_after", lambda value: 0)
+    yield SheetsClient(SimpleNamespace(token=lambda: "token"))
+    server.shutdown()
+    server.server_close()
+
+
+class FakeMessage:
+    def __init__(self, actor_name="append_sheets", queue_name="actions"):
+        self.actor_name = actor_name
+        self.queue_name = queue_name
+        self.message_id = "m1"
+        self.args = ("run1", "node1", {}, {})
+        self.options = {}
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class FakeBroker:
+    def __init__(self):
+        self.enqueued = []
+
+    def get_actor(self, name):
+        return SimpleNamespace(options={})
+
+    def enqueue(self, message, delay=None):
+        self.enqueued.append((message, delay))
+
+
+def run_policy(exception):
+    policy = RetryPolicy()
+    dead = []
+    policy.dead_letter = lambda broker, message, exc, kind: dead.append(kind)
+    policy.abandon = lambda broker, message, exc: None
+    broker, message = FakeBroker(), FakeMessage()
+    policy.after_process_message(broker, message, exception=exception)
+    return message, dead, broker.enqueued
+
+
+def test_rows_are_appended(sheets):
+    result = sheets.append("sheet-id", "Sheet1", [["a", 1], ["b", 2]])
+    assert result["updatedRange"] == "Sheet1!A1:C2"
+    assert result["rows_added"] == 2
+    assert FakeSheets.requests == [[["a", 1], ["b", 2]]]
+
+
+def test_client_error_goes_straight_to_dead_letters(sheets):
+    FakeSheets.responses.append((403, {"error": {"message": "The caller does not have permission"}}))
+    with pytest.raises(SheetsPermanentError) as excinfo:
+        sheets.append("sheet-id", "Sheet1", [["a"]])
+    assert classify_exception(excinfo.value) == "permanent"
+
+    message, dead, enqueued = run_policy(excinfo.value)
+    assert message.failed and dead == ["permanent"] and enqueued == []
+    assert len(FakeSheets.requests) == 1
+
+
+def test_server_errors_are_transient(sheets):
+    FakeSheets.responses.extend([(503, {}), (503, {})])
+    with pytest.raises(SheetsTransientError) as excinfo:
+        sheets.append("sheet-id", "Sheet1", [["a"]])
+    assert classify_exception(excinfo.value) == "transient"
+
+    message, dead, enqueued = run_policy(excinfo.value)
+    assert not message.failed and dead == [] and len(enqueued) == 1
+
+
+def append_in_thread(client, rows, timeout=120):
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = client.append("sheet-id", "Sheet1", rows, timeout=timeout)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def test_concurrent_appends_share_one_request(sheets):
+    first, first_outcome = append_in_thread(sheets, [["a"]])
+    second, second_outcome = append_in_thread(sheets, [["b"], ["c"]])
+    first.join()
+    second.join()
+    assert FakeSheets.requests == [[["a"], ["b"], ["c"]]]
+    assert first_outcome["result"]["updatedRange"] == "Sheet1!A1:C1"
+    assert second_outcome["result"]["updatedRange"] == "Sheet1!A2:C3"
+
+
+def test_timed_out_waiter_is_withdrawn_before_the_flush(sheets, monkeypatch):
+    monkeypatch.setattr(sheets_buffer, "SHEETS_FLUSH_INTERVAL", 0.5)
+    leader, leader_outcome = append_in_thread(sheets, [["a"]])
+    time.sleep(0.05)
+    with pytest.raises(SheetsTransientError):
+        sheets.append("sheet-id", "Sheet1", [["late"]], timeout=0.1)
+    leader.join()
+    assert FakeSheets.requests == [[["a"]]]
+    assert leader_outcome["result"]["rows_added"] == 1
+
+
+def test_timed_out_waiter_waits_for_the_flush_that_took_its_rows(sheets):
+    FakeSheets.delay = 0.5
+    leader, leader_outcome = append_in_thread(sheets, [["a"]])
+    time.sleep(0.01)
+    result = sheets.append("sheet-id", "Sheet1", [["b"]], timeout=0.2)
+    leader.join()
+    assert FakeSheets.requests == [[["a"], ["b"]]]
+    assert result["updatedRange"] == "Sheet1!A2:C2"
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def test_interrupted_flush_fails_every_waiter(sheets, monkeypatch):
+    def interrupted(*args):
+        time.sleep(0.1)
+        raise Interrupted()
+
+    monkeypatch.setattr(sheets, "append_values", interrupted)
+    leader, leader_outcome = append_in_thread(sheets, [["a"]])
+    time.sleep(0.01)
+    with pytest.raises(SheetsTransientError):
+        sheets.append("sheet-id", "Sheet1", [["b"]])
+    leader.join()
+    assert isinstance(leader_outcome["error"], Interrupted)
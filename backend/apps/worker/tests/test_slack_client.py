@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.shared_broker import classify_exception
+from src.tasks import slack_client
+from src.tasks.slack_client import SlackClient, SlackPermanentError, SlackTransientError
+
+
+class FakeSlack(BaseHTTPRequestHandler):
+    """chat.postMessage stand-in; `responses` holds canned (status, headers, body) replies, else ok"""
+
+    requests = []
+    responses = []
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).requests.append((self.path, payload, self.headers.get("Authorization")))
+        if type(self).responses:
+            status, headers, body = type(self).responses.pop(0)
+        else:
+            status, headers, body = 200, {}, {"ok": True, "ts": f"{time.time():.6f}", "channel": payload["channel"]}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slack(monkeypatch):
+    FakeSlack.requests = []
+    FakeSlack.responses = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSlack)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(slack_client, "SLACK_CHANNEL_INTERVAL", 0.2)
+    monkeypatch.setattr(slack_client, "SLACK_MAX_PACING_WAIT", 1.0)
+    yield SlackClient("xoxb-test", base_url=f"http://127.0.0.1:{server.server_port}/api")
+    server.shutdown()
+    server.server_close()
+
+
+def test_posts_through_pooled_session(slack):
+    first = slack.post_message("#a", "hello", username="bot")
+    second = slack.post_message("#b", "world")
+    assert first["ok"] and second["ok"]
+    paths = [path for path, _, _ in FakeSlack.requests]
+    assert paths == ["/api/chat.postMessage", "/api/chat.postMessage"]
+    assert FakeSlack.requests[0][1] == {"channel": "#a", "text": "hello", "username": "bot"}
+    assert FakeSlack.requests[0][2] == "Bearer xoxb-test"
+
+
+@pytest.mark.parametrize("error", ["channel_not_found", "invalid_auth", "not_in_channel"])
+def test_api_error_is_permanent(slack, error):
+    FakeSlack.responses.append((200, {}, {"ok": False, "error": error}))
+    with pytest.raises(SlackPermanentError) as excinfo:
+        slack.post_message("#missing", "hello")
+    assert excinfo.value.error == error
+    assert excinfo.value.retry_after is None
+    assert classify_exception(excinfo.value) == "permanent"
+
+
+def test_http_client_error_is_permanent(slack):
+    FakeSlack.responses.append((404, {}, {}))
+    with pytest.raises(SlackPermanentError) as excinfo:
+        slack.post_message("#a", "hello")
+    assert classify_exception(excinfo.value) == "permanent"
+
+
+def test_server_error_is_transient(slack):
+    FakeSlack.responses.append((503, {"Retry-After": "7"}, {}))
+    with pytest.raises(SlackTransientError) as excinfo:
+        slack.post_message("#a", "hello")
+    assert excinfo.value.retry_after == 7
+    assert classify_exception(excinfo.value) == "transient"
+
+
+def test_transient_api_error_is_retried(slack):
+    FakeSlack.responses.append((200, {}, {"ok": False, "error": "internal_error"}))
+    with pytest.raises(SlackTransientError) as excinfo:
+        slack.post_message("#a", "hello")
+    assert classify_exception(excinfo.value) == "transient"
+
+
+def test_same_channel_is_paced(slack):
+    started = time.time()
+    slack.post_message("#a", "one")
+    slack.post_message("#a", "two")
+    assert time.time() - started >= 0.2
+
+
+def test_rate_limit_blocks_channel_without_waiting(slack):
+    FakeSlack.responses.append((429, {"Retry-After": "20"}, {"ok": False, "error": "ratelimited"}))
+    with pytest.raises(SlackTransientError) as excinfo:
+        slack.post_message("#hot", "one")
+    assert excinfo.value.retry_after == 20
+    assert classify_exception(excinfo.value) == "transient"
+
+    # The channel stays blocked: the next post fails fast with the remaining delay, without a request
+    started = time.time()
+    with pytest.raises(SlackTransientError) as excinfo:
+        slack.post_message("#hot", "two")
+    assert time.time() - started < 0.5
+    assert 15 < excinfo.value.retry_after <= 20
+    assert len(FakeSlack.requests) == 1
+
+    # Other channels are unaffected
+    assert slack.post_message("#cold", "three")["ok"]
+
+
+def test_hot_channel_does_not_park_threads(slack, monkeypatch):
+    monkeypatch.setattr(slack_client, "SLACK_CHANNEL_INTERVAL", 10)
+    slack.post_message("#hot", "one")
+    errors = []
+
+    def post():
+        try:
+            slack.post_message("#hot", "again")
+        except SlackTransientError as e:
+            errors.append(e)
+
+    started = time.time()
+    threads = [threading.Thread(target=post) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.time() - started < 1
+    assert len(errors) == 8 and all(e.retry_after > 1 for e in errors)
+
+
+def test_thread_window_threads_replies(slack):
+    parent = slack.post_message("#a", "parent", thread_window=60)
+    reply = slack.post_message("#a", "reply", thread_window=60)
+    assert parent["thread_ts"] is None
+    assert reply["thread_ts"] == parent["ts"]
+    assert FakeSlack.requests[1][1]["thread_ts"] == parent["ts"]
@@ -0,0 +1,109 @@
+import pytest
+
+from src.shared_broker import classify_exception
+from src.tasks.ai_tasks import transform_outputs
+from src.tasks.transform_engine import TransformError, compile_jsonpath, compile_pipeline
+
+
+def run(operations, value):
+    return compile_pipeline({"operations": operations}).apply(value)
+
+
+@pytest.mark.parametrize("legacy, expected", [
+    ("uppercase", "HELLO WORLD"),
+    ("lowercase", "hello world"),
+    ("title_case", "Hello World"),
+    ("reverse", "dlroW olleH"),
+    ("unknown", "Hello World"),
+])
+def test_legacy_types(legacy, expected):
+    outputs = transform_outputs({"type": legacy}, {"content": "Hello World"})
+    assert outputs["transformed_text"] == expected
+    assert outputs["transform_type"] == legacy
+
+
+def test_legacy_default_is_uppercase():
+    outputs = transform_outputs({}, {"content": "abc"})
+    assert outputs == {"transformed_text": "ABC", "original_text": "abc",
+                       "transform_type": "uppercase", "type": "text"}
+
+
+def test_operations_report_their_names():
+    config = {"operations": [{"op": "case", "mode": "lower"}, {"op": "dedupe_lines"}]}
+    assert transform_outputs(config, {"content": "A\na"})["transform_type"] == "case,dedupe_lines"
+
+
+def test_case_modes():
+    assert run([{"op": "case", "mode": "capitalize"}], "hello there") == "Hello there"
+    assert run([{"op": "case", "mode": "swapcase"}], "aB") == "Ab"
+    assert run([{"op": "case", "mode": "strip"}], "  x ") == "x"
+    with pytest.raises(TransformError):
+        compile_pipeline({"operations": [{"op": "case", "mode": "shout"}]})
+
+
+def test_case_on_field_leaves_other_fields():
+    record = {"name": "ada", "id": 7}
+    assert run([{"op": "case", "mode": "upper", "field": "name"}], record) == {"name": "ADA", "id": 7}
+    assert record == {"name": "ada", "id": 7}
+
+
+def test_case_without_field_rejects_records():
+    with pytest.raises(TransformError) as info:
+        run([{"op": "case", "mode": "upper"}], {"name": "ada"})
+    assert classify_exception(info.value) == "permanent"
+
+
+def test_regex_replace():
+    ops = [{"op": "regex_replace", "pattern": "a+", "replacement": "-", "flags": "i", "count": 1}]
+    assert run(ops, "xAAyaz") == "x-yaz"
+    with pytest.raises(TransformError):
+        compile_pipeline({"operations": [{"op": "regex_replace", "pattern": "("}]})
+    with pytest.raises(TransformError):
+        compile_pipeline({"operations": [{"op": "regex_replace", "pattern": "a", "flags": "q"}]})
+
+
+def test_template():
+    ops = [{"op": "template", "template": "{name} <{email}>{missing}"}]
+    assert run(ops, {"name": "Ada", "email": "ada@example.com"}) == "Ada <ada@example.com>"
+    assert run([{"op": "template", "template": "[{value}]"}], "x") == "[x]"
+    with pytest.raises(TransformError):
+        compile_pipeline({"operations": [{"op": "template", "template": "{0}"}]})
+    with pytest.raises(TransformError):
+        run([{"op": "template", "template": "{n:d}"}], {"n": "text"})
+
+
+def test_extract():
+    record = {"user": {"name": "Ada", "tags": ["a", "b"]}}
+    assert run([{"op": "extract", "fields": ["user.name", "user.tags.1"]}], record) == {"name": "Ada", "1": "b"}
+    assert run([{"op": "extract", "fields": {"who": "user.name"}}], "text") == {"who": None}
+
+
+def test_json_path():
+    doc = {"items": [{"sku": "A"}, {"sku": "B"}], "a b": 1}
+    assert compile_jsonpath("$.items[1].sku")(doc) == "B"
+    assert compile_jsonpath("$.items[*].sku")(doc) == ["A", "B"]
+    assert compile_jsonpath("$['a b']")(doc) == 1
+    assert compile_jsonpath("$['a\\'b\"c']")({"a'b\"c": 2}) == 2
+    assert run([{"op": "json_path", "path": "$.items[0].sku"}], '{"items": [{"sku": "A"}]}') == "A"
+    assert run([{"op": "json_path", "path": "$.x"}], "not json") is None
+    with pytest.raises(TransformError):
+        compile_jsonpath("items")
+
+
+def test_dedupe_lines():
+    assert run([{"op": "dedupe_lines"}], "a\nb\na\nc\nb") == "a\nb\nc"
+
+
+def test_unknown_operation():
+    with pytest.raises(TransformError):
+        compile_pipeline({"operations": [{"op": "shuffle"}]})
+
+
+def test_batch_runs_each_operation_over_every_item():
+    config = {"operations": [{"op": "case", "mode": "upper", "field": "name"},
+                             {"op": "extract", "fields": ["name"]}]}
+    calls = []
+    outputs = transform_outputs(config, {"items": [{"name": "a"}, {"name": "b"}]},
+                                checkpoint=lambda: calls.append(1))
+    assert outputs["items"] == [{"name": "A"}, {"name": "B"}]
+    assert outputs["count"] == 2 and len(calls) == 2
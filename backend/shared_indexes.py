@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+# Shared by the API (Database.connect_db), the worker (pool supervisor start) and the
+# scheduler. Every index the services rely on is declared here and applied idempotently at
+# startup. An index whose stored definition differs is only reported; changing it is a
+# migration (python -m src.shared_indexes --rebuild), never a side effect of a deploy.
+RUN_LOG_TTL = int(os.getenv("RUN_LOG_TTL", str(30 * 24 * 3600)))
+TEST_RUN_TTL = int(os.getenv("TEST_RUN_TTL", str(24 * 3600)))
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "runs": [
+        # GET /runs filters by owner and optionally workflow or status; pages are keyset on (created_at, _id)
+        IndexModel([("created_by", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="owner_created"),
+        IndexModel([("created_by", ASCENDING), ("workflow_id", ASCENDING), ("created_at", DESCENDING),
+                    ("_id", DESCENDING)], name="owner_workflow_created"),
+        IndexModel([("created_by", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING),
+                    ("_id", DESCENDING)], name="owner_status_created"),
+        # Batch progress is aggregated over the batch's runs
+        IndexModel([("batch_id", ASCENDING)], sparse=True, name="batch_id"),
+        # Scheduler sweep of overdue runs
+        IndexModel([("status", ASCENDING), ("deadline", ASCENDING)], name="status_deadline"),
+        # One run per schedule fire, whichever replica (or restart) gets there first
+        IndexModel([("schedule_fire_key", ASCENDING)], unique=True, name="schedule_fire_key_unique",
+                   partialFilterExpression={"schedule_fire_key": {"$type": "string"}}),
+        # Runs left behind by POST /nodes/test
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=TEST_RUN_TTL, name="test_runs_ttl",
+                   partialFilterExpression={"is_test": True}),
+    ],
+    "run_logs": [
+        IndexModel([("run_id", ASCENDING), ("timestamp", ASCENDING)], name="run_timestamp"),
+        IndexModel([("logged_at", ASCENDING)], expireAfterSeconds=RUN_LOG_TTL, name="logged_at_ttl"),
+    ],
+    "workflows": [
+        IndexModel([("created_by", ASCENDING), ("is_active", ASCENDING), ("updated_at", DESCENDING),
+                    ("_id", DESCENDING)], name="owner_active_updated"),
+    ],
+    "workflow_versions": [
+        # One immutable compiled snapshot per workflow version
+        IndexModel([("workflow_id", ASCENDING), ("version", ASCENDING)], unique=True, name="workflow_version_unique"),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "uploaded_files": [
+        IndexModel([("file_id", ASCENDING)], unique=True, name="file_id_unique"),
+        IndexModel([("uploaded_by", ASCENDING), ("uploaded_at", DESCENDING)], name="owner_uploaded"),
+        # Upload dedupe looks files up by content hash
+        IndexModel([("uploaded_by", ASCENDING), ("sha256", ASCENDING)], name="owner_sha256"),
+        IndexModel([("sha256", ASCENDING)], sparse=True, name="sha256"),
+    ],
+    "upload_sessions": [
+        IndexModel([("upload_id", ASCENDING)], unique=True, name="upload_id"),
+        # Abandoned upload sessions expire
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "url_fetches": [
+        IndexModel([("document_id", ASCENDING)], unique=True, name="document_id_unique"),
+    ],
+    "documents": [
+        IndexModel([("document_id", ASCENDING)], unique=True, sparse=True, name="document_id_unique"),
+    ],
+    "schedules": [
+        IndexModel([("enabled", ASCENDING)], name="enabled"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+        IndexModel([("workflow_id", ASCENDING)], name="workflow_id"),
+    ],
+    "action_ledger": [
+        IndexModel([("key", ASCENDING)], unique=True, name="key_unique"),
+    ],
+}
+
+# Hot queries that must be served by an index: (collection, filter, sort). Values only need
+# the right type; check_query_plans() explains each one against the live database.
+QUERY_SHAPES: List[Tuple[str, Dict[str, Any], Optional[List[Tuple[str, int]]]]] = [
+    ("runs", {"created_by": "u"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("runs", {"created_by": "u", "workflow_id": "w"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("runs", {"created_by": "u", "status": "running"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("runs", {"created_by": "u", "workflow_id": "w", "status": "running"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("runs", {"batch_id": "b"}, None),
+    ("runs", {"status": {"$in": ["queued", "running"]}, "deadline": {"$lt": 0}}, None),
+    ("run_logs", {"run_id": "r"}, [("timestamp", ASCENDING)]),
+    ("workflows", {"created_by": "u", "is_active": True}, [("updated_at", DESCENDING), ("_id", DESCENDING)]),
+    ("workflow_versions", {"workflow_id": "w", "version": 1}, None),
+    ("users", {"email": "e"}, None),
+    ("uploaded_files", {"uploaded_by": "u"}, [("uploaded_at", DESCENDING)]),
+    ("uploaded_files", {"uploaded_by": "u", "sha256": "s"}, None),
+    ("uploaded_files", {"file_id": "f"}, None),
+    ("upload_sessions", {"upload_id": "u"}, None),
+    ("url_fetches", {"document_id": "d"}, None),
+    ("schedules", {"enabled": True}, None),
+    ("schedules", {"updated_at": {"$gte": 0}}, None),
+    ("action_ledger", {"key": "k"}, None),
+]
+
+# IndexOptionsConflict, IndexKeySpecsConflict
+_CONFLICT_CODES = (85, 86)
+
+
+def apply_indexes(db, rebuild: bool = False) -> List[str]:
+    """Create every registered index on a pymongo database; returns the conflicting ones left as they are.
+
+    Indexes are created one at a time so a single failure (e.g. duplicate emails blocking a
+    unique index) is reported without holding back the rest. An existing index whose
+    definition differs is logged and kept: dropping it would leave its queries scanning
+    the collection until the rebuild finishes. With `rebuild` it is dropped and recreated.
+    """
+    conflicts = []
+    for collection, models in INDEXES.items():
+        for model in models:
+            name = model.document["name"]
+            try:
+                db[collection].create_indexes([model])
+            except OperationFailure as e:
+                if e.code not in _CONFLICT_CODES:
+                    print(f"[indexes] Failed to create {collection}.{name}: {e}")
+                    continue
+                if not rebuild:
+                    print(f"[indexes] {collection}.{name} differs from its declared definition; "
+                          f"run python -m src.shared_indexes --rebuild to migrate it")
+                    conflicts.append(f"{collection}.{name}")
+                    continue
+                print(f"[indexes] Rebuilding {collection}.{name} with its new definition")
+                try:
+                    db[collection].drop_index(name)
+                    db[collection].create_indexes([model])
+                except OperationFailure as e:
+                    print(f"[indexes] Failed to rebuild {collection}.{name}: {e}")
+                    conflicts.append(f"{collection}.{name}")
+    return conflicts
+
+
+def check_query_plans(db) -> List[str]:
+    """Registered queries whose winning plan scans the whole collection"""
+    scans = []
+    for collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in json.dumps(plan, default=str):
+            scans.append(f"{collection}.find({query}){f'.sort({sort})' if sort else ''}")
+    return scans
+
+
+if __name__ == "__main__":
+    # CI check: python -m src.shared_indexes  (exits 1 if an index conflicts or a registered
+    # query scans a collection); migration: python -m src.shared_indexes --rebuild
+    from pymongo import MongoClient
+    database = MongoClient(os.getenv("MONGO_URL", "mongodb://mongo:27017/aiwf")).get_default_database("aiwf")
+    conflicting = apply_indexes(database, rebuild="--rebuild" in sys.argv[1:])
+    collscans = check_query_plans(database)
+    for line in conflicting:
+        print(f"CONFLICT: {line}")
+    for line in collscans:
+        print(f"COLLSCAN: {line}")
+    sys.exit(1 if conflicting or collscans else 0)
@@ -0,0 +1,170 @@
+import os
+import time
+import smtplib
+import threading
+from contextlib import contextmanager
+from email.message import Message
+from typing import List, Optional, Dict, Any
+
+# Shared by the API (magic codes, /actions/email.send) and the worker (act.email)
+SMTP_HOST = os.getenv("SMTP_HOST", os.getenv("SMTP_SERVER", "smtp.gmail.com"))
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", os.getenv("SMTP_USER", ""))
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", os.getenv("SMTP_PASS", ""))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+# How long a sender waits for a free session before giving up
+SMTP_ACQUIRE_TIMEOUT = float(os.getenv("SMTP_ACQUIRE_TIMEOUT", "30"))
+# Connections idle longer than this are NOOP-checked before reuse
+SMTP_KEEPALIVE_CHECK = float(os.getenv("SMTP_KEEPALIVE_CHECK", "30"))
+SMTP_MAX_IDLE = float(os.getenv("SMTP_MAX_IDLE", "300"))
+# Most servers cap RCPT TO per transaction; larger lists are split across transactions
+SMTP_RECIPIENT_BATCH = int(os.getenv("SMTP_RECIPIENT_BATCH", "50"))
+
+
+class SMTPPoolExhausted(TimeoutError):
+    """Every pooled session stayed busy for the acquire timeout; worth retrying later"""
+
+
+class _PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.last_used = time.time()
+
+
+class SMTPPool:
+    """Bounded pool of logged-in SMTP sessions with NOOP health checks and reconnect-on-failure"""
+
+    def __init__(self, host: str, port: int, username: str = "", password: str = "",
+                 starttls: bool = True, size: int = 4, timeout: float = 30,
+                 acquire_timeout: float = SMTP_ACQUIRE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle: List[_PooledConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> _PooledConnection:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                # Never fall back to plaintext: a server (or a man in the middle) that does not
+                # offer STARTTLS raises SMTPNotSupportedError here, before any credentials are sent
+                smtp.starttls()
+                smtp.ehlo()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        return _PooledConnection(smtp)
+
+    @staticmethod
+    def _close(conn: _PooledConnection):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            try:
+                conn.smtp.close()
+            except Exception:
+                pass
+
+    def _healthy(self, conn: _PooledConnection) -> bool:
+        idle = time.time() - conn.last_used
+        if idle > SMTP_MAX_IDLE:
+            return False
+        if idle < SMTP_KEEPALIVE_CHECK:
+            return True
+        try:
+            return conn.smtp.noop()[0] == 250
+        except OSError:
+            # smtplib.SMTPException subclasses OSError
+            return False
+
+    def _checkout(self) -> _PooledConnection:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if self._healthy(conn):
+                return conn
+            self._close(conn)
+
+    def _checkin(self, conn: _PooledConnection):
+        conn.last_used = time.time()
+        with self._lock:
+            self._idle.append(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a session; it goes back to the pool unless the caller's block raised"""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise SMTPPoolExhausted(f"No SMTP session became free within {self.acquire_timeout:g}s")
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn.smtp
+        except Exception:
+            # The session state is unknown after a failure, so never hand it out again
+            if conn:
+                self._close(conn)
+                conn = None
+            raise
+        finally:
+            if conn:
+                self._checkin(conn)
+            self._slots.release()
+
+    def send_message(self, msg: Message, from_addr: str, recipients: List[str],
+                     batch_size: int = SMTP_RECIPIENT_BATCH) -> Dict[str, Any]:
+        """Send one message to all recipients over a single session, in RCPT batches"""
+        refused: Dict[str, Any] = {}
+        payload = msg.as_string()
+        sent = 0
+        for attempt in range(2):
+            try:
+                with self.connection() as smtp:
+                    while sent < len(recipients):
+                        batch = recipients[sent:sent + batch_size]
+                        refused.update(smtp.sendmail(from_addr, batch, payload))
+                        sent += len(batch)
+                break
+            except smtplib.SMTPServerDisconnected:
+                # A pooled session dropped between the health check and the send;
+                # resume from the unsent batch on a fresh session
+                if attempt:
+                    raise
+        return {"refused": refused, "batches": (len(recipients) + batch_size - 1) // batch_size}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+
+_pool: Optional[SMTPPool] = None
+_pool_lock = threading.Lock()
+
+
+def smtp_configured() -> bool:
+    return bool(SMTP_USERNAME and SMTP_PASSWORD) or os.getenv("SMTP_ALLOW_ANONYMOUS", "false").lower() == "true"
+
+
+def get_smtp_pool() -> SMTPPool:
+    """Return the process-wide SMTP pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPPool(
+                SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD,
+                starttls=SMTP_STARTTLS, size=SMTP_POOL_SIZE
+            )
+        return _pool
@@ -0,0 +1,215 @@
+import io
+import os
+import shutil
+import threading
+from typing import BinaryIO, Optional
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+# Shared by the API (uploads) and the worker (ingest.pdf). Files are addressed by key, e.g.
+# "blobs/<sha256>", never by path, so API and worker need not share a filesystem.
+#   STORAGE_BACKEND=local - STORAGE_ROOT on a volume mounted by every API and worker container
+#   STORAGE_BACKEND=s3    - S3 or any S3-compatible store (MinIO locally, see deploy/docker-compose.yml)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", os.path.join(os.getenv("UPLOAD_DIR", "/tmp/aiwf_uploads"), "store"))
+S3_BUCKET = os.getenv("S3_BUCKET", "aiwf-uploads")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. http://minio:9000
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+# Bytes fetched per ranged GET when a stored file is read through open()
+STORAGE_READ_BLOCK = int(os.getenv("STORAGE_READ_BLOCK", str(1024 * 1024)))
+
+
+class StorageBackend:
+    """Where uploaded files live. Keys are '/'-separated; backends decide the physical layout."""
+
+    def put_file(self, key: str, path: str):
+        """Move a local file into storage under `key`; keeps an existing object with that key"""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, key: str) -> int:
+        raise NotImplementedError
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        """Bytes [start, end) of the object"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of the object when the backend has one, else None"""
+        return None
+
+    def open(self, key: str) -> BinaryIO:
+        """Seekable binary reader that fetches ranges on demand, e.g. for PyPDF2"""
+        return io.BufferedReader(RangeReader(self, key), buffer_size=STORAGE_READ_BLOCK)
+
+
+class RangeReader(io.RawIOBase):
+    """Raw, seekable stream over a stored object; each read is one ranged fetch"""
+
+    def __init__(self, backend: StorageBackend, key: str):
+        self.backend = backend
+        self.key = key
+        self.length = backend.size(key)
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.length + offset
+        self.position = max(0, self.position)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.length:
+            return 0
+        end = min(self.position + len(buffer), self.length)
+        data = self.backend.read_range(self.key, self.position, end)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class LocalStorage(StorageBackend):
+    """Files under `root`, sharded by the first two byte pairs of the key's last segment.
+
+    blobs/3fa9c0... lives at <root>/blobs/3f/a9/3fa9c0..., which keeps directories small
+    at millions of files; content hashes spread evenly over the 65536 leaf directories.
+    """
+
+    def __init__(self, root: str = STORAGE_ROOT):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        prefix, _, name = key.rpartition("/")
+        if len(name) >= 4:
+            return os.path.join(self.root, prefix, name[:2], name[2:4], name)
+        return os.path.join(self.root, prefix, name)
+
+    def put_file(self, key: str, path: str):
+        dest = self._path(key)
+        if os.path.exists(dest):
+            os.remove(path)
+            return
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.replace(path, dest)
+        except OSError:
+            # Staging area on another filesystem
+            shutil.move(path, dest)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self._path(key))
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+    def open(self, key: str) -> BinaryIO:
+        # A real file is already seekable and buffered
+        return open(self._path(key), "rb")
+
+
+class S3Storage(StorageBackend):
+    """Objects in one bucket of S3 or an S3-compatible store such as MinIO"""
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: Optional[str] = S3_ENDPOINT_URL):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3")
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=S3_REGION,
+            aws_access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+            # Path-style addressing is what MinIO and most stand-ins serve
+            config=BotoConfig(s3={"addressing_style": "path"}, retries={"max_attempts": 5, "mode": "standard"}),
+        )
+        try:
+            self.client.head_bucket(Bucket=bucket)
+        except ClientError:
+            self.client.create_bucket(Bucket=bucket)
+
+    def put_file(self, key: str, path: str):
+        if not self.exists(key):
+            # Multipart for large files, handled by the transfer manager
+            self.client.upload_file(path, self.bucket, key)
+        os.remove(path)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def size(self, key: str) -> int:
+        return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+        return response["Body"].read()
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """The configured storage backend, created on first use"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND == "s3":
+                    _storage = S3Storage()
+                elif STORAGE_BACKEND == "local":
+                    _storage = LocalStorage()
+                else:
+                    raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _storage
+
+
+def blob_key(sha256: str) -> str:
+    return f"blobs/{sha256}"